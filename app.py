@@ -5,6 +5,12 @@ import plotly.graph_objects as go
 from datetime import datetime
 import sys
 import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 # Add the modules directory to the Python path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'modules'))
@@ -12,11 +18,33 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'modules'))
 # Import your custom modules
 try:
     import modules.sql_connector as sql
-    import modules.mysql_query_generator as query_gen
+    import modules.result_store as result_store
+    import modules.result_export as result_export
+    import modules.query_guard as query_guard
+    import modules.tracing as tracing
+    import modules.visualization as visualization
+    import modules.llm_scheduler as llm_scheduler
+    from modules.chatbot_engine import ChatbotEngine
 except ImportError as e:
     st.error(f"Error importing modules: {e}")
     st.stop()
 
+# Rows shown per page of a query result; further pages are fetched on demand
+RESULT_PAGE_SIZE = 500
+# Formats offered for exporting a full result
+EXPORT_FORMAT_LABELS = {"csv": "CSV", "csv.gz": "CSV (gzip)", "parquet": "Parquet"}
+# Newest chat messages rendered in full; older ones are collapsed into one-line summaries
+CHAT_WINDOW_SIZE = 10
+# Collapsed summaries shown above the window, and added per "Show earlier messages" click
+CHAT_SUMMARY_PAGE = 50
+# Seconds between checks on a query running in the background
+RUNNING_QUERY_POLL_SECONDS = 0.25
+# Exports running at once across all sessions
+EXPORT_WORKERS = 4
+# Directory Streamlit serves at app/static/ when server.enableStaticServing is on; exports go to its
+# exports/ subdirectory, so their downloads stream from disk instead of passing through memory
+STATIC_EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'exports')
+
 # Page configuration
 st.set_page_config(
     page_title="Database Chatbot",
@@ -95,8 +123,6 @@ if 'query_count' not in st.session_state:
     st.session_state.query_count = 0
 if 'db_connection' not in st.session_state:
     st.session_state.db_connection = {}
-if 'mysql_connection' not in st.session_state:
-    st.session_state.mysql_connection = None
 if 'available_databases' not in st.session_state:
     st.session_state.available_databases = []
 if 'available_tables' not in st.session_state:
@@ -105,38 +131,605 @@ if 'current_database' not in st.session_state:
     st.session_state.current_database = ""
 if 'last_selected_database' not in st.session_state:
     st.session_state.last_selected_database = ""
+if 'result_pagers' not in st.session_state:
+    st.session_state.result_pagers = {}
+if 'use_result_cache' not in st.session_state:
+    st.session_state.use_result_cache = False
+if 'result_store' not in st.session_state:
+    st.session_state.result_store = result_store.ResultStore()
+if 'pending_confirmations' not in st.session_state:
+    st.session_state.pending_confirmations = {}
+if 'message_artifacts' not in st.session_state:
+    st.session_state.message_artifacts = {}
+if 'expanded_messages' not in st.session_state:
+    st.session_state.expanded_messages = set()
+if 'chat_summary_limit' not in st.session_state:
+    st.session_state.chat_summary_limit = CHAT_SUMMARY_PAGE
+if 'exports' not in st.session_state:
+    st.session_state.exports = {}
+if 'running_query' not in st.session_state:
+    st.session_state.running_query = None
+if 'running_export' not in st.session_state:
+    st.session_state.running_export = None
 
-# Function to switch database
-def switch_database(new_database):
-    """Switch to a different database"""
-    try:
-        # Close existing connection
-        if st.session_state.mysql_connection:
-            sql.close_connection(st.session_state.mysql_connection)
+# Connection pool shared by every session that logs in with the same credentials
+@st.cache_resource(show_spinner=False)
+def get_connection_pool(host, username, password, port, replicas=""):
+    """Return the process-wide connection pool for a MySQL login (routing reads to any replicas)"""
+    return sql.create_pool(host, username, password, port=port, replicas=sql.parse_targets(replicas))
+
+def session_pool():
+    """Return the connection pool for the current session's login"""
+    db_info = st.session_state.db_connection
+    return get_connection_pool(
+        db_info['host'], db_info['username'], db_info['password'], int(db_info['port']), db_info.get('replicas', '')
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_chatbot_engine(host, username, password, port, replicas=""):
+    """Return the chatbot engine shared by every session using this login"""
+    return ChatbotEngine(get_connection_pool(host, username, password, port, replicas))
+
+@st.cache_resource(show_spinner=False)
+def get_export_executor():
+    """Return the process-wide thread pool exports run on, so they don't block a session's script run"""
+    return ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+
+def session_engine():
+    """Return the chatbot engine for the current session's login"""
+    db_info = st.session_state.db_connection
+    return get_chatbot_engine(
+        db_info['host'], db_info['username'], db_info['password'], int(db_info['port']), db_info.get('replicas', '')
+    )
+
+def browser_session():
+    """Return the id of the browser session running this script, which the LLM scheduler queues it under"""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+def session_gone(session):
+    """Return a check for whether a browser session has disconnected (tab closed or navigated away)"""
+    def gone():
+        return session is not None and runtime.exists() and not runtime.get_instance().is_active_session(session)
+    return gone
+
+def trace_table(trace, render_ms=None):
+    """Flatten a recorded trace into one row per span for display"""
+    rows = [{
+        "stage": span["name"] if span["parent"] is None else f"  └ {span['name']}",
+        "ms": span["duration_ms"],
+        "cpu ms": span["cpu_ms"],
+        "details": ", ".join(f"{key}={value}" for key, value in span["attributes"].items()),
+    } for span in trace["spans"]]
+    if render_ms is not None:
+        rows.append({"stage": "ui.render", "ms": round(render_ms, 3), "cpu ms": None, "details": ""})
+    rows.append({"stage": "total", "ms": trace["duration_ms"], "cpu ms": None, "details": ""})
+    return pd.DataFrame(rows)
+
+def assistant_message(response, message_id):
+    """Build the chat history entry for an engine response"""
+    database = response["database"]
+    message = {
+        "role": "assistant",
+        "id": message_id,
+        "sql": response["sql"],
+        "database_used": database,
+        "cache": response["generation"].get("cache"),
+        "similar_question": response["generation"].get("similar_question"),
+        "few_shot": response["generation"].get("few_shot"),
+        "guard": response["guard"],
+        "corrections": (response["validation"] or {}).get("corrections", []),
+        "trace": response["trace"].to_dict()
+    }
+    if response["status"] == "ok":
+        query_result = None
+        if response["data"] is not None:
+            query_result = st.session_state.result_store.put(response["data"])
+        if response["pager"] is not None:
+            st.session_state.result_pagers[message_id] = response["pager"]
         
-        # Create new connection with the selected database
-        connection = sql.create_connection(
-            st.session_state.db_connection['host'],
-            st.session_state.db_connection['username'],
-            st.session_state.db_connection['password'],
-            new_database
+        # Generate response content
+        if response["writes"] is not None:
+            statements = sum(write["statements"] for write in response["writes"])
+            rows = sum(max(write["rows"], 0) for write in response["writes"])
+            message["content"] = f"Executed {statements} statement(s) in one transaction on '{database}' database: {rows} row(s) affected."
+            message["writes"] = response["writes"]
+        elif response["has_more"]:
+            message["content"] = f"Here are the first {len(query_result)} result(s) for your query in the '{database}' database. More rows are available on demand:"
+        elif query_result is not None and len(query_result) > 0:
+            message["content"] = f"I found {len(query_result)} result(s) for your query in the '{database}' database. Here's what I found:"
+        else:
+            message["content"] = f"Query executed successfully on '{database}' database, but no results were returned."
+        message.update(data=query_result, has_more=response["has_more"], result_cache=response["result_cache"])
+        # Exports re-run the query as validated, without the cost guard's row cap and time limit
+        message["export_sql"] = (response["guard"] or {}).get("original") or response["sql"]
+    elif response["status"] == "needs_confirmation":
+        # Kept until the user runs it anyway or asks something else
+        st.session_state.pending_confirmations[message_id] = response
+        message["content"] = f"This query looks expensive ({response['guard']['reason']}). Run it anyway?"
+        message["needs_confirmation"] = True
+    elif response["status"] == "cancelled":
+        message["content"] = f"I stopped the query on the '{database}' database as you asked."
+    elif response["status"] == "timeout":
+        message["content"] = f"The query on the '{database}' database took too long, so I stopped it. Try narrowing your question."
+        message["error"] = response["error"]
+    elif response["status"] == "invalid":
+        message["content"] = f"The generated query doesn't match the '{database}' database, so I didn't run it. Please try rephrasing your request."
+        message["error"] = response["error"]
+    elif response["status"] == "refused":
+        message["content"] = f"I didn't run this query on the '{database}' database because it is too expensive ({response['guard']['reason']}). Try narrowing your question."
+        message["error"] = response["error"]
+    else:
+        # Query failed
+        message["content"] = f"I encountered an error while executing your query on the '{database}' database. Please check the SQL syntax or try rephrasing your request."
+        message["error"] = "Query execution failed"
+    return message
+
+def error_message(error):
+    """Build the chat history entry for a question that failed before it produced a response"""
+    return {
+        "role": "assistant",
+        "id": uuid.uuid4().hex,
+        "content": f"Sorry, there was an error processing your query on the '{st.session_state.current_database}' database: {error}",
+        "error": str(error),
+        "database_used": st.session_state.current_database
+    }
+
+def message_key(message, index):
+    """Stable id of a chat message (older error messages have none)"""
+    return message.get("id") or f"message_{index}"
+
+def message_artifacts(message, index):
+    """Display strings derived from a message, built once per message id"""
+    key = message_key(message, index)
+    artifacts = st.session_state.message_artifacts.get(key)
+    if artifacts is not None:
+        return artifacts
+    cache_caption = None
+    if message.get("cache") == "hit":
+        cache_caption = "⚡ SQL served from query cache"
+    elif message.get("cache") == "similar":
+        cache_caption = f"♻️ SQL reused from a similar earlier question: \"{message.get('similar_question')}\""
+    elif message.get("few_shot"):
+        cache_caption = f"🧠 SQL freshly generated with {message['few_shot']} similar earlier question(s) as examples"
+    elif "cache" in message:
+        cache_caption = "🧠 SQL freshly generated"
+    summary = message["content"]
+    if message.get("sql"):
+        first_line = message["sql"].strip().splitlines()[0]
+        summary += f" · `{first_line[:80]}{'…' if len(first_line) > 80 else ''}`"
+    if message.get("error"):
+        summary = f"❌ {summary}"
+    artifacts = {
+        "summary": summary,
+        "cache_caption": cache_caption,
+        "fixes": ", ".join(f"{fix['from']} → {fix['to']}" for fix in message.get("corrections") or []),
+        "cost_summary": query_guard.describe_cost(message["guard"]) if message.get("guard") else "",
+        "file_name": f"query_results_{message.get('database_used', st.session_state.current_database)}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{index}.csv",
+    }
+    st.session_state.message_artifacts[key] = artifacts
+    return artifacts
+
+def reset_chat_view():
+    """Forget the per-message render state and export files when the chat history is cleared"""
+    cancel_running_query()
+    cancel_running_export()
+    for export in st.session_state.exports.values():
+        if "path" in export:
+            result_export.remove_export(export)
+    st.session_state.exports = {}
+    st.session_state.message_artifacts = {}
+    st.session_state.expanded_messages = set()
+    st.session_state.chat_summary_limit = CHAT_SUMMARY_PAGE
+
+def sync_server_catalog(pool, max_age=None):
+    """Copy the shared database list of a login into the session; False if it couldn't be loaded"""
+    catalog = sql.get_server_catalog(pool, max_age=max_age)
+    if catalog is None:
+        return False
+    st.session_state.available_databases = catalog["databases"]
+    st.session_state.available_tables = catalog["tables"].get(st.session_state.current_database, [])
+    return True
+
+def start_query(response, message_id, confirmed=False):
+    """Run a prepared response's query in the background, so the chat can offer cancelling it"""
+    control = sql.QueryControl(session_pool())
+    future = session_engine().submit_execute(
+        response,
+        page_size=RESULT_PAGE_SIZE,
+        use_result_cache=st.session_state.use_result_cache,
+        confirmed=confirmed,
+        control=control
+    )
+    st.session_state.running_query = {
+        "id": message_id,
+        "sql": response["sql"],
+        "database": response["database"],
+        "future": future,
+        "control": control,
+        "started": time.monotonic(),
+    }
+
+def cancel_running_query():
+    """Stop the query running in the background, if any, and drop its result"""
+    running = st.session_state.get('running_query')
+    if running is None:
+        return
+    running["control"].cancel()
+    # A result that arrives anyway must not keep its pager's connection checked out
+    running["future"].add_done_callback(
+        lambda future: future.result()["pager"] and future.result()["pager"].close()
+    )
+    st.session_state.running_query = None
+
+def render_running_query():
+    """Show the running query with a Cancel button, then add its answer to the chat once it finishes"""
+    running = st.session_state.running_query
+    control = running["control"]
+    with st.chat_message("assistant"):
+        if running["sql"]:
+            st.code(running["sql"], language='sql')
+        if st.button("⏹️ Cancel query", key=f"cancel_btn_{running['id']}", disabled=control.reason is not None):
+            control.cancel()
+        status = st.empty()
+        # Each update yields to Streamlit, so a click on Cancel interrupts this loop and reruns
+        while not running["future"].done():
+            elapsed = time.monotonic() - running["started"]
+            if control.reason == "cancelled":
+                status.caption("⏹️ Cancelling...")
+            else:
+                status.caption(f"⏳ Running on '{running['database']}' for {elapsed:.0f} s (stopped after {control.timeout:g} s)")
+            time.sleep(RUNNING_QUERY_POLL_SECONDS)
+    
+    st.session_state.running_query = None
+    response = running["future"].result()
+    if response["status"] == "error":
+        message = error_message(response["error"])
+    else:
+        message = assistant_message(response, running["id"])
+    # A confirmed query replaces the message that asked for confirmation
+    history = st.session_state.chat_history
+    index = next((i for i, entry in enumerate(history) if entry.get("id") == running["id"]), None)
+    if index is None:
+        history.append(message)
+    else:
+        history[index] = message
+        st.session_state.message_artifacts.pop(running["id"], None)
+    st.rerun()
+
+def close_result_pagers():
+    """Release the pooled connections held by open result pagers"""
+    for pager in st.session_state.get('result_pagers', {}).values():
+        pager.close()
+    st.session_state.result_pagers = {}
+
+def static_exports():
+    """Whether exports can be served from disk by Streamlit's static file serving"""
+    return bool(st.get_option("server.enableStaticServing"))
+
+def start_export(message, export_format):
+    """Export a message's full result in the background, so the chat can offer cancelling it"""
+    control = sql.QueryControl(session_pool(), timeout=result_export.EXPORT_TIMEOUT)
+    progress = {"rows": 0, "bytes": 0}
+    gone = session_gone(browser_session())
+
+    def on_progress(rows, size):
+        progress.update(rows=rows, bytes=size)
+        # Nobody is left to download it
+        if gone():
+            control.cancel()
+
+    future = get_export_executor().submit(
+        result_export.export_query,
+        session_pool(),
+        message["database_used"],
+        message["export_sql"],
+        export_format,
+        on_progress=on_progress,
+        control=control,
+        directory=STATIC_EXPORT_DIR if static_exports() else None
+    )
+    st.session_state.running_export = {
+        "id": message["id"],
+        "future": future,
+        "control": control,
+        "progress": progress,
+        "started": time.monotonic(),
+    }
+
+def cancel_running_export():
+    """Stop the export running in the background, if any, and delete its file"""
+    running = st.session_state.get('running_export')
+    if running is None:
+        return
+    running["control"].cancel()
+    running["future"].add_done_callback(
+        lambda future: future.result() and result_export.remove_export(future.result())
+    )
+    st.session_state.running_export = None
+
+def render_running_export():
+    """Show the running export with a Cancel button, then offer its download once it finishes"""
+    running = st.session_state.running_export
+    control = running["control"]
+    with st.chat_message("assistant"):
+        if st.button("⏹️ Cancel export", key=f"cancel_export_btn_{running['id']}", disabled=control.reason is not None):
+            control.cancel()
+        status = st.empty()
+        # Each update yields to Streamlit, so a click on Cancel interrupts this loop and reruns
+        while not running["future"].done():
+            elapsed = time.monotonic() - running["started"]
+            if control.reason == "cancelled":
+                status.caption("⏹️ Cancelling export...")
+            else:
+                status.caption(
+                    f"📤 Exported {running['progress']['rows']:,} rows ({running['progress']['bytes'] / 1e6:.1f} MB) "
+                    f"in {elapsed:.0f} s (stopped after {control.timeout:g} s)"
+                )
+            time.sleep(RUNNING_QUERY_POLL_SECONDS)
+    
+    st.session_state.running_export = None
+    export = running["future"].result()
+    if export is not None:
+        st.session_state.exports[running["id"]] = export
+    elif control.reason == "timeout":
+        st.session_state.exports[running["id"]] = {"error": f"Export stopped after the {control.timeout:g} s time limit."}
+    elif control.reason != "cancelled":
+        st.session_state.exports[running["id"]] = {"error": "Export failed. The query may no longer run on this database."}
+    st.rerun()
+
+def render_export(message):
+    """Offer the full result of a message as a file streamed to disk, not held in the session.
+
+    With server.enableStaticServing the file is downloaded from disk through
+    a link; otherwise through st.download_button, which holds the file in
+    memory while it is served, so exports larger than
+    result_export.EXPORT_MAX_MEMORY_DOWNLOAD_BYTES are not offered that way.
+    """
+    export = st.session_state.exports.get(message["id"])
+    if export is not None and "error" in export:
+        st.error(export["error"])
+        st.session_state.exports.pop(message["id"])
+    elif export is not None and os.path.exists(export["path"]):
+        label = f"⬇️ Download full export ({export['rows']:,} rows, {export['bytes'] / 1e6:.1f} MB)"
+        if export["truncated"]:
+            st.caption(f"Export stopped at {result_export.EXPORT_MAX_BYTES / 1e6:.0f} MB; narrow the query to export the rest.")
+        if os.path.dirname(export["path"]) == STATIC_EXPORT_DIR and static_exports():
+            url = f"app/static/exports/{os.path.basename(export['path'])}"
+            st.markdown(
+                f'<a href="{escape(url)}" download="{escape(export["file_name"])}">{escape(label)}</a>',
+                unsafe_allow_html=True
+            )
+        elif export["bytes"] <= result_export.EXPORT_MAX_MEMORY_DOWNLOAD_BYTES:
+            st.download_button(
+                label=label,
+                data=lambda: result_export.read_export(export),
+                file_name=export["file_name"],
+                mime=export["mime"],
+                key=f"export_download_btn_{message['id']}"
+            )
+        else:
+            st.warning(
+                f"The export is {export['bytes'] / 1e6:.1f} MB, more than the "
+                f"{result_export.EXPORT_MAX_MEMORY_DOWNLOAD_BYTES / 1e6:.0f} MB that can be downloaded through the "
+                "browser session. Enable server.enableStaticServing to download it from disk."
+            )
+        return
+    if st.session_state.running_export is not None and st.session_state.running_export["id"] == message["id"]:
+        st.caption("📤 Exporting the full result (see below)...")
+        return
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        export_format = st.selectbox(
+            "Export format",
+            list(EXPORT_FORMAT_LABELS),
+            format_func=EXPORT_FORMAT_LABELS.get,
+            key=f"export_format_{message['id']}",
+            label_visibility="collapsed"
         )
-        
-        if connection:
-            st.session_state.mysql_connection = connection
-            st.session_state.current_database = new_database
-            st.session_state.db_connection['database'] = new_database
-            
-            # Fetch tables for the new database
-            tables_info = sql.fetch_all_tables(connection)
-            if tables_info:
-                st.session_state.available_tables = [list(table)[0] for table in tables_info]
+    with col2:
+        if st.button("📤 Export full result", key=f"export_btn_{message['id']}",
+                     disabled=st.session_state.running_export is not None):
+            # The export runs in the background; the next run shows its progress with a Cancel button
+            start_export(message, export_format)
+            st.rerun()
+
+def result_is_partial(message):
+    """Whether only part of a message's result was fetched (more pages, or capped by the cost guard)"""
+    if message.get("has_more"):
+        return True
+    row_limit = (message.get("guard") or {}).get("row_limit")
+    return bool(row_limit) and len(message["data"]) >= row_limit
+
+def chart_figure(chart, data):
+    """Plotly figure for data prepared by the visualization module"""
+    if chart["kind"] == "line":
+        return px.line(data, x=chart["x"], y="value", color="series", title=chart["title"])
+    if chart["kind"] == "bar":
+        return px.bar(data, x=chart["x"], y="value", title=chart["title"])
+    return px.scatter(data, x=chart["x"], y=chart["y"][0], title=chart["title"])
+
+def render_chart(message, artifacts):
+    """Chart a result within the point budget; nothing is computed until the chart is switched on"""
+    if not st.toggle("📈 Chart", key=f"chart_toggle_{message['id']}"):
+        return
+    result = message["data"]
+    if artifacts.get("charts_rows") != len(result):
+        artifacts["charts"] = visualization.suggest_charts(result.to_pandas())
+        artifacts["charts_rows"] = len(result)
+        artifacts["chart_data"] = {}
+    charts = artifacts["charts"]
+    if not charts:
+        st.caption("No chart fits these columns.")
+        return
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        choice = st.selectbox(
+            "Chart",
+            range(len(charts)),
+            format_func=lambda index: charts[index]["title"],
+            key=f"chart_choice_{message['id']}",
+            label_visibility="collapsed"
+        )
+    chart = dict(charts[choice])
+    if chart["agg"] is not None:
+        with col2:
+            chart["agg"] = st.selectbox(
+                "Aggregate",
+                visualization.CHART_AGGREGATES if chart["y"] else ("count",),
+                index=visualization.CHART_AGGREGATES.index(chart["agg"]) if chart["y"] else 0,
+                key=f"chart_agg_{message['id']}_{choice}",
+                label_visibility="collapsed"
+            )
+    
+    # Partial results are aggregated by MySQL over the full result; complete ones in memory
+    pushdown = result_is_partial(message) and bool(message.get("export_sql"))
+    cache_key = (choice, chart["agg"], pushdown)
+    data = artifacts["chart_data"].get(cache_key)
+    if data is None:
+        with st.spinner("Preparing chart..."):
+            if pushdown:
+                data = visualization.pushdown_chart(
+                    session_pool(), message["database_used"], message["export_sql"], chart
+                )
             else:
-                st.session_state.available_tables = []
+                data = visualization.prepare_chart(chart, result.to_pandas())
+        if data is None:
+            st.error("Couldn't aggregate the full result for this chart.")
+            return
+        artifacts["chart_data"][cache_key] = data
+    st.plotly_chart(chart_figure(chart, data), use_container_width=True, key=f"chart_{message['id']}")
+    source = "aggregated in MySQL over the full result" if pushdown else f"from {len(result):,} loaded rows"
+    st.caption(f"{len(data):,} points, {source}")
+
+@st.fragment
+def render_assistant_message(i, message):
+    """Render an assistant message in full.
+
+    As a fragment, its own buttons (loading more rows, downloads) rerun only
+    this message instead of the whole chat history.
+    """
+    artifacts = message_artifacts(message, i)
+    st.write(message["content"])
+    
+    # Show which database was used for this query
+    if "database_used" in message:
+        st.caption(f"🎯 Query executed on database: **{message['database_used']}**")
+    
+    # Show whether the SQL came from the query cache
+    if artifacts["cache_caption"]:
+        st.caption(artifacts["cache_caption"])
+    
+    # Show whether the rows came from the result cache
+    if message.get("result_cache") == "hit":
+        st.caption("📦 Results served from result cache")
+    
+    # Show SQL query if available
+    if "sql" in message:
+        with st.expander("Generated SQL Query"):
+            st.code(message["sql"], language='sql')
+    
+    # Show identifiers that were fixed against the schema before running
+    if artifacts["fixes"]:
+        st.caption(f"🔧 Corrected against the schema: {artifacts['fixes']}")
+    
+    # Show the cost guard's estimate (and the actual cost once executed)
+    if artifacts["cost_summary"]:
+        st.caption(f"🛡️ {artifacts['cost_summary']}")
+    
+    # Over-budget queries only run once confirmed
+    if message.get("needs_confirmation"):
+        pending = st.session_state.pending_confirmations.get(message["id"])
+        if pending is not None and st.button("⚠️ Run anyway", key=f"confirm_btn_{i}",
+                                             disabled=st.session_state.running_query is not None):
+            close_result_pagers()
+            st.session_state.pending_confirmations.pop(message["id"], None)
+            start_query(pending, message["id"], confirmed=True)
+            st.rerun()
+        elif pending is None:
+            st.caption("This confirmation has expired. Ask the question again to run it.")
+    
+    # Show the affected rows of each statement a write ran as
+    if message.get("writes"):
+        with st.expander(f"Statements executed ({len(message['writes'])})"):
+            st.dataframe(
+                pd.DataFrame(message["writes"]).rename(
+                    columns={"sql": "SQL", "statements": "Statements", "rows": "Rows affected"}
+                ),
+                use_container_width=True,
+                hide_index=True,
+            )
+            if any(write["statements"] > 1 for write in message["writes"]):
+                st.caption("Batched statements report the combined rows affected by the statements they stand for.")
+    
+    # Show data if available
+    if "data" in message and message["data"] is not None:
+        result = message["data"]
+        if len(result) > 0:
+            # Results are stored once as Arrow tables, so nothing is rebuilt on rerun
+            with tracing.span("ui.render", rows=len(result), bytes=result.nbytes) as render_span:
+                st.dataframe(result.table(), use_container_width=True)
+            message["render_ms"] = render_span.duration_ms
             
-            return True
+            # Further pages are only fetched when asked for
+            if message.get("has_more"):
+                pager = st.session_state.result_pagers.get(message.get("id"))
+                if pager is not None and not pager.closed:
+                    if st.button(f"Load next {pager.page_size} rows", key=f"more_btn_{i}"):
+                        try:
+                            st.session_state.result_store.append(result, pager.fetch_page())
+                            message["has_more"] = not pager.exhausted
+                        except Exception as e:
+                            message["has_more"] = False
+                            st.error(f"Error fetching more rows: {e}")
+                        if pager.closed:
+                            st.session_state.result_pagers.pop(message["id"], None)
+                        st.rerun(scope="fragment")
+                else:
+                    st.caption(f"Showing the first {len(result)} rows. Ask again to page through the full result.")
+            
+            # Add download button with unique key; the CSV is only built when clicked
+            st.download_button(
+                label="Download Results as CSV",
+                data=result.to_csv,
+                file_name=artifacts["file_name"],
+                mime="text/csv",
+                key=f"download_btn_{i}"
+            )
+            if message.get("export_sql"):
+                render_export(message)
+            if message.get("id"):
+                render_chart(message, artifacts)
         else:
+            st.info("Query executed successfully, but no results returned.")
+    
+    # Show error if available
+    if "error" in message:
+        st.error(f"Error: {message['error']}")
+    
+    # Show where the time went for this answer
+    if "trace" in message:
+        with st.expander(f"⏱️ Timings ({message['trace']['duration_ms'] / 1000:.2f} s)"):
+            if "trace_table" not in artifacts:
+                artifacts["trace_table"] = trace_table(message["trace"], message.get("render_ms"))
+            st.dataframe(artifacts["trace_table"], use_container_width=True, hide_index=True)
+
+# Function to switch database
+def switch_database(new_database):
+    """Switch to a different database"""
+    try:
+        catalog = sql.get_server_catalog(session_pool())
+        if catalog is None or new_database not in catalog["tables"]:
+            st.error(f"Database '{new_database}' is not available")
             return False
+        
+        # Table names come from the shared database list, so switching needs no round trip
+        st.session_state.current_database = new_database
+        st.session_state.db_connection['database'] = new_database
+        st.session_state.available_tables = catalog["tables"][new_database]
+        # Evaluate the new database's schema prompt prefix before the first question
+        session_engine().warm_up(new_database)
+        return True
     except Exception as e:
         st.error(f"Error switching database: {e}")
         return False
@@ -158,6 +751,12 @@ def login_page():
         username = st.text_input("Username", placeholder="Enter your username", value="root")
         password = st.text_input("Password", type="password", placeholder="Enter your password")
         database = st.text_input("Initial Database", placeholder="Enter database name", value="classicmodels")
+        replicas = st.text_input(
+            "Read Replicas (optional)",
+            placeholder="replica1:3306, replica2:3306",
+            value=os.environ.get("DB_CHATBOT_REPLICAS", ""),
+            help="Questions that only read are spread across these servers; writes and reads right after a write go to the host above."
+        )
         
         st.info("💡 Don't worry! You can switch between databases after connecting.")
         
@@ -178,44 +777,32 @@ def login_page():
                     'password': password,
                     'database': database,
                     'port': '3306',
+                    'replicas': replicas,
                     'db_type': 'MySQL'
                 }
                 
                 # Test actual database connection
                 with st.spinner("Connecting to MySQL server..."):
                     try:
-                        # First, connect to the specified database
-                        connection = sql.create_connection(host, username, password, database)
+                        # First, check out a pooled connection to the specified database
+                        pool = get_connection_pool(host, username, password, 3306, replicas)
+                        connection = pool.acquire(database)
                         
                         if connection:
-                            st.session_state.mysql_connection = connection
+                            pool.release(connection)
                             st.session_state.current_database = database
                             st.session_state.logged_in = True
                             
-                            # Fetch all available databases on the server
-                            try:
-                                # Connect to information_schema or mysql database to get all databases
-                                temp_conn = sql.create_connection(host, username, password, 'information_schema')
-                                if temp_conn:
-                                    databases_info = sql.fetch_database_info(temp_conn)
-                                    if databases_info is not None:
-                                        # Filter out system databases if needed
-                                        all_dbs = databases_info['Database'].tolist()
-                                        # Remove system databases that users typically shouldn't access
-                                        system_dbs = ['information_schema', 'mysql', 'performance_schema', 'sys']
-                                        user_dbs = [db for db in all_dbs if db not in system_dbs]
-                                        st.session_state.available_databases = user_dbs if user_dbs else all_dbs
-                                    sql.close_connection(temp_conn)
-                                
-                                # Fetch tables for the current database
-                                tables_info = sql.fetch_all_tables(connection)
-                                if tables_info:
-                                    st.session_state.available_tables = [list(table)[0] for table in tables_info]
-                            except Exception as e:
-                                st.warning(f"Connected but couldn't fetch all database info: {e}")
+                            # Databases and their tables are loaded once per login, shared by
+                            # its sessions and refreshed in the background
+                            if not sync_server_catalog(pool):
+                                st.warning("Connected but couldn't fetch all database info")
                                 # Fallback: at least add the current database
                                 st.session_state.available_databases = [database]
                             
+                            # Load the model and the schema prompt prefix while the chat page renders
+                            get_chatbot_engine(host, username, password, 3306, replicas).warm_up(database)
+                            
                             st.success("✅ Successfully connected to MySQL server!")
                             st.balloons()
                             st.rerun()
@@ -251,6 +838,11 @@ def login_page():
 
 # Main Application Page
 def main_page():
+    # Expose /metrics when DB_CHATBOT_METRICS_PORT is set (started once per process)
+    tracing.start_metrics_server()
+    # Pick up the background refreshes of the database list (read from memory)
+    sync_server_catalog(session_pool())
+    
     # Sidebar with database info and settings
     with st.sidebar:
         # Database connection info
@@ -296,7 +888,10 @@ def main_page():
                             st.success(f"✅ Switched to database: {selected_database}")
                             # Clear chat history when switching databases
                             if st.checkbox("Clear chat history when switching", value=True):
+                                close_result_pagers()
+                                st.session_state.result_store.clear()
                                 st.session_state.chat_history = []
+                                reset_chat_view()
                                 st.session_state.query_count = 0
                             st.rerun()
                         else:
@@ -325,37 +920,25 @@ def main_page():
         with col1:
             if st.button("🔄 Refresh", use_container_width=True):
                 try:
-                    connection = st.session_state.mysql_connection
-                    if connection:
-                        # Refresh available databases
-                        temp_conn = sql.create_connection(
-                            st.session_state.db_connection['host'],
-                            st.session_state.db_connection['username'],
-                            st.session_state.db_connection['password'],
-                            'information_schema'
-                        )
-                        if temp_conn:
-                            databases_info = sql.fetch_database_info(temp_conn)
-                            if databases_info is not None:
-                                all_dbs = databases_info['Database'].tolist()
-                                system_dbs = ['information_schema', 'mysql', 'performance_schema', 'sys']
-                                user_dbs = [db for db in all_dbs if db not in system_dbs]
-                                st.session_state.available_databases = user_dbs if user_dbs else all_dbs
-                            sql.close_connection(temp_conn)
-                        
-                        # Refresh tables for current database
-                        tables_info = sql.fetch_all_tables(connection)
-                        if tables_info:
-                            st.session_state.available_tables = [list(table)[0] for table in tables_info]
-                        
-                        st.success("Refreshed!")
-                        st.rerun()
+                    # Reload the shared database list now instead of waiting for the background refresh
+                    sync_server_catalog(session_pool(), max_age=0)
+                    with session_pool().connection(st.session_state.current_database, read=True) as connection:
+                        # Re-check the current database's schema catalog, reloading
+                        # it only if its fingerprint changed
+                        sql.get_schema_catalog(connection, max_age=0)
+                    
+                    st.success("Refreshed!")
+                    st.rerun()
                 except Exception as e:
                     st.error(f"Error refreshing: {e}")
         
         with col2:
             if st.button("🗑️ Clear Chat", use_container_width=True):
+                close_result_pagers()
+                st.session_state.pending_confirmations = {}
+                st.session_state.result_store.clear()
                 st.session_state.chat_history = []
+                reset_chat_view()
                 st.session_state.query_count = 0
                 st.success("Chat cleared!")
                 st.rerun()
@@ -364,13 +947,53 @@ def main_page():
         
         # Session management
         st.subheader("🔧 Session")
+        with st.expander("Connection Pool"):
+            pool_stats = session_pool().stats()
+            st.write(f"**Connections:** {pool_stats['in_use']} in use, {pool_stats['idle']} idle (max {pool_stats['max_size']})")
+            st.write(f"**Checkouts:** {pool_stats['checkouts']} ({pool_stats['waits']} waited, {pool_stats['timeouts']} timed out)")
+            st.write(f"**Wait time:** avg {pool_stats['avg_wait_seconds'] * 1000:.1f} ms, max {pool_stats['max_wait_seconds'] * 1000:.1f} ms")
+            st.write(f"**Created / recycled:** {pool_stats['created']} / {pool_stats['recycled']}")
+            for replica in pool_stats.get("replicas", []):
+                state = f"{replica['lag']:.0f} s behind" if replica["healthy"] else f"out of rotation ({replica['error']})"
+                st.write(f"**Replica {replica['target']}:** {state}, {replica['in_use']} in use")
+            if "replicas" in pool_stats:
+                st.write(f"**Reads:** {pool_stats['replica_reads']} on replicas, {pool_stats['primary_reads']} on the primary")
+        with st.expander("LLM Queue"):
+            # Shared by every session of this server process
+            llm_stats = llm_scheduler.get_scheduler().stats()
+            st.write(f"**Generating:** {llm_stats['running']} of {llm_stats['max_concurrency']} slots, {llm_stats['queue_depth']} waiting from {llm_stats['waiting_sessions']} session(s)")
+            st.write(f"**Wait time:** p50 {llm_stats['wait_p50_seconds'] * 1000:.0f} ms, p95 {llm_stats['wait_p95_seconds'] * 1000:.0f} ms, max {llm_stats['wait_max_seconds'] * 1000:.0f} ms")
+            st.write(f"**Requests:** {llm_stats['submitted']} generated, {llm_stats['coalesced']} shared an identical one, {llm_stats['shed']} shed, {llm_stats['rejected']} turned away")
+        st.session_state.use_result_cache = st.checkbox(
+            "Cache read query results",
+            value=st.session_state.use_result_cache,
+            help="Serve repeated SELECTs from memory until a write or UPDATE_TIME change touches their tables."
+        )
+        if st.session_state.use_result_cache:
+            with st.expander("Result Cache"):
+                cache_stats = sql.result_cache.get_result_cache().stats()
+                st.write(f"**Entries:** {cache_stats['entries']} ({cache_stats['bytes'] / 1024 / 1024:.1f} of {cache_stats['memory_budget'] / 1024 / 1024:.0f} MB)")
+                st.write(f"**Hits / misses:** {cache_stats['hits']} / {cache_stats['misses']}")
+        with st.expander("⏱️ Performance"):
+            # Latency per stage across every session of this server process
+            stage_summary = tracing.get_metrics().summary()
+            if stage_summary:
+                st.dataframe(pd.DataFrame.from_dict(stage_summary, orient="index").round(1), use_container_width=True)
+                st.download_button(
+                    label="Download Prometheus metrics",
+                    data=tracing.get_metrics().render_prometheus,
+                    file_name="db_chatbot_metrics.prom",
+                    mime="text/plain",
+                    key="metrics_download_btn"
+                )
+            else:
+                st.caption("No questions answered yet.")
         if st.button("🚪 Disconnect", use_container_width=True):
-            # Close the database connection
-            if st.session_state.mysql_connection:
-                try:
-                    sql.close_connection(st.session_state.mysql_connection)
-                except:
-                    pass
+            # Pooled connections are shared with other sessions, so only this
+            # session's result pagers are released before resetting its state
+            close_result_pagers()
+            st.session_state.result_store.clear()
+            reset_chat_view()
             
             # Reset session state
             for key in list(st.session_state.keys()):
@@ -402,107 +1025,100 @@ def main_page():
     # Main chat interface
     st.subheader("💬 Chat Interface")
     
-    # Display chat history
-    for i, message in enumerate(st.session_state.chat_history):
+    # Display chat history: the newest messages in full, older ones as one-line summaries
+    history = st.session_state.chat_history
+    window_start = max(len(history) - CHAT_WINDOW_SIZE, 0)
+    summary_start = max(window_start - st.session_state.chat_summary_limit, 0)
+    if summary_start > 0:
+        if st.button(f"⬆️ Show {min(summary_start, CHAT_SUMMARY_PAGE)} earlier message(s)", key="show_earlier_btn"):
+            st.session_state.chat_summary_limit += CHAT_SUMMARY_PAGE
+            st.rerun()
+    running = st.session_state.running_query
+    for i in range(summary_start, len(history)):
+        message = history[i]
+        key = message_key(message, i)
+        if running is not None and message.get("id") == running["id"]:
+            # Shown below while it runs
+            continue
         with st.chat_message(message["role"]):
             if message["role"] == "user":
                 st.write(message["content"])
-            else:  # assistant
-                st.write(message["content"])
-                
-                # Show which database was used for this query
-                if "database_used" in message:
-                    st.caption(f"🎯 Query executed on database: **{message['database_used']}**")
-                
-                # Show SQL query if available
-                if "sql" in message:
-                    with st.expander("Generated SQL Query"):
-                        st.code(message["sql"], language='sql')
-                
-                # Show data if available
-                if "data" in message and message["data"] is not None:
-                    if isinstance(message["data"], list) and len(message["data"]) > 0:
-                        df = pd.DataFrame(message["data"])
-                        st.dataframe(df, use_container_width=True)
-                        
-                        # Add download button with unique key
-                        csv = df.to_csv(index=False)
-                        st.download_button(
-                            label="Download Results as CSV",
-                            data=csv,
-                            file_name=f"query_results_{st.session_state.current_database}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{i}.csv",
-                            mime="text/csv",
-                            key=f"download_btn_{i}"
-                        )
-                    elif isinstance(message["data"], list) and len(message["data"]) == 0:
-                        st.info("Query executed successfully, but no results returned.")
-                
-                # Show error if available
-                if "error" in message:
-                    st.error(f"Error: {message['error']}")
+            elif i >= window_start:
+                render_assistant_message(i, message)
+            elif key in st.session_state.expanded_messages:
+                if st.button("Hide details", key=f"collapse_btn_{key}"):
+                    st.session_state.expanded_messages.discard(key)
+                    st.rerun()
+                render_assistant_message(i, message)
+            else:
+                st.caption(message_artifacts(message, i)["summary"])
+                if st.button("Show details", key=f"expand_btn_{key}"):
+                    st.session_state.expanded_messages.add(key)
+                    st.rerun()
+    
+    running_slot = st.container()
+    export_slot = st.container()
     
     # Chat input
-    user_input = st.chat_input(f"Ask me anything about the '{st.session_state.current_database}' database...")
+    user_input = st.chat_input(
+        f"Ask me anything about the '{st.session_state.current_database}' database...",
+        disabled=running is not None
+    )
+    
+    # The answer in progress, with a Cancel button while its query runs
+    if running is not None:
+        with running_slot:
+            render_running_query()
     
     if user_input:
         # Add user message to chat history
         st.session_state.chat_history.append({
             "role": "user",
+            "id": uuid.uuid4().hex,
             "content": user_input
         })
         
+        # Show the question right away and stream the SQL into the reply as it is generated
+        with st.chat_message("user"):
+            st.write(user_input)
+        with st.chat_message("assistant"):
+            sql_placeholder = st.empty()
+        
         # Process the query using your backend modules
         with st.spinner("Processing your query..."):
             try:
-                connection = st.session_state.mysql_connection
-                
-                if not connection:
-                    st.error("Database connection lost. Please reconnect.")
-                    return
+                # Only the newest result keeps a pager (and its pooled connection) open
+                close_result_pagers()
+                st.session_state.pending_confirmations = {}
+                message_id = uuid.uuid4().hex
                 
-                # Generate SQL query using your AI module
-                generated_sql = query_gen.generate_mysql_query(user_input,connection)
+                session = browser_session()
+                response = session_engine().prepare(
+                    user_input,
+                    st.session_state.current_database,
+                    on_update=lambda partial_sql: sql_placeholder.code(partial_sql, language='sql'),
+                    session=session,
+                    abandoned=session_gone(session),
+                )
                 
-                # Execute the query
-                query_result = sql.execute_query(connection, generated_sql)
+                if response["status"] == "error":
+                    raise RuntimeError(response["error"])
                 
-                if query_result is not None:
-                    # Generate response content
-                    if len(query_result) > 0:
-                        response_content = f"I found {len(query_result)} result(s) for your query in the '{st.session_state.current_database}' database. Here's what I found:"
-                    else:
-                        response_content = f"Query executed successfully on '{st.session_state.current_database}' database, but no results were returned."
-                    
-                    # Add assistant response to chat history
-                    st.session_state.chat_history.append({
-                        "role": "assistant",
-                        "content": response_content,
-                        "sql": generated_sql,
-                        "data": query_result,
-                        "database_used": st.session_state.current_database
-                    })
-                else:
-                    # Query failed
-                    st.session_state.chat_history.append({
-                        "role": "assistant",
-                        "content": f"I encountered an error while executing your query on the '{st.session_state.current_database}' database. Please check the SQL syntax or try rephrasing your request.",
-                        "sql": generated_sql,
-                        "error": "Query execution failed",
-                        "database_used": st.session_state.current_database
-                    })
+                # The query runs in the background; the next run shows it with a Cancel button
+                start_query(response, message_id)
                 
                 st.session_state.query_count += 1
                 st.rerun()  # Refresh to show the new messages
                 
             except Exception as e:
                 # Add error message to chat history
-                st.session_state.chat_history.append({
-                    "role": "assistant",
-                    "content": f"Sorry, there was an error processing your query on the '{st.session_state.current_database}' database: {str(e)}",
-                    "error": str(e),
-                    "database_used": st.session_state.current_database
-                })
+                st.session_state.chat_history.append(error_message(e))
                 st.rerun()
+    
+    # The export in progress, with a Cancel button; polled last so the chat input stays usable meanwhile
+    if st.session_state.running_export is not None:
+        with export_slot:
+            render_running_export()
 
 # Main app logic
 if not st.session_state.logged_in:
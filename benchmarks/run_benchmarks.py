@@ -0,0 +1,288 @@
+"""Benchmark schema lookup, generation and execution against local stand-ins.
+
+Runs without a real Ollama or MySQL server: a fake Ollama HTTP server and a
+SQLite-backed MySQL stand-in (see standins.py) are started in-process and
+loaded with classicmodels plus synthetic schemas. Pass --mysql-host to
+benchmark a real MySQL server that already has the classicmodels database.
+
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --quick --baseline bench.json
+
+Results (latency percentiles per stage, throughput per concurrency level and
+peak memory) are written as JSON. With --baseline the run is compared with an
+earlier result file and exits non-zero when a latency regresses by more than
+--tolerance.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "modules"))
+
+from standins import FakeOllamaServer, StandInMySQLServer, synthetic_schema  # noqa: E402
+
+
+def percentiles(samples):
+    """Summarize latency samples (seconds) as milliseconds."""
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples) * 1000
+    return {
+        "count": int(values.size),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+class MemoryPeak:
+    """Context manager recording the peak traced Python allocation in bytes."""
+
+    def __enter__(self):
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, *exc):
+        self.peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+
+def bench_schema(sql, schema_index, query_gen, pool, databases, repeats, server=None):
+    """Catalog load, fingerprint check, index build and prompt size per schema."""
+    results = {}
+    question = "show the first 10 rows from customers with their payments"
+    for database in databases:
+        cold, warm, select = [], [], []
+        round_trips = None
+        with MemoryPeak() as memory:
+            for _ in range(repeats):
+                with pool.connection(database) as connection:
+                    sql.invalidate_schema_catalog(connection)
+                    started_trips = server.round_trips if server is not None else 0
+                    started = time.perf_counter()
+                    catalog = sql.get_schema_catalog(connection, max_age=0)
+                    cold.append(time.perf_counter() - started)
+                    if server is not None:
+                        round_trips = server.round_trips - started_trips
+
+                    started = time.perf_counter()
+                    sql.get_schema_catalog(connection, max_age=0)
+                    warm.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                schema_index.select_tables(catalog, question)
+                select.append(time.perf_counter() - started)
+
+        messages = query_gen.build_messages(question, catalog)
+        results[database] = {
+            "tables": len(catalog["tables"]),
+            "catalog_load": percentiles(cold),
+            "catalog_load_round_trips": round_trips,
+            "fingerprint_check": percentiles(warm),
+            "table_selection_cold": percentiles(select[:1]),
+            "prompt_chars": sum(len(message["content"]) for message in messages),
+            "peak_memory_bytes": memory.peak_bytes,
+        }
+    return results
+
+
+def bench_results(sql, pool, database, table, sizes):
+    """Fetch-all versus chunked server-side reads for growing result sizes."""
+    results = {}
+    for size in sizes:
+        query = f"SELECT * FROM {table} LIMIT {size}"
+        with pool.connection(database) as connection:
+            with MemoryPeak() as fetchall_memory:
+                started = time.perf_counter()
+                rows = sql.execute_query(connection, query, use_cache=False)
+                fetchall_seconds = time.perf_counter() - started
+            row_count = len(rows or [])
+            del rows
+
+            with MemoryPeak() as chunked_memory:
+                started = time.perf_counter()
+                chunked_rows = sum(len(chunk) for chunk in sql.iter_query_chunks(connection, query))
+                chunked_seconds = time.perf_counter() - started
+
+        results[str(size)] = {
+            "rows": row_count,
+            "fetchall_ms": fetchall_seconds * 1000,
+            "fetchall_peak_memory_bytes": fetchall_memory.peak_bytes,
+            "chunked_rows": chunked_rows,
+            "chunked_ms": chunked_seconds * 1000,
+            "chunked_peak_memory_bytes": chunked_memory.peak_bytes,
+        }
+    return results
+
+
+def bench_concurrency(engine, database, tables, user_counts, questions_per_user):
+    """End-to-end latency per stage and throughput with N concurrent users."""
+    results = {}
+    run = 0
+    for users in user_counts:
+        run += 1
+        responses = []
+        lock = threading.Lock()
+
+        def user_session(user):
+            for i in range(questions_per_user):
+                # Unique row counts keep every question out of the generation cache
+                question = f"show the first {run * 100000 + user * 1000 + i + 1} rows from {tables[i % len(tables)]}"
+                started = time.perf_counter()
+                response = engine.submit(question, database, max_rows=1000, session=f"user-{user}").result()
+                response["timings"]["total"] = time.perf_counter() - started
+                with lock:
+                    responses.append(response)
+
+        threads = [threading.Thread(target=user_session, args=(user,)) for user in range(users)]
+        with MemoryPeak() as memory:
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        stages = {}
+        for response in responses:
+            for stage, seconds in response["timings"].items():
+                stages.setdefault(stage, []).append(seconds)
+        results[str(users)] = {
+            "requests": len(responses),
+            "errors": sum(1 for response in responses if response["status"] != "ok"),
+            "throughput_rps": len(responses) / elapsed if elapsed else 0.0,
+            "stages": {stage: percentiles(samples) for stage, samples in stages.items()},
+            "peak_memory_bytes": memory.peak_bytes,
+        }
+    return results
+
+
+def compare(current, baseline, tolerance, path=""):
+    """Yield (metric path, baseline, current) for latencies that regressed beyond tolerance."""
+    for key, value in current.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        if old is None:
+            continue
+        metric = f"{path}.{key}" if path else key
+        if isinstance(value, dict):
+            yield from compare(value, old, tolerance, metric)
+        elif key.endswith("_ms") and key.startswith(("p50", "p95")) and old > 0 and value > old * (1 + tolerance):
+            yield metric, old, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative p50/p95 slowdown")
+    parser.add_argument("--quick", action="store_true", help="small sizes for a fast smoke run")
+    parser.add_argument("--schemas", default="100,1000", help="synthetic schema sizes in tables")
+    parser.add_argument("--rows", default="1000,10000,100000", help="result sizes in rows")
+    parser.add_argument("--users", default="1,4,16", help="concurrent user counts")
+    parser.add_argument("--questions-per-user", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--db-latency-ms", type=float, default=1.0, help="stand-in MySQL round-trip latency")
+    parser.add_argument("--connect-ms", type=float, default=20.0, help="stand-in MySQL connect/auth latency")
+    parser.add_argument("--first-token-ms", type=float, default=50.0)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--prefill-ms-per-1k-chars", type=float, default=5.0)
+    parser.add_argument("--llm-workers", type=int, default=2)
+    parser.add_argument("--mysql-host", help="benchmark a real MySQL server instead of the stand-in")
+    parser.add_argument("--mysql-user", default="root")
+    parser.add_argument("--mysql-password", default="")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.schemas, args.rows, args.users = "100", "1000,10000", "1,4"
+        args.questions_per_user, args.repeats = 3, 2
+    schema_sizes = [int(size) for size in args.schemas.split(",") if size]
+    row_sizes = [int(size) for size in args.rows.split(",") if size]
+    user_counts = [int(users) for users in args.users.split(",") if users]
+
+    workdir = tempfile.mkdtemp(prefix="db_chatbot_bench_")
+    ollama_server = FakeOllamaServer(
+        first_token_ms=args.first_token_ms,
+        tokens_per_second=args.tokens_per_second,
+        prefill_ms_per_1k_chars=args.prefill_ms_per_1k_chars,
+    ).start()
+    # The ollama client and the caches read these when they are imported
+    os.environ["OLLAMA_HOST"] = ollama_server.url
+    os.environ["DB_CHATBOT_QUERY_CACHE"] = os.path.join(workdir, "query_cache.sqlite3")
+    os.environ["DB_CHATBOT_QUESTION_INDEX"] = os.path.join(workdir, "question_index")
+
+    import sql_connector as sql
+    import schema_index
+    import mysql_query_generator as query_gen
+    import llm_scheduler
+    from chatbot_engine import ChatbotEngine
+
+    databases = ["classicmodels"]
+    if args.mysql_host:
+        pool = sql.ConnectionPool(args.mysql_host, args.mysql_user, args.mysql_password)
+        server = None
+    else:
+        server = StandInMySQLServer(os.path.join(workdir, "mysql"), round_trip_ms=args.db_latency_ms,
+                                    connect_ms=args.connect_ms)
+        server.add_classicmodels()
+        server.add_classicmodels("classicmodels_large", scale=max(1, max(row_sizes) // 2996 + 1))
+        for size in schema_sizes:
+            tables, foreign_keys = synthetic_schema(size)
+            server.add_database(f"synthetic_{size}", tables, foreign_keys, default_rows=5)
+            databases.append(f"synthetic_{size}")
+        pool = sql.ConnectionPool("standin", "bench", "", max_size=32, connection_factory=server.connect)
+
+    engine = ChatbotEngine(pool, db_workers=16, llm_workers=args.llm_workers)
+    large_database = "classicmodels" if args.mysql_host else "classicmodels_large"
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "mysql_password"},
+        "schema": bench_schema(sql, schema_index, query_gen, pool, databases, args.repeats, server),
+        "results": bench_results(sql, pool, large_database, "orderdetails", row_sizes),
+        "concurrency": bench_concurrency(
+            engine, "classicmodels", ["customers", "payments", "orders", "products"],
+            user_counts, args.questions_per_user,
+        ),
+        "pool": pool.stats(),
+        "llm_scheduler": llm_scheduler.get_scheduler().stats(),
+        "fake_ollama": dict(ollama_server.stats),
+        "stand_in_mysql": None if server is None else {
+            "round_trips": server.round_trips, "connections_opened": server.connections_opened,
+        },
+        "process_peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+    engine.shutdown()
+    pool.close_all()
+    ollama_server.stop()
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        regressions = list(compare(report, baseline, args.tolerance))
+        for metric, old, new in regressions:
+            print(f"REGRESSION {metric}: {old:.2f} ms -> {new:.2f} ms", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,623 @@
+"""Local stand-ins for the Ollama and MySQL servers used by the benchmarks.
+
+FakeOllamaServer speaks enough of the Ollama HTTP API (/api/chat,
+/api/generate) for the ``ollama`` client, with configurable prefill cost,
+time to first token and token rate. StandInMySQLServer hands out
+pymysql-compatible connections backed by SQLite files and emulates the
+information_schema queries sql_connector issues, with an optional
+per-round-trip latency; ``replica`` gives a read replica of it with a
+configurable replication lag.
+"""
+import datetime
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pymysql
+
+# Tables and columns of the classicmodels sample database: (column, MySQL type, key)
+CLASSICMODELS_TABLES = {
+    "productlines": [
+        ("productLine", "varchar(50)", "PRI"), ("textDescription", "varchar(4000)", ""),
+        ("htmlDescription", "mediumtext", ""), ("image", "mediumblob", ""),
+    ],
+    "products": [
+        ("productCode", "varchar(15)", "PRI"), ("productName", "varchar(70)", ""),
+        ("productLine", "varchar(50)", "MUL"), ("productScale", "varchar(10)", ""),
+        ("productVendor", "varchar(50)", ""), ("productDescription", "text", ""),
+        ("quantityInStock", "smallint", ""), ("buyPrice", "decimal(10,2)", ""), ("MSRP", "decimal(10,2)", ""),
+    ],
+    "offices": [
+        ("officeCode", "varchar(10)", "PRI"), ("city", "varchar(50)", ""), ("phone", "varchar(50)", ""),
+        ("addressLine1", "varchar(50)", ""), ("addressLine2", "varchar(50)", ""), ("state", "varchar(50)", ""),
+        ("country", "varchar(50)", ""), ("postalCode", "varchar(15)", ""), ("territory", "varchar(10)", ""),
+    ],
+    "employees": [
+        ("employeeNumber", "int", "PRI"), ("lastName", "varchar(50)", ""), ("firstName", "varchar(50)", ""),
+        ("extension", "varchar(10)", ""), ("email", "varchar(100)", ""), ("officeCode", "varchar(10)", "MUL"),
+        ("reportsTo", "int", "MUL"), ("jobTitle", "varchar(50)", ""),
+    ],
+    "customers": [
+        ("customerNumber", "int", "PRI"), ("customerName", "varchar(50)", ""),
+        ("contactLastName", "varchar(50)", ""), ("contactFirstName", "varchar(50)", ""),
+        ("phone", "varchar(50)", ""), ("addressLine1", "varchar(50)", ""), ("addressLine2", "varchar(50)", ""),
+        ("city", "varchar(50)", ""), ("state", "varchar(50)", ""), ("postalCode", "varchar(15)", ""),
+        ("country", "varchar(50)", ""), ("salesRepEmployeeNumber", "int", "MUL"),
+        ("creditLimit", "decimal(10,2)", ""),
+    ],
+    "payments": [
+        ("customerNumber", "int", "PRI"), ("checkNumber", "varchar(50)", "PRI"),
+        ("paymentDate", "date", ""), ("amount", "decimal(10,2)", ""),
+    ],
+    "orders": [
+        ("orderNumber", "int", "PRI"), ("orderDate", "date", ""), ("requiredDate", "date", ""),
+        ("shippedDate", "date", ""), ("status", "varchar(15)", ""), ("comments", "text", ""),
+        ("customerNumber", "int", "MUL"),
+    ],
+    "orderdetails": [
+        ("orderNumber", "int", "PRI"), ("productCode", "varchar(15)", "PRI"),
+        ("quantityOrdered", "int", ""), ("priceEach", "decimal(10,2)", ""), ("orderLineNumber", "smallint", ""),
+    ],
+}
+
+# (table, column, referenced table, referenced column)
+CLASSICMODELS_FOREIGN_KEYS = [
+    ("products", "productLine", "productlines", "productLine"),
+    ("employees", "officeCode", "offices", "officeCode"),
+    ("employees", "reportsTo", "employees", "employeeNumber"),
+    ("customers", "salesRepEmployeeNumber", "employees", "employeeNumber"),
+    ("payments", "customerNumber", "customers", "customerNumber"),
+    ("orders", "customerNumber", "customers", "customerNumber"),
+    ("orderdetails", "orderNumber", "orders", "orderNumber"),
+    ("orderdetails", "productCode", "products", "productCode"),
+]
+
+# Row counts of the real classicmodels database
+CLASSICMODELS_ROWS = {
+    "productlines": 7, "products": 110, "offices": 7, "employees": 23,
+    "customers": 122, "payments": 273, "orders": 326, "orderdetails": 2996,
+}
+
+_WORDS = ["alpha", "bravo", "delta", "north", "south", "classic", "vintage", "motor", "ship", "train"]
+
+
+def _fake_value(mysql_type, row, rng):
+    if mysql_type.startswith(("int", "smallint")):
+        return row + 1
+    if mysql_type.startswith("decimal"):
+        return round(rng.uniform(1, 10000), 2)
+    if mysql_type == "date":
+        return (datetime.date(2003, 1, 1) + datetime.timedelta(days=row % 1000)).isoformat()
+    if "blob" in mysql_type:
+        return None
+    return f"{rng.choice(_WORDS)} {row}"
+
+
+def fake_rows(columns, count, seed=0):
+    """Generate ``count`` deterministic rows for a table definition."""
+    rng = random.Random(seed)
+    for row in range(count):
+        yield tuple(_fake_value(mysql_type, row, rng) for _, mysql_type, _ in columns)
+
+
+def synthetic_schema(table_count, seed=0):
+    """Build a synthetic schema of ``table_count`` linked tables.
+
+    Returns (tables, foreign_keys) in the same shape as CLASSICMODELS_TABLES
+    and CLASSICMODELS_FOREIGN_KEYS.
+    """
+    rng = random.Random(seed)
+    nouns = ["account", "invoice", "shipment", "supplier", "warehouse", "region", "campaign",
+             "ticket", "contract", "asset", "vendor", "budget", "project", "employee", "device"]
+    tables = {}
+    foreign_keys = []
+    for i in range(table_count):
+        name = f"{nouns[i % len(nouns)]}_{i:04d}"
+        columns = [("id", "int", "PRI"), ("name", "varchar(100)", ""), ("created_at", "date", "")]
+        for k in range(rng.randint(3, 9)):
+            columns.append((f"{rng.choice(nouns)}_{rng.choice(['amount', 'status', 'code', 'note'])}_{k}",
+                            rng.choice(["int", "decimal(10,2)", "varchar(50)", "date"]), ""))
+        if i:
+            parent = list(tables)[rng.randrange(i)]
+            columns.append((f"{parent}_id", "int", "MUL"))
+            foreign_keys.append((name, f"{parent}_id", parent, "id"))
+        tables[name] = columns
+    return tables, foreign_keys
+
+
+def _sqlite_type(mysql_type):
+    if mysql_type.startswith(("int", "smallint")):
+        return "INTEGER"
+    if mysql_type.startswith("decimal"):
+        return "REAL"
+    if "blob" in mysql_type:
+        return "BLOB"
+    return "TEXT"
+
+
+class StandInMySQLServer:
+    """A MySQL stand-in: one SQLite file per database plus emulated information_schema."""
+
+    def __init__(self, root_dir, round_trip_ms=0.0, connect_ms=0.0):
+        self.root_dir = root_dir
+        self.round_trip_ms = round_trip_ms
+        self.connect_ms = connect_ms
+        self.databases = {}
+        self.round_trips = 0
+        self.connections_opened = 0
+        self.connections = {}
+        # Seconds_Behind_Source reported by SHOW REPLICA STATUS; None for a server that isn't a replica
+        self.replica_lag = None
+        self._lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def add_database(self, name, tables, foreign_keys=(), row_counts=None, default_rows=10):
+        """Create a database from table definitions and fill it with fake rows."""
+        path = os.path.join(self.root_dir, f"{name}.sqlite3")
+        if os.path.exists(path):
+            os.remove(path)
+        db = sqlite3.connect(path)
+        db.execute("PRAGMA journal_mode=WAL")
+        created = datetime.datetime(2024, 1, 1)
+        for table, columns in tables.items():
+            column_sql = ", ".join(f'"{column}" {_sqlite_type(mysql_type)}' for column, mysql_type, _ in columns)
+            db.execute(f'CREATE TABLE "{table}" ({column_sql})')
+            count = (row_counts or {}).get(table, default_rows)
+            placeholders = ", ".join("?" * len(columns))
+            db.executemany(f'INSERT INTO "{table}" VALUES ({placeholders})', fake_rows(columns, count))
+        db.commit()
+        db.close()
+        self.databases[name] = {
+            "path": path,
+            "tables": tables,
+            "foreign_keys": list(foreign_keys),
+            "create_time": {table: created for table in tables},
+            "update_time": {table: None for table in tables},
+        }
+
+    def add_classicmodels(self, name="classicmodels", scale=1):
+        """Add a classicmodels database, optionally with ``scale`` times the rows."""
+        rows = {table: count * scale for table, count in CLASSICMODELS_ROWS.items()}
+        self.add_database(name, CLASSICMODELS_TABLES, CLASSICMODELS_FOREIGN_KEYS, rows)
+
+    def replica(self, lag=0.0):
+        """A read replica of this server: same databases and files, reporting ``lag`` seconds of lag."""
+        replica = StandInMySQLServer(self.root_dir, round_trip_ms=self.round_trip_ms, connect_ms=self.connect_ms)
+        replica.databases = self.databases
+        replica.replica_lag = lag
+        return replica
+
+    def connect(self, host, user, password, database, port=3306, autocommit=False):
+        """Drop-in replacement for sql_connector.create_connection."""
+        if database is not None and database not in self.databases:
+            raise pymysql.err.OperationalError(1049, f"Unknown database '{database}'")
+        if self.connect_ms:
+            time.sleep(self.connect_ms / 1000)
+        with self._lock:
+            self.connections_opened += 1
+            thread_id = self.connections_opened
+        connection = StandInConnection(self, host, port, database, thread_id)
+        with self._lock:
+            self.connections[thread_id] = connection
+        return connection
+
+    def kill_query(self, thread_id):
+        """KILL QUERY: interrupt whatever the connection's SQLite handle is running."""
+        with self._lock:
+            connection = self.connections.get(thread_id)
+        if connection is None or not connection.open:
+            raise pymysql.err.OperationalError(1094, f"Unknown thread id: {thread_id}")
+        connection._sqlite.interrupt()
+
+    def _round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        if self.round_trip_ms:
+            time.sleep(self.round_trip_ms / 1000)
+
+
+def _mysql_error(err):
+    if "interrupted" in str(err):
+        return pymysql.err.OperationalError(1317, "Query execution was interrupted")
+    return pymysql.err.ProgrammingError(1064, str(err))
+
+
+def _unix_timestamp(value):
+    if value is None:
+        return None
+    moment = datetime.datetime.fromisoformat(str(value))
+    return moment.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def _from_unixtime(seconds):
+    if seconds is None:
+        return None
+    moment = datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc)
+    return moment.replace(tzinfo=None).isoformat(sep=" ")
+
+
+class StandInConnection:
+    """The subset of pymysql.connections.Connection that sql_connector uses."""
+
+    def __init__(self, server, host, port, database, thread_id=0):
+        self.server = server
+        self._thread_id = thread_id
+        self.host = host
+        self.port = port
+        self.db = database
+        self.open = True
+        self.server_status = 0
+        self._sqlite = None
+        self._connect_sqlite()
+
+    def _connect_sqlite(self):
+        if self._sqlite is not None:
+            self._sqlite.close()
+        path = self.server.databases[self.db]["path"] if self.db is not None else ":memory:"
+        self._sqlite = sqlite3.connect(path, check_same_thread=False)
+        # MySQL functions the chart aggregation queries use
+        self._sqlite.create_function("UNIX_TIMESTAMP", 1, _unix_timestamp, deterministic=True)
+        self._sqlite.create_function("FROM_UNIXTIME", 1, _from_unixtime, deterministic=True)
+        self._sqlite.create_function("FLOOR", 1, lambda value: None if value is None else math.floor(value))
+        self._sqlite.create_function("RAND", 0, random.random)
+
+    def thread_id(self):
+        return self._thread_id
+
+    def cursor(self, cursorclass=None):
+        cursorclass = cursorclass or pymysql.cursors.DictCursor
+        return StandInCursor(self, as_dict=issubclass(cursorclass, pymysql.cursors.DictCursorMixin))
+
+    def select_db(self, database):
+        self.server._round_trip()
+        if database not in self.server.databases:
+            raise pymysql.err.OperationalError(1049, f"Unknown database '{database}'")
+        self.db = database
+        self._connect_sqlite()
+
+    def ping(self, reconnect=False):
+        if not self.open:
+            raise pymysql.err.Error("Already closed")
+        self.server._round_trip()
+
+    def begin(self):
+        # Like MySQL, BEGIN inside a transaction commits it first
+        self.commit()
+        self._sqlite.execute("BEGIN")
+
+    def commit(self):
+        if self._sqlite.in_transaction:
+            self._sqlite.commit()
+
+    def rollback(self):
+        if self._sqlite.in_transaction:
+            self._sqlite.rollback()
+
+    def close(self):
+        if not self.open:
+            raise pymysql.err.Error("Already closed")
+        self.open = False
+        self._sqlite.close()
+        with self.server._lock:
+            self.server.connections.pop(self._thread_id, None)
+
+
+class StandInCursor:
+    """Cursor that answers information_schema queries itself and runs the rest on SQLite."""
+
+    def __init__(self, connection, as_dict):
+        self.connection = connection
+        self.as_dict = as_dict
+        self.description = None
+        self.rowcount = -1
+        self._rows = None
+        self._cursor = None
+
+    def _schema(self):
+        return self.connection.server.databases[self.connection.db]
+
+    def _set_rows(self, columns, rows):
+        self.description = [(column, None, None, None, None, None, None) for column in columns]
+        self._rows = iter(rows)
+        self._cursor = None
+        self.rowcount = len(rows)
+
+    def _emulate(self, query, args):
+        """Answer the information_schema queries sql_connector issues; None if not one."""
+        if "information_schema.SCHEMATA" in query:
+            databases = self.connection.server.databases
+            rows = [(name, table) for name in sorted(databases) for table in sorted(databases[name]["tables"])]
+            return ["database_name", "table_name"], rows + [("information_schema", None)]
+        if re.match(r"\s*SHOW (REPLICA|SLAVE) STATUS", query, re.IGNORECASE):
+            lag = self.connection.server.replica_lag
+            return ["Seconds_Behind_Source"], [] if lag is None else [(lag,)]
+        kill = re.match(r"\s*KILL QUERY (\d+)", query, re.IGNORECASE)
+        if kill:
+            self.connection.server.kill_query(int(kill.group(1)))
+            return [], []
+        if self.connection.db is None:
+            return None
+        schema = self._schema()
+        if "AS table_count" in query:
+            created = max(schema["create_time"].values(), default=None)
+            columns = [
+                (table, column, mysql_type, key, position)
+                for table, table_columns in schema["tables"].items()
+                for position, (column, mysql_type, key) in enumerate(table_columns, 1)
+            ]
+            checksum = sum(zlib.crc32("|".join(map(str, column)).encode("utf-8")) for column in columns)
+            return ["table_count", "last_created", "column_count", "column_checksum"], [
+                (len(schema["tables"]), created, len(columns), checksum if columns else None)
+            ]
+        if "LEFT JOIN information_schema.COLUMNS" in query:
+            rows = []
+            for table in sorted(schema["tables"]):
+                for column, mysql_type, key in schema["tables"][table]:
+                    null = "NO" if key == "PRI" else "YES"
+                    rows.append((table, "BASE TABLE", column, mysql_type, null, key, None, ""))
+            return ["table_name", "table_type", "Field", "Type", "Null", "Key", "Default", "Extra"], rows
+        if "KEY_COLUMN_USAGE" in query:
+            return ["table_name", "column_name", "referenced_table", "referenced_column"], list(schema["foreign_keys"])
+        if "UPDATE_TIME AS update_time" in query:
+            wanted = {table.lower() for table in (args or [])}
+            return ["table_name", "update_time"], [
+                (table, updated) for table, updated in schema["update_time"].items() if table.lower() in wanted
+            ]
+        if query.strip().upper().startswith("EXPLAIN FORMAT=JSON"):
+            return ["EXPLAIN"], [(json.dumps(self._explain_plan(query)),)]
+        if query.strip().lower().startswith("show databases"):
+            return ["Database"], [(name,) for name in sorted(self.connection.server.databases)]
+        return None
+
+    def _explain_plan(self, query):
+        """A MySQL-shaped JSON plan: a full scan of every table the query names, joined in order."""
+        tables = []
+        for table in self._schema()["tables"]:
+            if re.search(r"\b" + re.escape(table) + r"\b", query, re.IGNORECASE):
+                count = self.connection._sqlite.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+                tables.append({"table": {
+                    "table_name": table,
+                    "access_type": "ALL",
+                    "rows_examined_per_scan": count,
+                    "rows_produced_per_join": count,
+                }})
+        produced = 1
+        for entry in tables:
+            produced *= max(entry["table"]["rows_examined_per_scan"], 1)
+            entry["table"]["rows_produced_per_join"] = produced
+        return {"query_block": {"select_id": 1, "cost_info": {"query_cost": str(float(produced))},
+                                "nested_loop": tables}}
+
+    def execute(self, query, args=None):
+        if not self.connection.open:
+            raise pymysql.err.InterfaceError(0, "Connection is closed")
+        self.connection.server._round_trip()
+        emulated = self._emulate(query, args)
+        if emulated is not None:
+            self._set_rows(*emulated)
+            return self.rowcount
+
+        sqlite_query = query.replace("`", '"').replace("%s", "?")
+        try:
+            cursor = self.connection._sqlite.execute(sqlite_query, args or ())
+        except sqlite3.Error as err:
+            raise _mysql_error(err) from err
+        if cursor.description is None:
+            self.description = None
+            self.rowcount = cursor.rowcount
+            self._mark_updated(query)
+            self._cursor = None
+            self._rows = iter(())
+        else:
+            self.description = [(column[0], None, None, None, None, None, None) for column in cursor.description]
+            self._cursor = cursor
+            self._rows = None
+            self.rowcount = -1
+        return self.rowcount
+
+    def executemany(self, query, args):
+        total = 0
+        for params in args:
+            self.execute(query, params)
+            total += max(self.rowcount, 0)
+        self.rowcount = total
+        return total
+
+    def _mark_updated(self, query):
+        schema = self._schema()
+        now = datetime.datetime.now().replace(microsecond=0)
+        for table in schema["tables"]:
+            if re.search(r"\b" + re.escape(table) + r"\b", query, re.IGNORECASE):
+                schema["update_time"][table] = now
+
+    def _shape(self, rows):
+        if not self.as_dict:
+            return [tuple(row) for row in rows]
+        columns = [column[0] for column in self.description]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def fetchmany(self, size=1):
+        if self._cursor is not None:
+            try:
+                return self._shape(self._cursor.fetchmany(size))
+            except sqlite3.Error as err:
+                raise _mysql_error(err) from err
+        rows = []
+        for row in self._rows or ():
+            rows.append(row)
+            if len(rows) >= size:
+                break
+        return self._shape(rows)
+
+    def fetchall(self):
+        if self._cursor is not None:
+            try:
+                return self._shape(self._cursor.fetchall())
+            except sqlite3.Error as err:
+                raise _mysql_error(err) from err
+        return self._shape(list(self._rows or ()))
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def close(self):
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+
+
+class FakeOllamaServer:
+    """Minimal Ollama HTTP server with configurable prefill cost and token rate.
+
+    Answers are canned SQL: questions of the form "show the first N rows from
+    <table>" become ``SELECT * FROM <table> LIMIT N;`` wrapped in a fence and
+    followed by chatter, so early stopping on the first statement is
+    measurable. The prompt prefix shared with the previous request is treated
+    as KV-cached and not charged prefill time. ``stats["max_active"]`` is
+    the most requests it was answering at once.
+    """
+
+    CHATTER = (
+        "\n\nThis query selects every column from the table and limits the output. "
+        "You can adjust the LIMIT clause or add a WHERE clause to filter the rows further. "
+        "Let me know if you would like the results sorted or aggregated in another way."
+    )
+
+    def __init__(self, host="127.0.0.1", port=0, first_token_ms=50.0, tokens_per_second=200.0,
+                 prefill_ms_per_1k_chars=5.0):
+        self.first_token_ms = first_token_ms
+        self.tokens_per_second = tokens_per_second
+        self.prefill_ms_per_1k_chars = prefill_ms_per_1k_chars
+        self.stats = {"requests": 0, "tokens_generated": 0, "streams_cancelled": 0,
+                      "prompt_chars": 0, "prefill_chars": 0, "max_active": 0}
+        self._active = 0
+        self._last_prompt = ""
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def answer(self, prompt):
+        """The canned answer the fake model gives for a prompt."""
+        match = re.search(r"rows from (\w+)", prompt)
+        table = match.group(1) if match else "dual"
+        limit = re.search(r"first (\d+)", prompt)
+        sql = f"SELECT * FROM {table} LIMIT {limit.group(1) if limit else 10};"
+        return f"```sql\n{sql}\n```{self.CHATTER}"
+
+    def _prefill_seconds(self, prompt):
+        with self._lock:
+            shared = len(os.path.commonprefix([self._last_prompt, prompt]))
+            self._last_prompt = prompt
+            self.stats["requests"] += 1
+            self.stats["prompt_chars"] += len(prompt)
+            self.stats["prefill_chars"] += len(prompt) - shared
+        return (len(prompt) - shared) / 1000 * self.prefill_ms_per_1k_chars / 1000
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                model = request.get("model", "fake")
+                if self.path == "/api/chat":
+                    prompt = "\n".join(message.get("content", "") for message in request.get("messages", []))
+                    question = next((m.get("content", "") for m in reversed(request.get("messages", []))
+                                     if m.get("role") == "user"), "")
+                elif self.path == "/api/generate":
+                    prompt = question = request.get("prompt", "")
+                else:
+                    self.send_error(404)
+                    return
+
+                with server._lock:
+                    server._active += 1
+                    server.stats["max_active"] = max(server.stats["max_active"], server._active)
+                try:
+                    self._answer(request, model, prompt, question)
+                finally:
+                    with server._lock:
+                        server._active -= 1
+
+            def _answer(self, request, model, prompt, question):
+                time.sleep(server._prefill_seconds(prompt) + server.first_token_ms / 1000)
+                answer = server.answer(question) if question else ""
+                tokens = [answer[i:i + 4] for i in range(0, len(answer), 4)]
+                stream = request.get("stream", True)
+                created = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+                def chunk(content, done):
+                    payload = {"model": model, "created_at": created, "done": done}
+                    if self.path == "/api/chat":
+                        payload["message"] = {"role": "assistant", "content": content}
+                    else:
+                        payload["response"] = content
+                    if done:
+                        payload.update({"done_reason": "stop", "prompt_eval_count": len(prompt) // 4,
+                                        "eval_count": len(tokens)})
+                    return payload
+
+                if not stream:
+                    time.sleep(len(tokens) / server.tokens_per_second)
+                    with server._lock:
+                        server.stats["tokens_generated"] += len(tokens)
+                    self._send_json(chunk(answer, True))
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for token in tokens + [None]:
+                        payload = chunk("", True) if token is None else chunk(token, False)
+                        line = (json.dumps(payload) + "\n").encode()
+                        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                        self.wfile.flush()
+                        if token is not None:
+                            with server._lock:
+                                server.stats["tokens_generated"] += 1
+                            time.sleep(1 / server.tokens_per_second)
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    with server._lock:
+                        server.stats["streams_cancelled"] += 1
+                    self.close_connection = True
+
+        return Handler
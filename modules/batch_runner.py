@@ -0,0 +1,374 @@
+"""Answer a file of questions in bulk, e.g. to evaluate or precompute them overnight.
+
+    python modules/batch_runner.py questions.txt --database classicmodels --output results.parquet
+
+Questions are read from a text file (one per line, ``#`` comments allowed),
+a JSONL file (objects with ``question`` and optional ``id`` and ``database``),
+a CSV file with a ``question`` column, or stdin (``-``). They run through the
+ChatbotEngine with a bounded number in flight, and every answer is written
+to the output (Parquet, CSV or JSONL, by extension) as soon as it completes.
+Completed answers are also appended to ``<output>.checkpoint.jsonl``; running
+the same command again after a crash skips them.
+"""
+import argparse
+import csv
+import datetime
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    from . import sql_connector as sql
+    from .chatbot_engine import ChatbotEngine
+except ImportError:
+    import sql_connector as sql
+    from chatbot_engine import ChatbotEngine
+
+# Questions submitted to the engine at once; the engine's thread pools bound the LLM and MySQL work
+BATCH_MAX_IN_FLIGHT = 16
+# Result rows kept per question in the output's ``data`` column (as JSON)
+BATCH_MAX_ROWS = 100
+# Records buffered before a Parquet row group is written
+BATCH_PARQUET_ROW_GROUP = 100
+
+STAGES = ("schema", "generate", "validate", "guard", "execute")
+# Output columns, in order, with their Parquet types
+FIELDS = [
+    ("id", pa.string()),
+    ("database", pa.string()),
+    ("question", pa.string()),
+    ("status", pa.string()),
+    ("sql", pa.string()),
+    ("generated_sql", pa.string()),
+    ("cache", pa.string()),
+    ("corrections", pa.int64()),
+    ("guard_verdict", pa.string()),
+    ("rows_examined", pa.int64()),
+    ("rows", pa.int64()),
+    ("has_more", pa.bool_()),
+    ("error", pa.string()),
+    *[(f"{stage}_ms", pa.float64()) for stage in STAGES],
+    ("total_ms", pa.float64()),
+    ("trace_id", pa.string()),
+    ("completed_at", pa.string()),
+    ("data", pa.string()),
+]
+FIELD_NAMES = [name for name, _ in FIELDS]
+
+
+def _question_id(database, question, seen):
+    """Stable id from the question text, so resuming works even if the file was reordered."""
+    base = hashlib.sha1(f"{database}\0{question}".encode("utf-8")).hexdigest()[:16]
+    seen[base] = seen.get(base, 0) + 1
+    return base if seen[base] == 1 else f"{base}-{seen[base]}"
+
+
+def read_questions(source, database):
+    """Read questions from a .txt/.jsonl/.csv file or stdin ("-").
+
+    Returns a list of dicts with ``id``, ``question`` and ``database``.
+    """
+    handle = sys.stdin if source == "-" else open(source, newline="", encoding="utf-8")
+    extension = "" if source == "-" else os.path.splitext(source)[1].lower()
+    try:
+        if extension in (".jsonl", ".ndjson"):
+            items = [json.loads(line) for line in handle if line.strip()]
+        elif extension == ".csv":
+            items = list(csv.DictReader(handle))
+        else:
+            items = [
+                {"question": line.strip()} for line in handle
+                if line.strip() and not line.lstrip().startswith("#")
+            ]
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+    questions = []
+    seen = {}
+    for item in items:
+        question = (item.get("question") or "").strip()
+        if not question:
+            continue
+        item_database = item.get("database") or database
+        question_id = item.get("id")
+        if question_id in (None, ""):
+            question_id = _question_id(item_database, question, seen)
+        question_id = str(question_id)
+        questions.append({"id": question_id, "question": question, "database": item_database})
+    return questions
+
+
+def response_record(question_id, response, max_rows=BATCH_MAX_ROWS):
+    """Flatten an engine response into one output record."""
+    data = response["data"]
+    guard = response["guard"] or {}
+    record = {
+        "id": question_id,
+        "database": response["database"],
+        "question": response["question"],
+        "status": response["status"],
+        "sql": response["sql"],
+        "generated_sql": response["generation"].get("sql"),
+        "cache": response["generation"].get("cache"),
+        "corrections": len(response["validation"]["corrections"]) if response["validation"] else None,
+        "guard_verdict": guard.get("verdict"),
+        "rows_examined": guard.get("rows_examined"),
+        "rows": None if data is None else len(data),
+        "has_more": response["has_more"],
+        "error": response["error"],
+        "total_ms": response["trace"].duration_ms,
+        "trace_id": response["trace"].trace_id,
+        "completed_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "data": None,
+    }
+    for stage in STAGES:
+        seconds = response["timings"].get(stage)
+        record[f"{stage}_ms"] = None if seconds is None else seconds * 1000
+    if data is not None and max_rows:
+        record["data"] = data.head(max_rows).to_json(orient="records", date_format="iso", default_handler=str)
+    return record
+
+
+class JSONLWriter:
+    """Writes records as JSON lines, flushed after every write."""
+
+    def __init__(self, path):
+        self._handle = open(path, "w", encoding="utf-8")
+
+    def write(self, records):
+        for record in records:
+            self._handle.write(json.dumps(record, default=str) + "\n")
+        self._handle.flush()
+
+    def close(self):
+        self._handle.close()
+
+
+class CSVWriter:
+    """Writes records as CSV rows, flushed after every write."""
+
+    def __init__(self, path):
+        self._handle = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._handle, fieldnames=FIELD_NAMES)
+        self._writer.writeheader()
+
+    def write(self, records):
+        self._writer.writerows(records)
+        self._handle.flush()
+
+    def close(self):
+        self._handle.close()
+
+
+class ParquetWriter:
+    """Writes records as Parquet row groups of BATCH_PARQUET_ROW_GROUP records.
+
+    The file is only readable once closed; the checkpoint holds every record
+    written before a crash.
+    """
+
+    def __init__(self, path, row_group=BATCH_PARQUET_ROW_GROUP):
+        self._schema = pa.schema(FIELDS)
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._row_group = row_group
+        self._pending = []
+
+    def write(self, records):
+        self._pending.extend(records)
+        if len(self._pending) >= self._row_group:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._writer.write_table(pa.Table.from_pylist(self._pending, schema=self._schema))
+            self._pending = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def open_writer(path):
+    """Open an output writer for a path; the format follows its extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".parquet", ".pq"):
+        return ParquetWriter(path)
+    if extension == ".csv":
+        return CSVWriter(path)
+    if extension in (".jsonl", ".ndjson", ".json"):
+        return JSONLWriter(path)
+    raise ValueError(f"Unsupported output format: {path} (use .parquet, .csv or .jsonl)")
+
+
+class Checkpoint:
+    """Append-only JSONL log of completed records, synced to disk after each one."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """Return the completed records by id; a torn last line is ignored."""
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record["id"]] = record
+        return records
+
+    def open(self, records):
+        """Rewrite the log with ``records`` (dropping any torn line) and keep it open for appends."""
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            for record in records:
+                handle.write(json.dumps(record, default=str) + "\n")
+        os.replace(temp_path, self.path)
+        self._handle = open(self.path, "a", encoding="utf-8")
+
+    def append(self, record):
+        self._handle.write(json.dumps(record, default=str) + "\n")
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+
+    def close(self):
+        self._handle.close()
+
+
+def _summary(records, started, resumed):
+    statuses = {}
+    for record in records:
+        statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+    totals = sorted(record["total_ms"] for record in records if record["total_ms"] is not None)
+    elapsed = time.perf_counter() - started
+    answered = len(records) - resumed
+    return {
+        "questions": len(records),
+        "resumed": resumed,
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "questions_per_minute": round(answered / elapsed * 60, 2) if elapsed else None,
+        "p50_ms": totals[len(totals) // 2] if totals else None,
+        "p95_ms": totals[min(len(totals) - 1, int(0.95 * len(totals)))] if totals else None,
+    }
+
+
+def run_batch(engine, questions, output, checkpoint_path=None, resume=True, max_in_flight=BATCH_MAX_IN_FLIGHT,
+              max_rows=BATCH_MAX_ROWS, use_result_cache=True, allow_over_budget=False, read_only=True,
+              on_record=None):
+    """Answer ``questions`` (from read_questions) and stream the records to ``output``.
+
+    At most ``max_in_flight`` questions are queued on the engine at a time.
+    With ``resume`` questions already in the checkpoint are not asked again
+    and their records are written to the output first. ``read_only`` keeps
+    generated writes from running. ``on_record(record, done, total)`` is
+    called after each answer. Returns a summary dict.
+    """
+    started = time.perf_counter()
+    checkpoint = Checkpoint(checkpoint_path or f"{output}.checkpoint.jsonl")
+    completed = checkpoint.load() if resume else {}
+    wanted = {question["id"] for question in questions}
+    records = [record for question_id, record in completed.items() if question_id in wanted]
+    pending = [question for question in questions if question["id"] not in completed]
+    resumed = len(records)
+
+    writer = open_writer(output)
+    checkpoint.open(records)
+    if records:
+        writer.write(records)
+    in_flight = {}
+    try:
+        while pending or in_flight:
+            while pending and len(in_flight) < max_in_flight:
+                question = pending.pop(0)
+                future = engine.submit(
+                    question["question"],
+                    question["database"],
+                    max_rows=max_rows or None,
+                    use_result_cache=use_result_cache,
+                    allow_over_budget=allow_over_budget,
+                    read_only=read_only,
+                )
+                in_flight[future] = question
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                question = in_flight.pop(future)
+                record = response_record(question["id"], future.result(), max_rows=max_rows)
+                checkpoint.append(record)
+                writer.write([record])
+                records.append(record)
+                if on_record is not None:
+                    on_record(record, len(records), len(questions))
+    finally:
+        # Questions still in flight finish in the engine's threads; they are asked again on resume
+        writer.close()
+        checkpoint.close()
+    return _summary(records, started, resumed)
+
+
+def _print_progress(record, done, total):
+    total_ms = f"{record['total_ms']:,.0f} ms" if record["total_ms"] is not None else "-"
+    print(f"[{done}/{total}] {record['status']:<18} {total_ms:>10}  {record['question'][:80]}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("questions", help="questions file (.txt, .jsonl or .csv), or - for stdin")
+    parser.add_argument("--database", required=True, help="database for questions that don't name one")
+    parser.add_argument("--output", required=True, help="results file (.parquet, .csv or .jsonl)")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.checkpoint.jsonl)")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and ask every question")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default=os.environ.get("MYSQL_PWD", ""),
+                        help="MySQL password (default: $MYSQL_PWD)")
+    parser.add_argument("--replicas", default=os.environ.get("DB_CHATBOT_REPLICAS", ""),
+                        help="read replicas as host[:port],... (default: $DB_CHATBOT_REPLICAS)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_MAX_IN_FLIGHT, help="questions in flight")
+    parser.add_argument("--llm-workers", type=int, default=None, help="concurrent LLM generations")
+    parser.add_argument("--max-rows", type=int, default=BATCH_MAX_ROWS, help="result rows kept per question")
+    parser.add_argument("--allow-over-budget", action="store_true", help="run queries the cost guard would hold")
+    parser.add_argument("--allow-writes", action="store_true", help="execute generated INSERT/UPDATE/DELETE")
+    parser.add_argument("--no-result-cache", action="store_true", help="don't read or fill the result cache")
+    args = parser.parse_args(argv)
+
+    questions = read_questions(args.questions, args.database)
+    pool = sql.create_pool(args.host, args.user, args.password, port=args.port,
+                           replicas=sql.parse_targets(args.replicas))
+    engine_options = {"llm_workers": args.llm_workers} if args.llm_workers else {}
+    engine = ChatbotEngine(pool, **engine_options)
+    try:
+        # Load the model and the schema prompt prefix before the first wave of questions
+        engine.warm_up(args.database).result()
+        summary = run_batch(
+            engine,
+            questions,
+            args.output,
+            checkpoint_path=args.checkpoint,
+            resume=not args.restart,
+            max_in_flight=args.concurrency,
+            max_rows=args.max_rows,
+            use_result_cache=not args.no_result_cache,
+            allow_over_budget=args.allow_over_budget,
+            read_only=not args.allow_writes,
+            on_record=_print_progress,
+        )
+    finally:
+        engine.shutdown()
+        pool.close_all()
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
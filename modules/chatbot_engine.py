@@ -0,0 +1,473 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pandas as pd
+
+try:
+    from . import sql_connector as sql
+    from . import mysql_query_generator as query_gen
+    from . import query_guard
+    from . import llm_scheduler
+    from . import result_cache
+    from . import tracing
+    from . import validation
+except ImportError:
+    import sql_connector as sql
+    import mysql_query_generator as query_gen
+    import query_guard
+    import llm_scheduler
+    import result_cache
+    import tracing
+    import validation
+
+# Worker threads for the MySQL stages (schema lookup, execution)
+ENGINE_DB_WORKERS = 8
+# Worker threads for LLM generation; the process-wide llm_scheduler limits how many run at once
+ENGINE_LLM_WORKERS = 2
+
+
+class ChatbotEngine:
+    """Question -> SQL -> result pipeline, independent of any UI.
+
+    A request runs through five stages: schema lookup, prompt building and
+    generation, offline validation against the schema catalog, the EXPLAIN
+    cost guard, and SQL execution. ``ask`` runs them inline in the calling
+    thread (needed when ``on_update`` touches a UI). ``submit`` and
+    ``ask_async`` hand the stages to separate database and LLM thread pools, so
+    the MySQL work of some requests overlaps with the generation of others
+    and neither kind of work can starve the other.
+
+    Every call returns a response dict with the keys ``question``,
+    ``database``, ``status`` ("ok", "failed" when MySQL rejected the query,
+    "invalid" when validation rejected it, "refused" or "needs_confirmation"
+    when the cost guard stopped it, "skipped" for writes in read-only mode,
+    "cancelled" or "timeout" when a QueryControl stopped it, or "error" when
+    a stage raised), ``sql``
+    (as corrected and rewritten), ``generation``, ``validation`` and
+    ``guard`` (the validation and query_guard reports), ``data`` (a
+    DataFrame for reads), ``has_more``, ``pager``, ``writes`` (for writes,
+    sql.execute_script's statements with their affected rows),
+    ``result_cache``, ``error``, ``timings`` (seconds per stage) and ``trace`` (the finished
+    tracing.Trace with the spans recorded by every stage).
+    """
+
+    def __init__(self, pool, db_workers=ENGINE_DB_WORKERS, llm_workers=ENGINE_LLM_WORKERS):
+        self.pool = pool
+        self._db_executor = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="engine-db")
+        self._llm_executor = ThreadPoolExecutor(max_workers=llm_workers, thread_name_prefix="engine-llm")
+
+    @staticmethod
+    def _new_response(question, database):
+        return {
+            "question": question,
+            "database": database,
+            "status": "pending",
+            "sql": None,
+            "generation": {},
+            "validation": None,
+            "guard": None,
+            "catalog": None,
+            "data": None,
+            "has_more": False,
+            "pager": None,
+            "writes": None,
+            "result_cache": None,
+            "error": None,
+            "timings": {},
+            "trace": tracing.Trace("question", question=question, database=database),
+        }
+
+    @staticmethod
+    def _finish(response):
+        tracing.finish(response["trace"], status=response["status"], error=response["error"])
+        return response
+
+    @staticmethod
+    def _pending(response, control):
+        """Whether a request goes on to its next stage; a cancelled one ends as "cancelled"."""
+        if response["status"] == "pending" and control is not None and control.reason == "cancelled":
+            response["status"] = "cancelled"
+            response["error"] = "Query cancelled"
+        return response["status"] == "pending"
+
+    @staticmethod
+    def _reopen(response):
+        """Let a request the cost guard held back run, with a fresh trace."""
+        response["status"] = "pending"
+        response["error"] = None
+        response["trace"] = tracing.Trace(
+            "confirmed_question", question=response["question"], database=response["database"]
+        )
+
+    @staticmethod
+    def _fail(response, stage, err):
+        response["status"] = "error"
+        response["error"] = str(err)
+        print(f"Error during {stage}: {err}")
+
+    def lookup_schema(self, response):
+        """Stage 1: fetch the (cached) schema catalog for the request's database."""
+        with tracing.activate(response["trace"]), tracing.span("schema") as span:
+            try:
+                with self.pool.connection(response["database"], read=True) as connection:
+                    response["catalog"] = sql.get_schema_catalog(connection)
+            except Exception as err:
+                self._fail(response, "schema lookup", err)
+        response["timings"]["schema"] = span.seconds
+        return response
+
+    def generate(self, response, on_update=None, stream=True, session=None, abandoned=None):
+        """Stage 2: build the prompt and generate SQL; the pool is not held meanwhile.
+
+        The model call waits in ``session``'s queue of the LLM scheduler; a
+        request given up on meanwhile (``abandoned()``) ends as "cancelled".
+        """
+        with tracing.activate(response["trace"]), tracing.span("generate") as span:
+            try:
+                response["sql"], response["generation"] = query_gen.generate_mysql_query(
+                    response["question"],
+                    catalog=response["catalog"],
+                    with_metadata=True,
+                    stream=stream,
+                    on_update=on_update,
+                    session=session,
+                    abandoned=abandoned,
+                )
+                # The SQL as generated, before validation and the cost guard rewrite it
+                response["generation"]["sql"] = response["sql"]
+                span.set(cache=response["generation"].get("cache"))
+            except llm_scheduler.LLMRequestShed as err:
+                response["status"] = "cancelled"
+                response["error"] = str(err)
+            except Exception as err:
+                self._fail(response, "generation", err)
+        response["timings"]["generate"] = span.seconds
+        return response
+
+    def validate(self, response):
+        """Stage 3: resolve the SQL's tables and columns against the catalog, fixing near misses.
+
+        Invalid SQL ends with status "invalid" without a round trip to MySQL.
+        """
+        with tracing.activate(response["trace"]), tracing.span("validate") as span:
+            try:
+                report = validation.validate_query(response["sql"], response["catalog"])
+                response["validation"] = report
+                span.set(valid=report["valid"], corrections=len(report["corrections"]))
+                if not report["valid"]:
+                    response["status"] = "invalid"
+                    response["error"] = "Invalid SQL: " + "; ".join(report["errors"])
+                    query_gen.forget_cached_query(
+                        response["question"], catalog=response["catalog"], query=response["generation"].get("sql")
+                    )
+                elif report["corrections"]:
+                    response["sql"] = report["query"]
+                    # Serve the corrected SQL the next time the question is asked (unless it was borrowed)
+                    if response["generation"].get("cache") != "similar":
+                        query_gen.remember_query(response["question"], report["query"], response["catalog"])
+            except Exception as err:
+                self._fail(response, "validation", err)
+        response["timings"]["validate"] = span.seconds
+        return response
+
+    def guard(self, response, allow_over_budget=False):
+        """Stage 4: EXPLAIN the generated SELECT, cap it with LIMIT/MAX_EXECUTION_TIME and judge its cost.
+
+        Over-budget queries end with status "refused", or "needs_confirmation"
+        unless ``allow_over_budget`` is set; ``confirm`` runs them later.
+        """
+        with tracing.activate(response["trace"]), tracing.span("guard") as span:
+            try:
+                read = sql.is_read_query(response["sql"])
+                with self.pool.connection(response["database"], read=read) as connection:
+                    report = query_guard.check_query(connection, response["sql"])
+                response["guard"] = report
+                response["sql"] = report["query"]
+                span.set(verdict=report["verdict"], limit=report["limit"])
+                if report["verdict"] == "refuse":
+                    response["status"] = "refused"
+                    response["error"] = f"Query refused: {report['reason']}"
+                elif report["verdict"] == "confirm" and not allow_over_budget:
+                    response["status"] = "needs_confirmation"
+                    response["error"] = f"Query needs confirmation: {report['reason']}"
+            except Exception as err:
+                self._fail(response, "cost guard", err)
+        response["timings"]["guard"] = span.seconds
+        return response
+
+    def _read(self, response, page_size, max_rows, use_result_cache, control):
+        query = response["sql"]
+        database = response["database"]
+        update_times = None
+        if use_result_cache:
+            with self.pool.connection(database, read=True) as connection:
+                cached_rows = sql.get_cached_result(connection, query)
+                if cached_rows is None:
+                    # Snapshot UPDATE_TIME before running the query so a concurrent write makes the entry stale
+                    update_times = sql.fetch_table_update_times(connection, result_cache.extract_tables(query))
+            response["result_cache"] = "miss" if cached_rows is None else "hit"
+            if cached_rows is not None:
+                return pd.DataFrame(cached_rows)
+
+        if page_size:
+            pager = sql.open_result_pager(self.pool, database, query, page_size=page_size, control=control)
+            if pager is None:
+                return None
+            try:
+                data = pager.fetch_page(control=control)
+            except Exception as err:
+                print(f"Error executing query: {err}")
+                return None
+            if not pager.exhausted:
+                response["has_more"] = True
+                response["pager"] = pager
+                return data
+        else:
+            with self.pool.connection(database, read=True) as connection, tracing.span("mysql.read") as span:
+                chunks = []
+                rows = 0
+                chunk_iter = sql.iter_query_chunks(connection, query, control=control)
+                try:
+                    for chunk in chunk_iter:
+                        chunks.append(chunk)
+                        rows += len(chunk)
+                        if max_rows is not None and rows >= max_rows:
+                            response["has_more"] = True
+                            break
+                except Exception as err:
+                    print(f"Error executing query: {err}")
+                    return None
+                finally:
+                    # Finish with the cursor before the connection goes back to the pool
+                    chunk_iter.close()
+                    span.set(rows=rows, chunks=len(chunks))
+            data = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+            if max_rows is not None:
+                data = data.iloc[:max_rows]
+            if response["has_more"]:
+                return data
+
+        if use_result_cache and update_times is not None:
+            # Only complete results are cached
+            with self.pool.connection(database, read=True) as connection:
+                sql.cache_result(connection, query, data, update_times)
+        return data
+
+    def _run_query(self, response, span, page_size, max_rows, use_result_cache, control):
+        if sql.is_read_query(response["sql"]):
+            response["data"] = self._read(response, page_size, max_rows, use_result_cache, control)
+            succeeded = response["data"] is not None
+            if succeeded:
+                span.set(
+                    rows=len(response["data"]),
+                    bytes=int(response["data"].memory_usage(index=True, deep=False).sum()),
+                    has_more=response["has_more"],
+                )
+                if response["guard"] is not None:
+                    response["guard"]["actual_rows"] = len(response["data"])
+        else:
+            with self.pool.connection(response["database"]) as connection:
+                response["writes"] = sql.execute_query(connection, response["sql"], control=control)
+            succeeded = response["writes"] is not None
+            if succeeded:
+                span.set(statements=sum(write["statements"] for write in response["writes"]),
+                         rows_affected=sum(write["rows"] for write in response["writes"]))
+        if not succeeded and control.reason is not None:
+            # Stopped, not rejected: the SQL itself may be fine
+            response["status"] = control.reason
+            response["error"] = (
+                "Query cancelled" if control.reason == "cancelled"
+                else f"Query stopped after the {control.timeout:g} s time limit"
+            )
+            span.set(stopped=control.reason)
+        elif succeeded:
+            response["status"] = "ok"
+            if sql.is_read_query(response["sql"]) and response["generation"].get("cache") != "similar":
+                # Successful reads feed SQL reuse and few-shot examples for similar questions;
+                # SQL borrowed from one is not filed under this question as well
+                validated = response["validation"]["query"] if response["validation"] else response["sql"]
+                query_gen.remember_successful_query(response["question"], validated, response["catalog"])
+        else:
+            response["status"] = "failed"
+            response["error"] = "Query execution failed"
+            # Don't serve SQL that MySQL rejected from the generation cache (or index) again
+            query_gen.forget_cached_query(
+                response["question"], catalog=response["catalog"], query=response["generation"].get("sql")
+            )
+
+    def execute(self, response, page_size=None, max_rows=None, use_result_cache=False, read_only=False,
+                control=None):
+        """Stage 5: run the generated SQL.
+
+        Reads return a DataFrame. With ``page_size`` only the first page is
+        fetched and the open ResultPager is returned in ``response["pager"]``
+        (the caller must close it); otherwise at most ``max_rows`` rows are
+        read through a server-side cursor. With ``read_only`` other statements
+        are not run and the response is "skipped". The query runs under
+        ``control`` (a new sql.QueryControl with the default deadline if not
+        given), which another thread can use to cancel it.
+        """
+        control = control or sql.QueryControl(self.pool)
+        with tracing.activate(response["trace"]), tracing.span("execute") as span:
+            try:
+                if read_only and not sql.is_read_query(response["sql"]):
+                    response["status"] = "skipped"
+                    response["error"] = "Write statement not executed in read-only mode"
+                else:
+                    self._run_query(response, span, page_size, max_rows, use_result_cache, control)
+            except Exception as err:
+                self._fail(response, "execution", err)
+        response["timings"]["execute"] = span.seconds
+        if response["guard"] is not None and "actual_rows" in response["guard"]:
+            response["guard"]["actual_ms"] = span.duration_ms
+        return response
+
+    @staticmethod
+    def _abandoned(control, abandoned=None):
+        """Tells the LLM scheduler when nobody wants a request's answer anymore."""
+        if control is None:
+            return abandoned
+        return lambda: control.reason == "cancelled" or (abandoned is not None and abandoned())
+
+    def prepare(self, question, database, on_update=None, allow_over_budget=False, control=None, session=None,
+                abandoned=None):
+        """Run every stage but execution in the calling thread.
+
+        The response is still "pending" if its SQL is ready to run; pass it to
+        ``execute`` or ``submit_execute``. It is not finished yet. ``session``
+        and ``abandoned`` go to the LLM scheduler (see ``generate``).
+        """
+        response = self._new_response(question, database)
+        self.lookup_schema(response)
+        if self._pending(response, control):
+            self.generate(
+                response, on_update=on_update, session=session, abandoned=self._abandoned(control, abandoned)
+            )
+        if self._pending(response, control):
+            self.validate(response)
+        if self._pending(response, control):
+            self.guard(response, allow_over_budget=allow_over_budget)
+        self._pending(response, control)
+        return response
+
+    def ask(self, question, database, on_update=None, page_size=None, max_rows=None, use_result_cache=False,
+            allow_over_budget=False, control=None, session=None):
+        """Answer one question, running every stage in the calling thread."""
+        response = self.prepare(
+            question, database, on_update=on_update, allow_over_budget=allow_over_budget, control=control,
+            session=session,
+        )
+        if response["status"] == "pending":
+            self.execute(
+                response, page_size=page_size, max_rows=max_rows, use_result_cache=use_result_cache, control=control
+            )
+        return self._finish(response)
+
+    def confirm(self, response, page_size=None, max_rows=None, use_result_cache=False, control=None):
+        """Run a query the cost guard held back for confirmation, in the calling thread."""
+        if response["status"] != "needs_confirmation":
+            return response
+        self._reopen(response)
+        self.execute(
+            response, page_size=page_size, max_rows=max_rows, use_result_cache=use_result_cache, control=control
+        )
+        return self._finish(response)
+
+    def submit_execute(self, response, page_size=None, max_rows=None, use_result_cache=False, confirmed=False,
+                       control=None):
+        """Run a prepared request's query on the database thread pool; returns a Future of the finished response.
+
+        With ``confirmed`` a request the cost guard held back runs as well.
+        The caller keeps the thread free, e.g. to offer cancelling through
+        ``control``.
+        """
+        if confirmed and response["status"] == "needs_confirmation":
+            self._reopen(response)
+
+        def run():
+            if self._pending(response, control):
+                self.execute(
+                    response, page_size=page_size, max_rows=max_rows, use_result_cache=use_result_cache,
+                    control=control
+                )
+            return self._finish(response)
+
+        return self._db_executor.submit(run)
+
+    def submit(self, question, database, page_size=None, max_rows=None, use_result_cache=False,
+               allow_over_budget=False, read_only=False, control=None, session=None):
+        """Queue a question on the engine's thread pools and return a Future of the response."""
+        outer = Future()
+        response = self._new_response(question, database)
+        stages = [
+            (self._db_executor, self.lookup_schema, {}),
+            (self._llm_executor, self.generate, {"session": session, "abandoned": self._abandoned(control)}),
+            (self._db_executor, self.validate, {}),
+            (self._db_executor, self.guard, {"allow_over_budget": allow_over_budget}),
+            (self._db_executor, self.execute, {
+                "page_size": page_size, "max_rows": max_rows, "use_result_cache": use_result_cache,
+                "read_only": read_only, "control": control,
+            }),
+        ]
+
+        def run_stage(index):
+            if index == len(stages) or not self._pending(response, control):
+                outer.set_result(self._finish(response))
+                return
+            executor, stage, kwargs = stages[index]
+            try:
+                future = executor.submit(stage, response, **kwargs)
+            except RuntimeError as err:
+                self._fail(response, stage.__name__, err)
+                outer.set_result(self._finish(response))
+                return
+            future.add_done_callback(lambda _: run_stage(index + 1))
+
+        run_stage(0)
+        return outer
+
+    async def ask_async(self, question, database, page_size=None, max_rows=None, use_result_cache=False):
+        """Async wrapper around ``submit`` for asyncio callers (e.g. an HTTP service)."""
+        return await asyncio.wrap_future(
+            self.submit(question, database, page_size=page_size, max_rows=max_rows, use_result_cache=use_result_cache)
+        )
+
+    def ask_many(self, questions, database, max_rows=None, use_result_cache=False):
+        """Answer many questions concurrently; responses come back in input order."""
+        futures = [
+            self.submit(question, database, max_rows=max_rows, use_result_cache=use_result_cache)
+            for question in questions
+        ]
+        return [future.result() for future in futures]
+
+    def warm_up(self, database):
+        """Preload the model and a database's schema prompt prefix in the background.
+
+        Returns a Future that resolves to True once Ollama has evaluated the
+        prefix, so the first question of a session only pays for its own tokens.
+        """
+        def load_catalog():
+            with self.pool.connection(database, read=True) as connection:
+                return sql.get_schema_catalog(connection)
+
+        outer = Future()
+
+        def preload(catalog_future):
+            try:
+                catalog = catalog_future.result()
+            except Exception as err:
+                print(f"Error during warm-up: {err}")
+                catalog = None
+            preloaded = self._llm_executor.submit(query_gen.preload_model, catalog)
+            preloaded.add_done_callback(
+                lambda future: outer.set_exception(future.exception()) if future.exception()
+                else outer.set_result(future.result())
+            )
+
+        self._db_executor.submit(load_catalog).add_done_callback(preload)
+        return outer
+
+    def shutdown(self, wait=True):
+        """Stop the engine's worker threads."""
+        self._db_executor.shutdown(wait=wait)
+        self._llm_executor.shutdown(wait=wait)
@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import ExitStack
+
+try:
+    from . import tracing
+except ImportError:
+    import tracing
+
+# Generations run at once; match the Ollama server's OLLAMA_NUM_PARALLEL
+LLM_MAX_CONCURRENCY = int(os.environ.get("DB_CHATBOT_LLM_CONCURRENCY", "2"))
+# Generations waiting for a slot beyond which new requests are turned away
+LLM_MAX_QUEUE = int(os.environ.get("DB_CHATBOT_LLM_MAX_QUEUE", "32"))
+# Seconds between a waiting caller's checks for progress and whether it still wants the answer
+LLM_POLL_INTERVAL = 0.1
+# Queue wait times kept for the percentile summary
+LLM_RECENT_WAITS = 1000
+# Sessions whose last turn is remembered for fair ordering
+LLM_REMEMBERED_SESSIONS = 1000
+
+
+class LLMBusyError(Exception):
+    """Raised when too many generations are already waiting for the model."""
+
+
+class LLMRequestShed(Exception):
+    """Raised to callers of a generation that was dropped because nobody wanted it anymore."""
+
+
+class _Generation:
+    def __init__(self, key, generate, session):
+        self.key = key
+        self.generate = generate
+        self.session = session
+        self.waiters = 1
+        self.state = "queued"
+        self.partial = None
+        self.result = None
+        self.error = None
+        self.queued_at = time.perf_counter()
+
+
+class LLMScheduler:
+    """Process-wide admission control in front of the model.
+
+    At most ``max_concurrency`` generations run at once, on the scheduler's
+    own threads. Waiting generations are queued per session, and the next
+    one comes from the session served least recently, so one session asking
+    many questions can't starve the others. A request identical to one already queued or running
+    (same ``key``) waits for that generation instead of starting its own.
+    Requests nobody waits for anymore are shed: dropped from the queue, or
+    stopped at their next progress update if already running. More than
+    ``max_queue`` waiting generations raise LLMBusyError.
+    """
+
+    def __init__(self, max_concurrency=None, max_queue=None):
+        self.max_concurrency = max_concurrency or LLM_MAX_CONCURRENCY
+        self.max_queue = LLM_MAX_QUEUE if max_queue is None else max_queue
+        self._condition = threading.Condition()
+        # Session -> deque of queued generations
+        self._queues = {}
+        # Session -> turn it was last served in, oldest first
+        self._served = OrderedDict()
+        self._turn = 0
+        self._queued = 0
+        self._running = 0
+        # Key -> queued or running generation, for coalescing identical requests
+        self._generations = {}
+        self._workers = []
+        self._waits = deque(maxlen=LLM_RECENT_WAITS)
+        self._metrics = {
+            "submitted": 0,
+            "coalesced": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "shed": 0,
+            "max_queue_depth": 0,
+        }
+
+    def run(self, key, generate, session=None, on_update=None, abandoned=None):
+        """Run ``generate(progress)`` under the scheduler and return its result.
+
+        ``generate`` runs on a scheduler thread and may call ``progress`` with
+        partial output; ``on_update`` receives it in the calling thread, so it
+        may touch a UI. ``key`` identifies identical requests (None never
+        coalesces) and ``session`` the queue the request waits in. The caller
+        stops waiting, and the generation is shed if nobody else waits for it,
+        when ``abandoned()`` returns True (LLMRequestShed is raised) or when
+        ``on_update`` raises.
+        """
+        with ExitStack() as queued:
+            span = queued.enter_context(tracing.span("llm.queue"))
+            generation, coalesced = self._join(key, generate, session)
+            span.set(coalesced=coalesced, queue_depth=self._queued)
+            seen = None
+            try:
+                while True:
+                    with self._condition:
+                        if generation.state != "done" and generation.partial == seen:
+                            self._condition.wait(LLM_POLL_INTERVAL)
+                        state, partial = generation.state, generation.partial
+                    if state != "queued":
+                        queued.close()
+                    if partial and partial != seen:
+                        seen = partial
+                        if on_update is not None:
+                            on_update(partial)
+                    if state == "done":
+                        break
+                    if abandoned is not None and abandoned():
+                        raise LLMRequestShed("The question was abandoned before the model answered it")
+            finally:
+                with self._condition:
+                    generation.waiters -= 1
+        if generation.error is not None:
+            raise generation.error
+        return generation.result
+
+    def _join(self, key, generate, session):
+        with self._condition:
+            generation = self._generations.get(key) if key is not None else None
+            if generation is not None:
+                generation.waiters += 1
+                self._metrics["coalesced"] += 1
+                return generation, True
+            if self._queued >= self.max_queue:
+                self._metrics["rejected"] += 1
+                raise LLMBusyError("Too many questions are waiting for the model; please try again shortly")
+            generation = _Generation(key, generate, session)
+            if key is not None:
+                self._generations[key] = generation
+            self._queues.setdefault(session, deque()).append(generation)
+            self._queued += 1
+            self._metrics["submitted"] += 1
+            self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], self._queued)
+            while len(self._workers) < self.max_concurrency:
+                worker = threading.Thread(
+                    target=self._work, name=f"llm-scheduler-{len(self._workers)}", daemon=True
+                )
+                self._workers.append(worker)
+                worker.start()
+            self._condition.notify_all()
+            return generation, False
+
+    def _forget(self, generation):
+        if self._generations.get(generation.key) is generation:
+            del self._generations[generation.key]
+
+    def _next_generation(self):
+        """Pop the next generation someone still waits for, taking sessions in turn."""
+        while self._queues:
+            # Sessions never served (or forgotten) go first, in the order they queued
+            session = min(self._queues, key=lambda waiting: self._served.get(waiting, -1))
+            queue = self._queues[session]
+            generation = queue.popleft()
+            if not queue:
+                del self._queues[session]
+            self._queued -= 1
+            self._turn += 1
+            self._served[session] = self._turn
+            self._served.move_to_end(session)
+            if len(self._served) > LLM_REMEMBERED_SESSIONS:
+                self._served.popitem(last=False)
+            if generation.waiters > 0:
+                return generation
+            generation.state = "done"
+            generation.error = LLMRequestShed("Nobody was waiting for this answer anymore")
+            self._forget(generation)
+            self._metrics["shed"] += 1
+        return None
+
+    def _progress(self, generation, partial):
+        with self._condition:
+            if generation.waiters == 0:
+                self._forget(generation)
+                raise LLMRequestShed("Nobody was waiting for this answer anymore")
+            generation.partial = partial
+            self._condition.notify_all()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                generation = self._next_generation()
+                while generation is None:
+                    self._condition.wait()
+                    generation = self._next_generation()
+                generation.state = "running"
+                self._running += 1
+                self._waits.append(time.perf_counter() - generation.queued_at)
+            try:
+                result, error = generation.generate(lambda partial: self._progress(generation, partial)), None
+            except Exception as err:
+                result, error = None, err
+            with self._condition:
+                self._running -= 1
+                self._forget(generation)
+                generation.result, generation.error = result, error
+                generation.state = "done"
+                if error is None:
+                    self._metrics["completed"] += 1
+                elif isinstance(error, LLMRequestShed):
+                    self._metrics["shed"] += 1
+                else:
+                    self._metrics["failed"] += 1
+                self._condition.notify_all()
+
+    def stats(self):
+        """Return queue depth, running generations, counters and queue wait times."""
+        with self._condition:
+            stats = dict(self._metrics)
+            stats["queue_depth"] = self._queued
+            stats["waiting_sessions"] = len(self._queues)
+            stats["running"] = self._running
+            stats["max_concurrency"] = self.max_concurrency
+            waits = sorted(self._waits)
+        stats["wait_p50_seconds"] = waits[len(waits) // 2] if waits else 0.0
+        stats["wait_p95_seconds"] = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        stats["wait_max_seconds"] = waits[-1] if waits else 0.0
+        return stats
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide LLM scheduler, creating it on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
@@ -1,30 +1,323 @@
+import hashlib
+import json
+import os
+import time
+
 import ollama
-import sql_connector as sql
-
-def generate_mysql_query(prompt: str,connection) -> str:   
-    """Generate a MySQL query based on the provided prompt using Ollama."""
-    response = ollama.chat(model="qwen2.5-coder", messages=[
-    {
-    'role': 'user',
-    'content': f"Generate a MySQL query based on the following prompt: {prompt}"
-    'The schema for the database is as follows:'
-    'the tables in the database are:'
-    f"{sql.fetch_all_tables(connection)}"
-    'The schema for each table is as follows:'
-    f"{[sql.fetch_table_schema(connection, table_name) for table_name in sql.fetch_all_tables(connection)]}"
-    "The query should be a valid MySQL query that can be executed on the database. and autocorrect the table names and column names if they are not correct. If the query is not valid, return an error message indicating that the query is invalid."  
+
+try:
+    from . import sql_connector as sql
+    from . import schema_index
+    from . import schema_prompt
+    from . import query_cache
+    from . import question_index
+    from . import llm_scheduler
+    from . import tracing
+    from .sql_extraction import SQLExtractor, extract_sql
+except ImportError:
+    import sql_connector as sql
+    import schema_index
+    import schema_prompt
+    import query_cache
+    import question_index
+    import llm_scheduler
+    import tracing
+    from sql_extraction import SQLExtractor, extract_sql
+
+MODEL_NAME = "qwen2.5-coder"
+# How long Ollama keeps the model (and its evaluated prompt prefix) loaded after a request
+OLLAMA_KEEP_ALIVE = os.environ.get("DB_CHATBOT_OLLAMA_KEEP_ALIVE", "30m")
+# Model options sent with every request; num_ctx must fit the system prompt and schema block,
+# and must not vary between requests or Ollama reloads the model
+OLLAMA_OPTIONS = {
+    "num_ctx": int(os.environ.get("DB_CHATBOT_OLLAMA_NUM_CTX", "8192")),
+}
+
+
+def _cache_key(prompt, catalog):
+    database_key = catalog["key"] if catalog else None
+    fingerprint = catalog["fingerprint"] if catalog else None
+    return query_cache.make_key(prompt, MODEL_NAME, database_key, fingerprint)
+
+
+def forget_cached_query(prompt: str, connection=None, catalog=None, query=None) -> None:
+    """Drop the cached SQL for a question, e.g. because it failed to execute.
+
+    Past questions whose stored SQL is ``query`` are dropped from the
+    similarity index as well, so a failing answer is not reused again.
+    """
+    if catalog is None:
+        catalog = sql.get_schema_catalog(connection)
+    query_cache.get_cache().discard(_cache_key(prompt, catalog))
+    if catalog:
+        question_index.get_index(catalog["key"]).forget(question=prompt, sql=query)
+
+
+def remember_successful_query(prompt: str, query: str, catalog) -> None:
+    """Add a question whose SQL executed successfully to the similarity index."""
+    if catalog and query:
+        question_index.get_index(catalog["key"]).add(prompt, query)
+
+
+def remember_query(prompt: str, query: str, catalog) -> None:
+    """Store SQL for a question in the generation cache, e.g. after it was corrected."""
+    query_cache.get_cache().put(
+        _cache_key(prompt, catalog),
+        query,
+        catalog["key"] if catalog else None,
+        catalog["fingerprint"] if catalog else None,
+    )
+
+
+def _token_counts(response):
+    """Ollama's prompt/completion token counts from a final response."""
+    counts = {}
+    if response.get('prompt_eval_count') is not None:
+        counts["prompt_tokens"] = response['prompt_eval_count']
+    if response.get('eval_count') is not None:
+        counts["completion_tokens"] = response['eval_count']
+    return counts
+
+
+def _set_token_counts(span, response):
+    """Copy Ollama's prompt/completion token counts from a final response onto a span."""
+    span.set(**_token_counts(response))
+
+
+def _generation_key(kind, messages, options):
+    """Identity of a model request, so identical requests in flight share one generation."""
+    payload = json.dumps([MODEL_NAME, kind, messages, options], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _stream_generation(messages, progress):
+    """Stream the model's answer on a scheduler thread, reporting the SQL so far to ``progress``."""
+    extractor = SQLExtractor()
+    generation = {"chunks": 0}
+    started = time.perf_counter()
+    stream = ollama.chat(
+        model=MODEL_NAME, messages=messages, stream=True, options=OLLAMA_OPTIONS, keep_alive=OLLAMA_KEEP_ALIVE
+    )
+    try:
+        for chunk in stream:
+            if generation["chunks"] == 0:
+                generation["first_token_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            generation["chunks"] += 1
+            done = extractor.feed(chunk['message']['content'])
+            if chunk.get('done'):
+                generation.update(_token_counts(chunk))
+            # Raises once every caller has gone, which ends the generation below
+            progress(extractor.sql)
+            if done:
+                break
+    finally:
+        # Closing the stream drops the HTTP response, which makes Ollama stop generating
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    generation["sql"] = extractor.finish()
+    generation["complete"] = extractor.complete
+    return generation
+
+
+def _stream_query(messages, on_update=None, session=None, abandoned=None):
+    """Stream the model's answer and stop as soon as a full statement is seen.
+
+    The generation is queued on the process-wide LLM scheduler; ``session``
+    and ``abandoned`` are passed on to it.
+    """
+    with tracing.span("llm.chat", model=MODEL_NAME, streamed=True) as span:
+        generation = llm_scheduler.get_scheduler().run(
+            _generation_key("stream", messages, OLLAMA_OPTIONS),
+            lambda progress: _stream_generation(messages, progress),
+            session=session,
+            on_update=on_update,
+            abandoned=abandoned,
+        )
+        span.set(**{key: generation[key] for key in ("first_token_ms", "prompt_tokens", "completion_tokens")
+                    if key in generation})
+        # Ollama streams about one token per chunk; its exact counts only arrive with the last one
+        span.attributes.setdefault("completion_tokens", generation["chunks"])
+        span.set(stopped_early=generation["complete"])
+    return generation["sql"], generation["complete"]
+
+
+SYSTEM_PROMPT = (
+    'You are a MySQL query generator. You will generate a MySQL query based on the user\'s request. The query should be formatted correctly and include a semicolon at the end. Do not include any additional text or explanations. The query should be formatted correctly and include a semicolon at the end.and only give me the query and nothing else not even a here is the query or any other text. Just the query itself.'
+    "The query should be a valid MySQL query that can be executed on the database. and autocorrect the table names and column names if they are not correct. If the query is not valid, return an error message indicating that the query is invalid."
     'as you have the schema make sure that the query is valid and the table names and column names are correct.'
-    ,
-    },
-  {
-    'role': 'system',
-    'content': 'You are a MySQL query generator. You will generate a MySQL query based on the user\'s request. The query should be formatted correctly and include a semicolon at the end. Do not include any additional text or explanations. The query should be formatted correctly and include a semicolon at the end.and only give me the query and nothing else not even a here is the query or any other text. Just the query itself.'  
-    ,
-  }
-])
-    query=response['message']['content']
-    new_query = query.replace("sql", "")
-    new_query = new_query.replace("```", "")
-    return new_query.strip()  # Return the generated query without leading/trailing whitespace
+    ' To change data you may give several INSERT, UPDATE or DELETE statements, each ending with a semicolon; they run together in one transaction.'
+)
+# Rendered schema blocks kept per catalog (one per distinct table selection)
+SCHEMA_BLOCK_CACHE_SIZE = 64
+# First line of every schema block
+SCHEMA_BLOCK_HEADER = "The database schema, as MySQL DDL:\n"
+
+
+def schema_block(catalog, tables) -> str:
+    """Schema text for a selection of tables, rendered once per catalog fingerprint.
+
+    Tables are serialized as compact DDL by schema_prompt, whose per-table
+    text is cached on the catalog as well. The catalog is replaced when the
+    schema fingerprint changes, so repeated questions send byte-identical
+    prefixes.
+    """
+    blocks = catalog.setdefault("prompt_blocks", {})
+    key = tuple(tables)
+    block = blocks.get(key)
+    if block is None:
+        ddl, _ = schema_prompt.render_schema(catalog, tables)
+        block = SCHEMA_BLOCK_HEADER + ddl
+        if len(blocks) >= SCHEMA_BLOCK_CACHE_SIZE:
+            blocks.pop(next(iter(blocks)))
+        blocks[key] = block
+    return block
+
+
+def build_messages(prompt: str, catalog, examples=None) -> list:
+    """Build the chat messages sent to the model for a question.
+
+    The layout is stable so Ollama can reuse the evaluated prompt prefix
+    between questions: the system prompt and schema block come first and
+    only change with the schema fingerprint (or the table selection, for
+    schemas too large to send whole), then ``examples`` - past (question,
+    SQL) pairs from the similarity index sent as earlier conversation turns
+    (few-shot prompting) - and the question last.
+    """
+    # Only the tables relevant to the question (plus their join neighbours) go into the prompt;
+    # they keep catalog order so questions about overlapping tables share a longer prefix
+    if catalog:
+        selected = set(schema_index.select_tables(catalog, prompt))
+        tables = [table_name for table_name in catalog["tables"] if table_name in selected]
+    else:
+        tables = []
+    system = SYSTEM_PROMPT
+    if catalog:
+        system += "\n\n" + schema_block(catalog, tables)
+    messages = [{'role': 'system', 'content': system}]
+    for example in examples or []:
+        messages.append({'role': 'user', 'content': f"Generate a MySQL query based on the following prompt: {example['question']}"})
+        messages.append({'role': 'assistant', 'content': example['sql']})
+    messages.append({'role': 'user', 'content': f"Generate a MySQL query based on the following prompt: {prompt}"})
+    return messages
+
+
+def preload_model(catalog=None) -> bool:
+    """Load the model into Ollama's memory ahead of the first question.
+
+    With a schema ``catalog`` the system prompt and full schema block are
+    evaluated as well, so the first question only pays for its own tokens.
+    When the schema is pruned per question (schema_index.prunes), questions
+    share no table selection, so only the system prompt and the schema
+    block's header are evaluated. Uses the same ``OLLAMA_OPTIONS`` as
+    generation: a different ``num_ctx`` would make Ollama reload the model.
+    Returns False if Ollama failed.
+    """
+    if catalog and schema_index.prunes(catalog):
+        messages = [{'role': 'system', 'content': f"{SYSTEM_PROMPT}\n\n{SCHEMA_BLOCK_HEADER}"}]
+        options = {**OLLAMA_OPTIONS, "num_predict": 1}
+    elif catalog:
+        messages = build_messages("", catalog)[:1]
+        options = {**OLLAMA_OPTIONS, "num_predict": 1}
+    else:
+        # An empty conversation only loads the model
+        messages = []
+        options = OLLAMA_OPTIONS
+    try:
+        with tracing.span("llm.preload", model=MODEL_NAME, schema=bool(catalog)) as span:
+            response = llm_scheduler.get_scheduler().run(
+                _generation_key("preload", messages, options),
+                lambda progress: ollama.chat(
+                    model=MODEL_NAME, messages=messages, options=options, keep_alive=OLLAMA_KEEP_ALIVE
+                ),
+            )
+            _set_token_counts(span, response)
+    except Exception as err:
+        print(f"Error preloading model: {err}")
+        return False
+    return True
+
+
+def generate_mysql_query(prompt: str,connection=None, with_metadata=False, use_cache=True, stream=False, on_update=None, catalog=None,
+                         session=None, abandoned=None):
+    """Generate a MySQL query based on the provided prompt using Ollama.
+
+    Generated queries are cached per normalized question, model and schema
+    fingerprint. On a cache miss the similarity index of past successful
+    questions is searched: a close paraphrase (same numbers and quoted
+    values and content words) reuses its SQL without calling the model,
+    otherwise the most similar past questions are sent as few-shot examples.
+    Reused SQL is not cached or indexed under the new question. With ``stream=True`` (implied by ``on_update``) the answer is
+    read token by token, ``on_update`` receives the SQL extracted so far, and
+    generation stops at the first complete statement. With
+    ``with_metadata=True`` a ``(query, metadata)`` tuple is returned, where
+    metadata["cache"] is "hit", "similar" (with ``similar_question`` and
+    ``similarity``) or "miss" (with ``few_shot``, the number of examples).
+
+    Pass an already fetched schema ``catalog`` to avoid holding a database
+    connection while the model is generating.
+
+    The model is called through the process-wide llm_scheduler, queued
+    under ``session``; ``abandoned()`` returning True gives up the wait
+    (raising llm_scheduler.LLMRequestShed).
+    """
+    if catalog is None:
+        catalog = sql.get_schema_catalog(connection)
+    cache_key = _cache_key(prompt, catalog)
+    if use_cache:
+        with tracing.span("query_cache.lookup") as span:
+            cached_query = query_cache.get_cache().get(cache_key)
+            span.set(hit=cached_query is not None)
+        if cached_query is not None:
+            if on_update is not None:
+                on_update(cached_query)
+            return (cached_query, {"cache": "hit"}) if with_metadata else cached_query
+
+    examples = []
+    if use_cache and catalog:
+        index = question_index.get_index(catalog["key"])
+        with tracing.span("question_index.search", entries=len(index)) as span:
+            matches = index.search(prompt, k=question_index.QUESTION_FEW_SHOT_K)
+            reusable = index.find_reusable(prompt) if matches else None
+            span.set(best_score=round(matches[0]["score"], 3) if matches else None, reused=reusable is not None)
+        if reusable is not None:
+            index.touch(reusable["question"])
+            # Not cached under this question: a wrong match would otherwise be served as a hit for the TTL
+            if on_update is not None:
+                on_update(reusable["sql"])
+            metadata = {
+                "cache": "similar",
+                "similar_question": reusable["question"],
+                "similarity": reusable["score"],
+            }
+            return (reusable["sql"], metadata) if with_metadata else reusable["sql"]
+        examples = [match for match in matches if match["score"] >= question_index.QUESTION_FEW_SHOT_MIN_SCORE]
+
+    with tracing.span("prompt.build") as span:
+        messages = build_messages(prompt, catalog, examples)
+        prompt_text = "".join(message['content'] for message in messages)
+        # Estimated here so the prompt size is known even when Ollama's count never arrives
+        span.set(prompt_chars=len(prompt_text), prompt_tokens=schema_prompt.count_tokens(prompt_text))
+    metadata = {"cache": "miss", "few_shot": len(examples)}
+    if stream or on_update is not None:
+        new_query, stopped_early = _stream_query(messages, on_update, session=session, abandoned=abandoned)
+        metadata["streamed"] = True
+        metadata["stopped_early"] = stopped_early
+    else:
+        with tracing.span("llm.chat", model=MODEL_NAME, streamed=False) as span:
+            response = llm_scheduler.get_scheduler().run(
+                _generation_key("chat", messages, OLLAMA_OPTIONS),
+                lambda progress: ollama.chat(
+                    model=MODEL_NAME, messages=messages, options=OLLAMA_OPTIONS, keep_alive=OLLAMA_KEEP_ALIVE
+                ),
+                session=session,
+                abandoned=abandoned,
+            )
+            _set_token_counts(span, response)
+        new_query = extract_sql(response['message']['content'])
+
+    if use_cache and new_query:
+        remember_query(prompt, new_query, catalog)
+    return (new_query, metadata) if with_metadata else new_query
 
  
\ No newline at end of file
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Maximum number of generated queries kept in memory
+QUERY_CACHE_SIZE = 512
+# Seconds a generated query stays valid, in memory and on disk
+QUERY_CACHE_TTL = 7 * 24 * 3600
+# On-disk store that survives Streamlit restarts
+QUERY_CACHE_PATH = os.environ.get(
+    "DB_CHATBOT_QUERY_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "database_chatbot", "query_cache.sqlite3"),
+)
+
+
+def normalize_question(question):
+    """Normalize a question so trivially different phrasings share a cache entry."""
+    question = question.lower().strip()
+    question = re.sub(r"\s+", " ", question)
+    return question.rstrip(" ?.!;")
+
+
+def make_key(question, model, database_key, fingerprint):
+    """Build the cache key for a question asked against one schema version."""
+    raw = "\x1f".join([normalize_question(question), model, str(database_key), str(fingerprint)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class QueryCache:
+    """LRU+TTL cache of generated SQL backed by a SQLite file."""
+
+    def __init__(self, path=QUERY_CACHE_PATH, max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_enabled = self._init_disk()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def _init_disk(self):
+        if not self.path:
+            return False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with self._connect() as db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS generated_queries ("
+                    "key TEXT PRIMARY KEY, database_key TEXT, fingerprint TEXT, "
+                    "sql TEXT, created_at REAL)"
+                )
+                db.execute(
+                    "CREATE INDEX IF NOT EXISTS generated_queries_database "
+                    "ON generated_queries (database_key)"
+                )
+                db.execute("DELETE FROM generated_queries WHERE created_at < ?", (time.time() - self.ttl,))
+            return True
+        except sqlite3.Error as err:
+            print(f"Query cache disabled on disk: {err}")
+            return False
+
+    def _remember(self, key, sql, created_at):
+        self._entries[key] = (sql, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached SQL for a key, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[1] < self.ttl:
+                    self._entries.move_to_end(key)
+                    return entry[0]
+                del self._entries[key]
+
+        if not self._disk_enabled:
+            return None
+        try:
+            with self._connect() as db:
+                row = db.execute(
+                    "SELECT sql, created_at FROM generated_queries WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as err:
+            print(f"Error reading query cache: {err}")
+            return None
+        if row is None or now - row[1] >= self.ttl:
+            return None
+        with self._lock:
+            self._remember(key, row[0], row[1])
+        return row[0]
+
+    def put(self, key, sql, database_key, fingerprint):
+        """Store generated SQL and drop disk entries for older schema versions."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, sql, now)
+        if not self._disk_enabled:
+            return
+        try:
+            with self._connect() as db:
+                db.execute(
+                    "DELETE FROM generated_queries WHERE database_key = ? AND fingerprint != ?",
+                    (str(database_key), str(fingerprint)),
+                )
+                db.execute(
+                    "INSERT OR REPLACE INTO generated_queries VALUES (?, ?, ?, ?, ?)",
+                    (key, str(database_key), str(fingerprint), sql, now),
+                )
+        except sqlite3.Error as err:
+            print(f"Error writing query cache: {err}")
+
+    def discard(self, key):
+        """Forget a cached query, for example after it failed to execute."""
+        with self._lock:
+            self._entries.pop(key, None)
+        if not self._disk_enabled:
+            return
+        try:
+            with self._connect() as db:
+                db.execute("DELETE FROM generated_queries WHERE key = ?", (key,))
+        except sqlite3.Error as err:
+            print(f"Error writing query cache: {err}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide query cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = QueryCache()
+        return _cache
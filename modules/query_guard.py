@@ -0,0 +1,282 @@
+import json
+import re
+
+import pymysql
+
+try:
+    from . import tracing
+    from . import validation
+except ImportError:
+    import tracing
+    import validation
+
+# Check generated SELECTs with EXPLAIN before running them
+GUARD_ENABLED = True
+# Row cap injected into SELECTs without a LIMIT (and the ceiling larger LIMITs are tightened to)
+GUARD_ROW_LIMIT = 10000
+# MAX_EXECUTION_TIME hint added to SELECTs, in milliseconds (0 disables)
+GUARD_MAX_EXECUTION_TIME_MS = 30000
+# Estimated rows examined above which a query needs confirmation before it runs
+GUARD_CONFIRM_ROWS_EXAMINED = 1_000_000
+# Estimated rows examined above which a query is refused outright
+GUARD_REFUSE_ROWS_EXAMINED = 100_000_000
+# Full scans of tables with at least this many rows need confirmation
+GUARD_FULL_SCAN_ROWS = 500_000
+
+# Plan keys whose contents run independently of the enclosing join (row estimates restart at 1)
+_SUBQUERY_KEYS = {
+    "attached_subqueries",
+    "optimized_away_subqueries",
+    "materialized_from_subquery",
+    "query_specifications",
+    "select_list_subqueries",
+    "having_subqueries",
+    "order_by_subqueries",
+    "group_by_subqueries",
+}
+_FULL_SCAN_ACCESS_TYPES = {"ALL", "index"}
+_LIMIT_PATTERN = re.compile(
+    r"\blimit\s+(?:(\d+)\s*,\s*)?(\d+)(?:\s+offset\s+(\d+))?", re.IGNORECASE
+)
+_LOCKING_CLAUSE = re.compile(r"\b(?:for\s+update|for\s+share|lock\s+in\s+share\s+mode|into)\b", re.IGNORECASE)
+
+
+def _mask(query):
+    """Blank out strings, comments and parenthesized text, keeping offsets.
+
+    Whatever is left matches only top-level clauses of the statement.
+    """
+    masked = list(query)
+    depth = 0
+    i = 0
+    while i < len(query):
+        char = query[i]
+        end = None
+        if char in "'\"`":
+            end = i + 1
+            while end < len(query) and query[end] != char:
+                end += 2 if query[end] == "\\" and char != "`" else 1
+            end += 1
+        elif query.startswith("/*", i):
+            close = query.find("*/", i + 2)
+            end = len(query) if close < 0 else close + 2
+        elif char == "#" or query.startswith("-- ", i):
+            close = query.find("\n", i)
+            end = len(query) if close < 0 else close
+        if end is not None:
+            for j in range(i, min(end, len(query))):
+                masked[j] = " "
+            i = end
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth = max(depth - 1, 0)
+            masked[i] = " "
+        if depth > 0:
+            masked[i] = " "
+        i += 1
+    return "".join(masked)
+
+
+def is_guardable(query):
+    """Only SELECTs (including WITH ... SELECT and parenthesized queries) are explained and rewritten."""
+    return validation.statement_kind(query) == "select"
+
+
+def _main_select(query):
+    """Match of the SELECT keyword that starts the statement's outer query block, or None.
+
+    That is the first top-level SELECT (after any WITH clause), or for a
+    parenthesized query such as ``(SELECT ...) UNION (SELECT ...)`` the
+    first SELECT inside the leading parentheses.
+    """
+    match = re.search(r"\bselect\b", _mask(query), re.IGNORECASE)
+    return match or re.match(r"[\s(]*(select)\b", query, re.IGNORECASE)
+
+
+def apply_row_limit(query, row_limit=None):
+    """Add a top-level LIMIT or tighten a larger one; returns (query, limit_applied)."""
+    row_limit = GUARD_ROW_LIMIT if row_limit is None else row_limit
+    stripped = query.strip()
+    semicolon = stripped.endswith(";")
+    body = stripped.rstrip(";").rstrip()
+    masked = _mask(body)
+
+    matches = list(_LIMIT_PATTERN.finditer(masked))
+    if matches:
+        match = matches[-1]
+        if int(match.group(2)) <= row_limit:
+            return query, None
+        body = body[:match.start(2)] + str(row_limit) + body[match.end(2):]
+        applied = "tightened"
+    else:
+        # LIMIT has to come before a trailing locking or INTO clause
+        last_from = max((m.end() for m in re.finditer(r"\bfrom\b", masked, re.IGNORECASE)), default=0)
+        trailing = _LOCKING_CLAUSE.search(masked, last_from)
+        position = trailing.start() if trailing else len(body)
+        head = body[:position].rstrip()
+        # Start a new line if the clause would otherwise end up inside a trailing -- or # comment
+        separator = "\n" if re.search(r"(--\s|#)[^\n]*$", head) else " "
+        body = f"{head}{separator}LIMIT {row_limit}" + (f" {body[position:]}" if trailing else "")
+        applied = "added"
+    return body + (";" if semicolon else ""), applied
+
+
+def add_execution_time_hint(query, max_execution_ms=None):
+    """Add a MAX_EXECUTION_TIME optimizer hint to a SELECT unless it already has one."""
+    max_execution_ms = GUARD_MAX_EXECUTION_TIME_MS if max_execution_ms is None else max_execution_ms
+    if not max_execution_ms or re.search(r"max_execution_time\s*\(", query, re.IGNORECASE):
+        return query
+    select = _main_select(query)
+    if select is None:
+        return query
+    hint = f"MAX_EXECUTION_TIME({int(max_execution_ms)})"
+    end = select.end()
+    existing = re.match(r"\s*/\*\+", query[end:])
+    if existing:
+        end += existing.end()
+        return f"{query[:end]} {hint}{query[end:]}"
+    return f"{query[:end]} /*+ {hint} */{query[end:]}"
+
+
+def _walk_table(table, stats, prefix):
+    scanned = float(table.get("rows_examined_per_scan") or 0)
+    stats["rows_examined"] += scanned * prefix
+    if table.get("access_type") in _FULL_SCAN_ACCESS_TYPES:
+        stats["full_scans"].append({"table": table.get("table_name"), "rows": int(scanned)})
+    for key, value in table.items():
+        if key in _SUBQUERY_KEYS:
+            _walk_subqueries(value, stats)
+    produced = table.get("rows_produced_per_join")
+    return float(produced) if produced is not None else scanned * prefix
+
+
+def _walk_subqueries(value, stats):
+    for item in value if isinstance(value, list) else [value]:
+        _walk(item, stats, 1.0)
+
+
+def _walk(node, stats, prefix):
+    """Accumulate estimated rows examined under a plan node; return rows it produces."""
+    if isinstance(node, list):
+        # Nested-loop joins: each table is scanned once per row produced so far
+        for item in node:
+            prefix = _walk(item, stats, prefix)
+        return prefix
+    if not isinstance(node, dict):
+        return prefix
+    produced = prefix
+    for key, value in node.items():
+        if key == "table" and isinstance(value, dict):
+            produced = _walk_table(value, stats, prefix)
+        elif key in _SUBQUERY_KEYS:
+            _walk_subqueries(value, stats)
+        elif isinstance(value, (dict, list)):
+            produced = _walk(value, stats, prefix)
+    return produced
+
+
+def estimate_cost(plan):
+    """Summarize an EXPLAIN FORMAT=JSON plan: rows examined, query cost and full scans."""
+    stats = {"rows_examined": 0.0, "full_scans": []}
+    _walk(plan, stats, 1.0)
+    query_cost = None
+    cost_info = plan.get("query_block", {}).get("cost_info", {})
+    if cost_info.get("query_cost") is not None:
+        query_cost = float(cost_info["query_cost"])
+    return {
+        "rows_examined": int(stats["rows_examined"]),
+        "query_cost": query_cost,
+        "full_scans": stats["full_scans"],
+    }
+
+
+def explain_query(connection, query):
+    """Return the EXPLAIN FORMAT=JSON plan of a query, or None if it cannot be explained."""
+    cursor = connection.cursor(pymysql.cursors.Cursor)
+    try:
+        cursor.execute(f"EXPLAIN FORMAT=JSON {query.strip().rstrip(';')}")
+        row = cursor.fetchone()
+        return json.loads(row[0]) if row else None
+    except (pymysql.Error, ValueError, TypeError) as err:
+        print(f"Error explaining query: {err}")
+        return None
+    finally:
+        cursor.close()
+
+
+def check_query(connection, query):
+    """Rewrite a generated SELECT within the guard's limits and judge its estimated cost.
+
+    Returns a report dict with the rewritten ``query``, the ``original``,
+    ``limit`` ("added", "tightened" or None), ``max_execution_time_ms``,
+    ``rows_examined``, ``query_cost``, ``full_scans`` and a ``verdict`` of
+    "ok", "confirm" or "refuse" with its ``reason``. Statements other than
+    SELECT, and queries EXPLAIN rejects, pass through with verdict "ok";
+    MySQL reports their errors when they run.
+    """
+    report = {
+        "original": query,
+        "query": query,
+        "limit": None,
+        "row_limit": None,
+        "max_execution_time_ms": None,
+        "rows_examined": None,
+        "query_cost": None,
+        "full_scans": [],
+        "verdict": "ok",
+        "reason": None,
+    }
+    if not GUARD_ENABLED or not is_guardable(query):
+        return report
+
+    with tracing.span("guard.explain") as span:
+        limited, report["limit"] = apply_row_limit(query)
+        if report["limit"]:
+            report["row_limit"] = GUARD_ROW_LIMIT
+        rewritten = add_execution_time_hint(limited)
+        if rewritten != limited:
+            report["max_execution_time_ms"] = GUARD_MAX_EXECUTION_TIME_MS
+        report["query"] = rewritten
+
+        plan = explain_query(connection, rewritten)
+        if plan is None:
+            span.set(explained=False)
+            return report
+        report.update(estimate_cost(plan))
+        span.set(explained=True, rows_examined=report["rows_examined"], query_cost=report["query_cost"])
+
+    large_scans = [scan for scan in report["full_scans"] if scan["rows"] >= GUARD_FULL_SCAN_ROWS]
+    if report["rows_examined"] > GUARD_REFUSE_ROWS_EXAMINED:
+        report["verdict"] = "refuse"
+        report["reason"] = (
+            f"estimated {report['rows_examined']:,} rows examined, "
+            f"over the limit of {GUARD_REFUSE_ROWS_EXAMINED:,}"
+        )
+    elif report["rows_examined"] > GUARD_CONFIRM_ROWS_EXAMINED:
+        report["verdict"] = "confirm"
+        report["reason"] = f"estimated {report['rows_examined']:,} rows examined"
+    elif large_scans:
+        report["verdict"] = "confirm"
+        report["reason"] = "full scan of " + ", ".join(
+            f"{scan['table']} (~{scan['rows']:,} rows)" for scan in large_scans
+        )
+    return report
+
+
+def describe_cost(report):
+    """One-line summary of a guard report's estimated and actual cost for display."""
+    parts = []
+    if report.get("rows_examined") is not None:
+        estimate = f"est. ~{report['rows_examined']:,} rows examined"
+        if report.get("query_cost") is not None:
+            estimate += f", cost {report['query_cost']:,.1f}"
+        parts.append(estimate)
+    if report.get("full_scans"):
+        parts.append("full scan: " + ", ".join(str(scan["table"]) for scan in report["full_scans"]))
+    if report.get("limit"):
+        parts.append(f"LIMIT {report['row_limit']:,} {report['limit']}")
+    if report.get("actual_rows") is not None:
+        parts.append(f"actual {report['actual_rows']:,} rows in {report['actual_ms']:,.0f} ms")
+    return " · ".join(parts)
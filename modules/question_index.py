@@ -0,0 +1,239 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+try:
+    from .query_cache import normalize_question
+except ImportError:
+    from query_cache import normalize_question
+
+# Hashed feature dimensions of a question vector
+QUESTION_INDEX_DIMENSIONS = 2048
+# Cosine similarity at or above which a past question's SQL is reused without calling the LLM
+QUESTION_REUSE_THRESHOLD = 0.92
+# Past questions injected as few-shot examples when nothing is similar enough to reuse
+QUESTION_FEW_SHOT_K = 3
+# Minimum cosine similarity for a past question to be used as a few-shot example
+QUESTION_FEW_SHOT_MIN_SCORE = 0.35
+# Questions remembered per database; the least recently used are dropped first
+QUESTION_INDEX_MAX_ENTRIES = 2000
+# Directory with one JSON file of past questions per database
+QUESTION_INDEX_DIR = os.environ.get(
+    "DB_CHATBOT_QUESTION_INDEX",
+    os.path.join(os.path.expanduser("~"), ".cache", "database_chatbot", "question_index"),
+)
+
+_WORD = re.compile(r"[a-z0-9_]+")
+# Numbers and quoted values must match exactly for SQL to be reused ("top 5" is not "top 10")
+_LITERAL = re.compile(r"'[^']*'|\"[^\"]*\"|\b\d+(?:\.\d+)?\b")
+# Words that don't change what a question asks for; ignored when comparing content words
+_STOPWORDS = frozenset("""
+    a an the of in on at to for by with from into about as and
+    is are was were be been being has have had do does did
+    i me my we our you your it its this that these those there their them they
+    what which who whom whose whats please can could would should will shall
+    show list give get find display tell return all each every
+""".split())
+# Words that negate what follows them
+_NEGATIONS = frozenset("not no never without none nor neither except excluding exclude non".split())
+# Words that set a sort direction or pick an end of a ranking; their order matters too
+_DIRECTIONS = frozenset("""
+    asc ascending desc descending increasing decreasing highest lowest largest smallest biggest
+    greatest fewest most least top bottom first last oldest newest earliest latest
+""".split())
+
+
+def _features(question):
+    words = _WORD.findall(normalize_question(question))
+    features = [f"w:{word}" for word in words]
+    features += [f"b:{first} {second}" for first, second in zip(words, words[1:])]
+    for word in words:
+        padded = f"<{word}>"
+        features += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    return features
+
+
+def embed(question, dimensions=None):
+    """L2-normalized hashed word, word-bigram and character-trigram vector of a question."""
+    dimensions = dimensions or QUESTION_INDEX_DIMENSIONS
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for feature in _features(question):
+        # crc32 is stable across processes, unlike hash(), so persisted indexes stay valid
+        hashed = zlib.crc32(feature.encode("utf-8"))
+        vector[hashed % dimensions] += 1.0 if hashed & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def literals(question):
+    """The numbers and quoted values a question mentions."""
+    return sorted(_LITERAL.findall(question.lower()))
+
+
+def _stem(word):
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def content_signature(question):
+    """What a question asks for, beyond its wording: (content words, negations and sort words in order).
+
+    Content words are the question's words without stopwords, plurals
+    folded. Each negation is kept with the word it negates, and sort
+    direction words in the order they appear, so "shipped" vs "not shipped"
+    and "highest to lowest" vs "lowest to highest" differ.
+    """
+    words = [_stem(word) for word in _WORD.findall(re.sub(r"n't\b", " not", normalize_question(question)))]
+    content = [word for word in words if word not in _STOPWORDS]
+    markers = []
+    for i, word in enumerate(content):
+        if word in _NEGATIONS:
+            markers.append(f"{word} {content[i + 1]}" if i + 1 < len(content) else word)
+        elif word in _DIRECTIONS:
+            markers.append(word)
+    return frozenset(content), tuple(markers)
+
+
+class QuestionIndex:
+    """Past (question, SQL) pairs of one database with cosine similarity search."""
+
+    def __init__(self, database_key, path=None, max_entries=QUESTION_INDEX_MAX_ENTRIES):
+        self.database_key = database_key
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = []
+        self._matrix = np.zeros((0, QUESTION_INDEX_DIMENSIONS), dtype=np.float32)
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as handle:
+                entries = json.load(handle)["entries"]
+        except (OSError, ValueError, KeyError) as err:
+            print(f"Error loading question index: {err}")
+            return
+        self._entries = entries[-self.max_entries:]
+        self._rebuild()
+
+    def _rebuild(self):
+        if self._entries:
+            self._matrix = np.vstack([embed(entry["question"]) for entry in self._entries])
+        else:
+            self._matrix = np.zeros((0, QUESTION_INDEX_DIMENSIONS), dtype=np.float32)
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as handle:
+                json.dump({"database_key": list(self.database_key), "entries": self._entries}, handle)
+            os.replace(temp_path, self.path)
+        except OSError as err:
+            print(f"Error saving question index: {err}")
+
+    def search(self, question, k=QUESTION_FEW_SHOT_K):
+        """Return up to k past entries most similar to a question, each with a ``score``."""
+        vector = embed(question)
+        with self._lock:
+            if not self._entries:
+                return []
+            scores = self._matrix @ vector
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [{**self._entries[i], "score": float(scores[i])} for i in top]
+
+    def find_reusable(self, question, threshold=None):
+        """Return a past entry whose SQL can answer this question as is, or None.
+
+        Besides the similarity threshold, the past question must mention the
+        same numbers and quoted values and have the same content_signature: a
+        single different word ("France" vs "Spain") changes the SQL, however
+        close the vectors are. Near misses are only few-shot examples.
+        """
+        threshold = QUESTION_REUSE_THRESHOLD if threshold is None else threshold
+        matches = self.search(question, k=1)
+        if not matches or matches[0]["score"] < threshold:
+            return None
+        if literals(matches[0]["question"]) != literals(question):
+            return None
+        if content_signature(matches[0]["question"]) != content_signature(question):
+            return None
+        return matches[0]
+
+    def add(self, question, sql):
+        """Remember a question whose SQL executed successfully."""
+        normalized = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            for entry in self._entries:
+                if normalize_question(entry["question"]) == normalized:
+                    entry.update(sql=sql, used_at=now)
+                    break
+            else:
+                self._entries.append({"question": question, "sql": sql, "created_at": now, "used_at": now})
+                self._matrix = np.vstack([self._matrix, embed(question)[None, :]])
+                if len(self._entries) > self.max_entries:
+                    oldest = min(range(len(self._entries)), key=lambda j: self._entries[j]["used_at"])
+                    del self._entries[oldest]
+                    self._matrix = np.delete(self._matrix, oldest, axis=0)
+            self._save()
+
+    def touch(self, question):
+        """Mark a past question as just used so it is evicted last."""
+        normalized = normalize_question(question)
+        with self._lock:
+            for entry in self._entries:
+                if normalize_question(entry["question"]) == normalized:
+                    entry["used_at"] = time.time()
+
+    def forget(self, question=None, sql=None):
+        """Drop entries for a question or with a given SQL, e.g. after it failed."""
+        normalized = normalize_question(question) if question else None
+        with self._lock:
+            keep = [
+                i for i, entry in enumerate(self._entries)
+                if not (normalized and normalize_question(entry["question"]) == normalized)
+                and not (sql and entry["sql"] == sql)
+            ]
+            if len(keep) == len(self._entries):
+                return
+            self._entries = [self._entries[i] for i in keep]
+            self._matrix = self._matrix[keep]
+            self._save()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def index_path(database_key):
+    """File of a database's question index inside QUESTION_INDEX_DIR."""
+    if not QUESTION_INDEX_DIR:
+        return None
+    digest = hashlib.sha1(str(database_key).encode("utf-8")).hexdigest()[:12]
+    name = re.sub(r"[^A-Za-z0-9_-]+", "_", str(database_key[-1]))
+    return os.path.join(QUESTION_INDEX_DIR, f"{name}-{digest}.json")
+
+
+def get_index(database_key):
+    """Return the question index of a database, loading it from disk on first use."""
+    database_key = tuple(database_key)
+    with _indexes_lock:
+        index = _indexes.get(database_key)
+        if index is None:
+            index = _indexes[database_key] = QuestionIndex(database_key, path=index_path(database_key))
+        return index
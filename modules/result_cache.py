@@ -0,0 +1,179 @@
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+# The result cache is opt-in; execute_query(use_cache=True) or this flag turns it on
+RESULT_CACHE_ENABLED = False
+# Approximate bytes of cached results kept per process
+RESULT_CACHE_MEMORY_BUDGET = 128 * 1024 * 1024
+# Results larger than this share of the budget are never cached
+RESULT_CACHE_MAX_ENTRY_SHARE = 0.25
+# Seconds a cached result is served without being re-executed
+RESULT_CACHE_TTL = 300
+# Re-check information_schema UPDATE_TIME of the involved tables before serving a hit.
+# MySQL 8 caches UPDATE_TIME for information_schema_stats_expiry seconds, so set
+# that variable to 0 on the server for this check to see changes immediately.
+RESULT_CACHE_CHECK_UPDATE_TIME = True
+
+_IDENTIFIER = r"(?:`[^`]+`|[A-Za-z0-9_$]+)(?:\s*\.\s*(?:`[^`]+`|[A-Za-z0-9_$]+))?"
+_TABLE_PATTERNS = [
+    re.compile(r"\b(?:from|join|update|into|truncate(?:\s+table)?|table)\s+(" + _IDENTIFIER + r")", re.IGNORECASE),
+    # Comma-separated FROM lists: FROM a, b
+    re.compile(
+        r",\s*(" + _IDENTIFIER + r")(?:\s+(?:as\s+)?[A-Za-z0-9_$]+)?"
+        r"(?=\s*(?:,|\bwhere\b|\bjoin\b|\bgroup\b|\border\b|\bhaving\b|\blimit\b|\bunion\b|\)|;|$))",
+        re.IGNORECASE,
+    ),
+]
+_NOT_TABLES = {"select", "dual", "set", "values", "lateral", "if", "exists", "where", "table"}
+
+
+def normalize_sql(query):
+    """Collapse whitespace outside quoted strings and drop a trailing semicolon."""
+    parts = re.split(r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`[^`]*`)""", query.strip())
+    normalized = []
+    for i, part in enumerate(parts):
+        normalized.append(part if i % 2 else re.sub(r"\s+", " ", part))
+    return "".join(normalized).strip().rstrip(";").strip()
+
+
+def _strip_literals(query):
+    return re.sub(r"""'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*\"""", "''", query)
+
+
+def extract_tables(query):
+    """Best-effort set of (lowercase, unqualified) table names a statement touches."""
+    query = _strip_literals(query)
+    tables = set()
+    for pattern in _TABLE_PATTERNS:
+        for match in pattern.finditer(query):
+            name = match.group(1).split(".")[-1].strip().strip("`").lower()
+            if name and name not in _NOT_TABLES:
+                tables.add(name)
+    return tables
+
+
+def estimate_size(result):
+    """Approximate in-memory size of a cached result in bytes."""
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(deep=True, index=True).sum())
+    size = sys.getsizeof(result)
+    for row in result:
+        size += sys.getsizeof(row)
+        if isinstance(row, dict):
+            size += sum(sys.getsizeof(key) + sys.getsizeof(value) for key, value in row.items())
+    return size
+
+
+class ResultCache:
+    """Size-aware LRU cache of read query results with per-table invalidation.
+
+    Entries are keyed by (database_key, normalized SQL), where database_key is
+    the (server, database) pair from sql_connector.catalog_key. Table
+    invalidation applies to every database on the same server, so writes
+    through database-qualified names are never missed.
+    """
+
+    def __init__(self, memory_budget=RESULT_CACHE_MEMORY_BUDGET, ttl=RESULT_CACHE_TTL):
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._by_table = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._size -= entry["size"]
+        for table in entry["tables"]:
+            keys = self._by_table.get((key[0][0], table))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[(key[0][0], table)]
+
+    def get(self, database_key, query):
+        """Return the cache entry for a query, or None on a miss."""
+        key = (database_key, normalize_sql(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry["stored_at"] >= self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, database_key, query, result, update_times=None):
+        """Cache a complete read result, evicting least recently used entries to fit."""
+        key = (database_key, normalize_sql(query))
+        size = estimate_size(result)
+        if size > self.memory_budget * RESULT_CACHE_MAX_ENTRY_SHARE:
+            return False
+        tables = extract_tables(query)
+        with self._lock:
+            self._remove(key)
+            while self._entries and self._size + size > self.memory_budget:
+                self._remove(next(iter(self._entries)))
+            self._entries[key] = {
+                "result": result,
+                "size": size,
+                "tables": tables,
+                "update_times": update_times or {},
+                "stored_at": time.monotonic(),
+            }
+            self._size += size
+            for table in tables:
+                self._by_table.setdefault((database_key[0], table), set()).add(key)
+        return True
+
+    def discard(self, database_key, query):
+        with self._lock:
+            self._remove((database_key, normalize_sql(query)))
+
+    def invalidate_tables(self, database_key, tables):
+        """Drop every cached result on the server that reads any of the given tables."""
+        with self._lock:
+            for table in tables:
+                for key in list(self._by_table.get((database_key[0], table.lower()), ())):
+                    self._remove(key)
+
+    def invalidate_database(self, database_key):
+        """Drop every cached result for one database."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == database_key]:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "memory_budget": self.memory_budget,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Return the process-wide result cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
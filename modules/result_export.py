@@ -0,0 +1,220 @@
+import gzip
+import os
+import tempfile
+import time
+import uuid
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+try:
+    from . import sql_connector as sql
+    from . import tracing
+    from .result_store import to_arrow
+except ImportError:
+    import sql_connector as sql
+    import tracing
+    from result_store import to_arrow
+
+# Rows read from the server-side cursor and written per chunk
+EXPORT_CHUNK_SIZE = 50_000
+# Directory export files are written to
+EXPORT_DIR = os.environ.get(
+    "DB_CHATBOT_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "database_chatbot_exports")
+)
+# Export files older than this many seconds are deleted when the next export starts
+EXPORT_MAX_AGE = 3600
+# Seconds an export query may run before it is killed; longer than QUERY_TIMEOUT, as it reads the full result
+EXPORT_TIMEOUT = int(os.environ.get("DB_CHATBOT_EXPORT_TIMEOUT", "600"))
+# Largest export file; the export stops after the chunk that passes it (Streamlit serves static files up to 200 MB)
+EXPORT_MAX_BYTES = int(os.environ.get("DB_CHATBOT_EXPORT_MAX_BYTES", str(200 * 1024 * 1024)))
+# Largest export handed to the browser through memory (st.download_button keeps the bytes in its media store)
+EXPORT_MAX_MEMORY_DOWNLOAD_BYTES = int(os.environ.get("DB_CHATBOT_EXPORT_MAX_MEMORY_DOWNLOAD_BYTES", str(50 * 1024 * 1024)))
+# Supported formats: file extension and MIME type
+EXPORT_FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "csv.gz": (".csv.gz", "application/gzip"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+
+
+def _unique_columns(columns):
+    """Suffix repeated column names (e.g. two joined ``id`` columns), which Arrow rejects."""
+    seen = {}
+    unique = []
+    for column in map(str, columns):
+        seen[column] = seen.get(column, 0) + 1
+        unique.append(column if seen[column] == 1 else f"{column}_{seen[column]}")
+    return unique
+
+
+class _CSVWriter:
+    def __init__(self, path, compress):
+        # Level 6 compresses almost as well as gzip's default 9 in a fraction of the time
+        self._handle = gzip.open(path, "wb", compresslevel=6) if compress else open(path, "wb")
+        self._header = True
+
+    def write(self, chunk):
+        # Same CSV dialect as StoredResult.to_csv
+        options = pa_csv.WriteOptions(include_header=self._header)
+        pa_csv.write_csv(to_arrow(chunk), self._handle, write_options=options)
+        self._header = False
+
+    def close(self):
+        self._handle.close()
+
+
+class _ParquetWriter:
+    """Writes chunks as row groups; the schema is fixed by the first chunk."""
+
+    def __init__(self, path):
+        self._path = path
+        self._writer = None
+        self._schema = None
+
+    def _initial_schema(self, table):
+        fields = []
+        for field in table.schema:
+            if pa.types.is_null(field.type):
+                # Nothing to infer from an all-NULL first chunk
+                field = field.with_type(pa.string())
+            elif pa.types.is_decimal(field.type):
+                # A chunk's inferred precision only covers its own values; the scale is the column's
+                field = field.with_type(pa.decimal128(38, field.type.scale))
+            fields.append(field)
+        return pa.schema(fields)
+
+    def write(self, chunk):
+        table = to_arrow(chunk)
+        if self._writer is None:
+            self._schema = self._initial_schema(table)
+            self._writer = pq.ParquetWriter(self._path, self._schema)
+        if not table.schema.equals(self._schema):
+            table = pa.Table.from_arrays(
+                [column.cast(field.type) for column, field in zip(table.columns, self._schema)],
+                schema=self._schema,
+            )
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        else:
+            # An empty result still produces a readable file
+            pq.write_table(pa.table({}), self._path)
+
+
+def _open_writer(path, fmt):
+    if fmt == "parquet":
+        return _ParquetWriter(path)
+    return _CSVWriter(path, compress=fmt == "csv.gz")
+
+
+def remove_stale_exports(max_age=None, directory=None):
+    """Delete export files older than ``max_age`` seconds (EXPORT_MAX_AGE by default)."""
+    max_age = EXPORT_MAX_AGE if max_age is None else max_age
+    directory = directory or EXPORT_DIR
+    if not os.path.isdir(directory):
+        return
+    now = time.time()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def remove_export(export):
+    """Delete an export's file if it still exists."""
+    try:
+        os.remove(export["path"])
+    except OSError:
+        pass
+
+
+def export_query(pool, database, query, fmt="csv", chunk_size=None, on_progress=None, control=None,
+                 directory=None):
+    """Re-run a read query over a server-side cursor and stream its full result to a file.
+
+    Rows are written ``chunk_size`` at a time as CSV, gzip-compressed CSV or
+    Parquet into ``directory`` (EXPORT_DIR by default), so memory stays
+    bounded however large the result is. The query runs under ``control``
+    (a new sql.QueryControl with the EXPORT_TIMEOUT deadline if not given),
+    which another thread can use to cancel it. The export stops once the
+    file passes EXPORT_MAX_BYTES and is marked ``truncated``.
+    ``on_progress(rows, bytes)`` is called after every chunk. Returns a dict
+    with ``path``, ``format``, ``file_name``, ``mime``, ``rows``, ``bytes``,
+    ``truncated`` and ``seconds``, or None if the export failed or was
+    stopped (see ``control.reason``).
+    """
+    if fmt not in EXPORT_FORMATS:
+        print(f"Unsupported export format: {fmt}")
+        return None
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    control = control or sql.QueryControl(pool, timeout=EXPORT_TIMEOUT)
+    directory = directory or EXPORT_DIR
+    extension, mime = EXPORT_FORMATS[fmt]
+    path = os.path.join(directory, f"{uuid.uuid4().hex}{extension}")
+
+    started = time.perf_counter()
+    rows = 0
+    truncated = False
+    writer = None
+    try:
+        remove_stale_exports(directory=directory)
+        os.makedirs(directory, exist_ok=True)
+        writer = _open_writer(path, fmt)
+        with tracing.span("export", format=fmt) as span, pool.connection(database, read=True) as connection:
+            chunk_iter = sql.iter_query_chunks(connection, query, chunk_size=chunk_size, control=control)
+            try:
+                for chunk in chunk_iter:
+                    writer.write(chunk.set_axis(_unique_columns(chunk.columns), axis=1))
+                    rows += len(chunk)
+                    size = os.path.getsize(path)
+                    if on_progress is not None:
+                        on_progress(rows, size)
+                    if size > EXPORT_MAX_BYTES:
+                        truncated = True
+                        break
+            finally:
+                # Finish with the cursor before the connection goes back to the pool
+                chunk_iter.close()
+            writer.close()
+            span.set(rows=rows, bytes=os.path.getsize(path), truncated=truncated)
+    except Exception as err:
+        # Anything from a pool timeout to a bad value in a row; the caller only sees None
+        print(f"Error exporting query: {err}")
+        try:
+            if writer is not None:
+                writer.close()
+        except Exception:
+            pass
+        remove_export({"path": path})
+        return None
+    return {
+        "path": path,
+        "format": fmt,
+        "file_name": f"query_results_{database}_{time.strftime('%Y%m%d_%H%M%S')}{extension}",
+        "mime": mime,
+        "rows": rows,
+        "bytes": os.path.getsize(path),
+        "truncated": truncated,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def read_export(export):
+    """Return an export file's bytes; only called when its download is requested.
+
+    The whole file is read into memory, so exports larger than
+    EXPORT_MAX_MEMORY_DOWNLOAD_BYTES are refused (None); serve those from
+    disk instead (see app.py's static file serving).
+    """
+    if os.path.getsize(export["path"]) > EXPORT_MAX_MEMORY_DOWNLOAD_BYTES:
+        print(f"Export too large to download through memory: {export['path']}")
+        return None
+    with open(export["path"], "rb") as handle:
+        return handle.read()
@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import weakref
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+# Bytes of query results a session keeps in memory before older ones spill to disk
+RESULT_MEMORY_LIMIT = 64 * 1024 * 1024
+
+
+def to_arrow(df):
+    """Convert a result DataFrame to an Arrow table with typed columns.
+
+    Columns Arrow cannot infer a single type for (e.g. mixed bytes and
+    strings) are stored as strings rather than failing the whole result.
+    """
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        df = df.copy()
+        for column in df.columns[df.dtypes == object]:
+            df[column] = df[column].map(lambda value: None if value is None else str(value))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+class StoredResult:
+    """A query result held once as an Arrow table, in memory or in an Arrow IPC file."""
+
+    def __init__(self, table):
+        self._table = table
+        self.path = None
+        self.num_rows = table.num_rows
+        self.columns = table.column_names
+        self.nbytes = table.nbytes
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def spilled(self):
+        return self.path is not None
+
+    def table(self):
+        """Return the result as an Arrow table, memory-mapping it if spilled."""
+        if self._table is not None:
+            return self._table
+        return pa.ipc.open_file(pa.memory_map(self.path)).read_all()
+
+    def to_pandas(self):
+        return self.table().to_pandas()
+
+    def to_csv(self):
+        """Serialize the result as CSV bytes; only called when a download is requested."""
+        sink = pa.BufferOutputStream()
+        pa_csv.write_csv(self.table(), sink)
+        return sink.getvalue().to_pybytes()
+
+    def _replace(self, table):
+        self._table = table
+        self.num_rows = table.num_rows
+        self.columns = table.column_names
+        self.nbytes = table.nbytes
+        if self.path is not None:
+            # Write a new file instead of truncating one that may still be memory-mapped
+            old_path = self.path
+            self._spill(os.path.join(os.path.dirname(old_path), f"{uuid.uuid4().hex}.arrow"))
+            os.remove(old_path)
+
+    def _write(self, path):
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, self._table.schema) as writer:
+                writer.write_table(self._table)
+
+    def _spill(self, path):
+        self._write(path)
+        self.path = path
+        self._table = None
+
+
+class ResultStore:
+    """Per-session store of query results with spill-to-disk past a memory limit."""
+
+    def __init__(self, memory_limit=RESULT_MEMORY_LIMIT):
+        self.memory_limit = memory_limit
+        self._results = []
+        self._lock = threading.Lock()
+        self._spill_dir = None
+        self._finalizer = None
+
+    def _spill_path(self):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="db_chatbot_results_")
+            # Remove spilled files even if the session is dropped without clear()
+            self._finalizer = weakref.finalize(self, shutil.rmtree, self._spill_dir, True)
+        return os.path.join(self._spill_dir, f"{uuid.uuid4().hex}.arrow")
+
+    def memory_usage(self):
+        """Bytes of results currently held in memory."""
+        return sum(result.nbytes for result in self._results if not result.spilled)
+
+    def _enforce_limit(self):
+        # Spill the oldest in-memory results first, always keeping the newest in memory
+        in_memory = [result for result in self._results[:-1] if not result.spilled]
+        usage = self.memory_usage()
+        for result in in_memory:
+            if usage <= self.memory_limit:
+                break
+            usage -= result.nbytes
+            result._spill(self._spill_path())
+
+    def put(self, df):
+        """Store a result DataFrame and return its StoredResult."""
+        result = StoredResult(to_arrow(df))
+        with self._lock:
+            self._results.append(result)
+            self._enforce_limit()
+        return result
+
+    def append(self, result, df):
+        """Append more rows (e.g. the next page) to a stored result."""
+        if len(df) == 0:
+            return result
+        with self._lock:
+            table = pa.concat_tables([result.table(), to_arrow(df)], promote_options="permissive")
+            result._replace(table)
+            self._enforce_limit()
+        return result
+
+    def clear(self):
+        """Drop every stored result and delete spilled files."""
+        with self._lock:
+            self._results = []
+            if self._finalizer is not None:
+                self._finalizer()
+            self._spill_dir = None
+            self._finalizer = None
@@ -0,0 +1,173 @@
+import re
+
+import numpy as np
+
+try:
+    from . import schema_prompt
+except ImportError:
+    import schema_prompt
+
+# Number of best-scoring tables sent to the model before join neighbours are added
+SCHEMA_TOP_K = 5
+# Rough token budget for the schema part of the prompt
+SCHEMA_TOKEN_BUDGET = 3000
+# Below this best BM25 score the question is treated as a low-confidence match
+# and the whole schema is sent instead
+MIN_RELEVANCE_SCORE = 1.0
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Table name tokens count this many times more than column tokens
+TABLE_NAME_WEIGHT = 3
+
+
+def tokenize(text):
+    """Split identifiers or free text into lowercase, roughly singular tokens."""
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", str(text))
+    tokens = []
+    for token in re.split(r"[^A-Za-z0-9]+", text.lower()):
+        if not token or token.isdigit():
+            continue
+        if len(token) > 3 and token.endswith("ies"):
+            token = token[:-3] + "y"
+        elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def join_neighbours(catalog):
+    """Map every table to the set of tables it is linked to by a foreign key."""
+    neighbours = {table: set() for table in catalog["tables"]}
+    for fk in catalog.get("foreign_keys", []):
+        table, referenced = fk["table_name"], fk["referenced_table"]
+        if table in neighbours and referenced in neighbours and table != referenced:
+            neighbours[table].add(referenced)
+            neighbours[referenced].add(table)
+    return neighbours
+
+
+def estimate_tokens(text):
+    """Token estimate for prompt text (see schema_prompt.count_tokens)."""
+    return max(1, schema_prompt.count_tokens(text))
+
+
+def table_token_cost(catalog, table_name):
+    """How many prompt tokens a table's schema costs, as schema_prompt renders it."""
+    return schema_prompt.table_tokens(catalog, table_name)
+
+
+def build_index(catalog):
+    """Build a BM25 weight matrix over table names, column names and join neighbours."""
+    tables = list(catalog["tables"])
+    neighbours = join_neighbours(catalog)
+
+    documents = []
+    for table in tables:
+        tokens = tokenize(table) * TABLE_NAME_WEIGHT
+        for column in catalog["tables"][table]:
+            tokens.extend(tokenize(column["Field"]))
+        for neighbour in neighbours[table]:
+            tokens.extend(tokenize(neighbour))
+        documents.append(tokens)
+
+    vocabulary = {}
+    for tokens in documents:
+        for token in tokens:
+            vocabulary.setdefault(token, len(vocabulary))
+
+    term_counts = np.zeros((len(tables), max(len(vocabulary), 1)), dtype=np.float32)
+    for row, tokens in enumerate(documents):
+        for token in tokens:
+            term_counts[row, vocabulary[token]] += 1
+
+    doc_lengths = term_counts.sum(axis=1)
+    avg_length = doc_lengths.mean() if len(tables) else 1.0
+    doc_freq = (term_counts > 0).sum(axis=0)
+    idf = np.log1p((len(tables) - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / max(avg_length, 1e-9))
+    weights = idf * term_counts * (BM25_K1 + 1) / (term_counts + norm[:, None])
+
+    return {
+        "tables": tables,
+        "vocabulary": vocabulary,
+        "weights": weights.astype(np.float32),
+        "neighbours": neighbours,
+        "costs": np.array(
+            [table_token_cost(catalog, table) for table in tables], dtype=np.int64
+        ),
+    }
+
+
+def get_index(catalog):
+    """Return the lexical index for a catalog, building it on first use.
+
+    The index is stored on the catalog itself, so it is rebuilt whenever the
+    schema catalog is reloaded after a fingerprint change.
+    """
+    index = catalog.get("lexical_index")
+    if index is None:
+        index = build_index(catalog)
+        catalog["lexical_index"] = index
+    return index
+
+
+def score_tables(catalog, question):
+    """Return a BM25 score per table for the question, in catalog table order."""
+    index = get_index(catalog)
+    columns = sorted({index["vocabulary"][t] for t in tokenize(question) if t in index["vocabulary"]})
+    if not columns:
+        return np.zeros(len(index["tables"]), dtype=np.float32)
+    return index["weights"][:, columns].sum(axis=1)
+
+
+def prunes(catalog, top_k=None, token_budget=None):
+    """Whether select_tables may send only part of a catalog's schema for a question."""
+    top_k = SCHEMA_TOP_K if top_k is None else top_k
+    token_budget = SCHEMA_TOKEN_BUDGET if token_budget is None else token_budget
+    index = get_index(catalog)
+    return len(index["tables"]) > top_k and index["costs"].sum() > token_budget
+
+
+def select_tables(catalog, question, top_k=None, token_budget=None, min_score=None):
+    """Choose the tables whose schema should be sent to the model for a question.
+
+    The top_k best matches are taken first, then their foreign-key neighbours
+    so the model can still build joins, until the token budget is spent. When
+    the best match scores below min_score, or the whole schema already fits in
+    the budget, every table is returned.
+    """
+    top_k = SCHEMA_TOP_K if top_k is None else top_k
+    token_budget = SCHEMA_TOKEN_BUDGET if token_budget is None else token_budget
+    min_score = MIN_RELEVANCE_SCORE if min_score is None else min_score
+
+    index = get_index(catalog)
+    tables = index["tables"]
+    if not tables:
+        return []
+    if not prunes(catalog, top_k, token_budget):
+        return list(tables)
+
+    scores = score_tables(catalog, question)
+    ranking = np.argsort(-scores, kind="stable")
+    if scores[ranking[0]] < min_score:
+        return list(tables)
+
+    position = {table: i for i, table in enumerate(tables)}
+    primary = [i for i in ranking[:top_k] if scores[i] > 0]
+    neighbour_ids = {position[n] for i in primary for n in index["neighbours"][tables[i]]}
+    neighbour_ids.difference_update(primary)
+    candidates = primary + sorted(neighbour_ids, key=lambda i: -scores[i])
+
+    selected = []
+    spent = 0
+    for i in candidates:
+        cost = int(index["costs"][i])
+        if selected and spent + cost > token_budget:
+            continue
+        selected.append(tables[i])
+        spent += cost
+    return selected
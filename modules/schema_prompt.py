@@ -0,0 +1,192 @@
+import heapq
+import re
+
+try:
+    from . import validation
+except ImportError:
+    import validation
+
+# Most columns rendered per table; key columns come first, the rest are listed by name in a comment
+SCHEMA_MAX_COLUMNS = 40
+# Column types longer than this (long ENUM and SET lists) are cut short
+SCHEMA_MAX_TYPE_CHARS = 60
+# Sample values shown per column, and the characters kept of each
+SCHEMA_SAMPLES_PER_COLUMN = 3
+SCHEMA_MAX_SAMPLE_CHARS = 24
+# Token cap for a whole schema block; the largest tables are rendered more tersely until it fits
+SCHEMA_MAX_TOKENS = 6000
+
+# Rendering levels, most detailed first: with sample values, with types and keys, column names only
+LEVELS = ("full", "typed", "names")
+
+# Pieces a BPE tokenizer rarely merges across: words (split at camelCase), digits, whitespace, symbols
+_TOKEN_PIECE = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d|\n\s*|[^\S\n]+|[^\sA-Za-z\d]")
+_PLAIN_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_$]*$")
+
+
+def count_tokens(text):
+    """Estimate how many tokens a BPE tokenizer (Qwen, Llama) splits ``text`` into.
+
+    Words cost a token per six letters, digits one each, a line break with
+    its indentation one, and every other symbol one; a single space is
+    merged into the word after it. Closer than a characters-per-token ratio
+    for the identifier- and punctuation-heavy text of a schema.
+    """
+    tokens = 0
+    for piece in _TOKEN_PIECE.findall(text):
+        if piece[0].isalpha():
+            tokens += (len(piece) + 5) // 6
+        elif piece[0] == "\n" or not piece.isspace():
+            tokens += 1
+        elif len(piece) > 1:
+            tokens += 1
+    return tokens
+
+
+def _quote(name):
+    name = str(name)
+    if _PLAIN_IDENTIFIER.match(name) and name.lower() not in validation.KEYWORDS:
+        return name
+    return "`" + name.replace("`", "``") + "`"
+
+
+def _short_type(column_type):
+    column_type = str(column_type or "")
+    if len(column_type) <= SCHEMA_MAX_TYPE_CHARS:
+        return column_type
+    # ENUM('a','b',...) keeps its first values
+    cut = column_type.rfind(",", 0, SCHEMA_MAX_TYPE_CHARS)
+    if column_type.endswith(")") and cut > 0:
+        return column_type[:cut] + ",...)"
+    return column_type[:SCHEMA_MAX_TYPE_CHARS] + "..."
+
+
+def _sample(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    text = str(value)
+    if len(text) > SCHEMA_MAX_SAMPLE_CHARS:
+        text = text[:SCHEMA_MAX_SAMPLE_CHARS] + "..."
+    return "'" + text.replace("'", "''").replace("\n", " ") + "'"
+
+
+def _references(catalog):
+    """(table, column) -> "referenced_table(referenced_column)", built once per catalog."""
+    references = catalog.get("schema_references")
+    if references is None:
+        references = {
+            (fk["table_name"], fk["column_name"]): f"{_quote(fk['referenced_table'])}({_quote(fk['referenced_column'])})"
+            for fk in catalog.get("foreign_keys", [])
+        }
+        catalog["schema_references"] = references
+    return references
+
+
+def _render_table(catalog, table, level):
+    columns = catalog["tables"][table]
+    references = _references(catalog)
+    samples = catalog.get("samples", {}).get(table, {}) if level == "full" else {}
+    primary = [column["Field"] for column in columns if column["Key"] == "PRI"]
+    kind = "VIEW" if catalog.get("table_types", {}).get(table) == "VIEW" else "TABLE"
+
+    def is_key(column):
+        return column["Key"] in ("PRI", "UNI") or (table, column["Field"]) in references
+
+    # Key columns are never the ones cut off
+    shown = sorted(columns, key=lambda column: not is_key(column))[:SCHEMA_MAX_COLUMNS]
+    shown_fields = {column["Field"] for column in shown}
+    shown = [column for column in columns if column["Field"] in shown_fields]
+    hidden = [column["Field"] for column in columns if column["Field"] not in shown_fields]
+
+    definitions = []
+    for column in shown:
+        parts = [_quote(column["Field"])]
+        if level != "names":
+            parts.append(_short_type(column["Type"]))
+        if column["Key"] == "PRI" and len(primary) == 1:
+            parts.append("PRIMARY KEY")
+        elif column["Key"] == "UNI":
+            parts.append("UNIQUE")
+        reference = references.get((table, column["Field"]))
+        if reference is not None:
+            parts.append(f"REFERENCES {reference}")
+        definitions.append((" ".join(parts), samples.get(column["Field"])))
+    if len(primary) > 1:
+        definitions.append((f"PRIMARY KEY ({', '.join(_quote(field) for field in primary)})", None))
+
+    if level == "names":
+        text = f"CREATE {kind} {_quote(table)} ({', '.join(definition for definition, _ in definitions)});"
+        if hidden:
+            text += f" -- {len(hidden)} more columns"
+        return text
+
+    lines = []
+    for i, (definition, values) in enumerate(definitions):
+        line = f"  {definition}" + ("," if i < len(definitions) - 1 else "")
+        if values:
+            line += " -- e.g. " + ", ".join(_sample(value) for value in values[:SCHEMA_SAMPLES_PER_COLUMN])
+        lines.append(line)
+    if hidden:
+        lines.append(f"  -- {len(hidden)} more columns: {', '.join(_quote(field) for field in hidden)}")
+    return f"CREATE {kind} {_quote(table)} (\n" + "\n".join(lines) + "\n);"
+
+
+def table_ddl(catalog, table, level="full"):
+    """A table's DDL-like text and its token count at a level, rendered once per catalog.
+
+    The cache lives on the catalog, which is replaced when the schema
+    fingerprint changes.
+    """
+    rendered = catalog.setdefault("schema_ddl", {})
+    key = (table, level)
+    entry = rendered.get(key)
+    if entry is None:
+        if level == "full" and not catalog.get("samples", {}).get(table):
+            entry = table_ddl(catalog, table, "typed")
+        else:
+            text = _render_table(catalog, table, level)
+            entry = (text, count_tokens(text))
+        rendered[key] = entry
+    return entry
+
+
+def table_tokens(catalog, table):
+    """Tokens a table costs in the prompt at full detail."""
+    return table_ddl(catalog, table)[1]
+
+
+def render_schema(catalog, tables, max_tokens=None):
+    """Render tables as compact MySQL DDL within a token budget.
+
+    Every table starts at full detail; while the total is over
+    ``max_tokens`` (SCHEMA_MAX_TOKENS by default) the currently largest
+    table is rendered one level terser (see LEVELS). Tables that still don't
+    fit once all are at the tersest level are left out from the end, noted
+    in a closing comment. Returns the text and its token count.
+    """
+    max_tokens = SCHEMA_MAX_TOKENS if max_tokens is None else max_tokens
+    levels = {table: 0 for table in tables}
+    # Each table also costs the line break joining it to the next
+    costs = {table: table_ddl(catalog, table)[1] + 1 for table in tables}
+    total = sum(costs.values())
+    largest = [(-cost, i, table) for i, (table, cost) in enumerate(costs.items())]
+    heapq.heapify(largest)
+    while total > max_tokens and largest:
+        _, i, table = heapq.heappop(largest)
+        levels[table] += 1
+        cost = table_ddl(catalog, table, LEVELS[levels[table]])[1] + 1
+        total += cost - costs[table]
+        costs[table] = cost
+        if levels[table] < len(LEVELS) - 1:
+            heapq.heappush(largest, (-cost, i, table))
+
+    shown = list(tables)
+    if total > max_tokens:
+        note = f"-- {len(tables)} more tables not shown"
+        total += count_tokens(note)
+        while total > max_tokens and len(shown) > 1:
+            total -= costs[shown.pop()]
+    text = "\n".join(table_ddl(catalog, table, LEVELS[levels[table]])[0] for table in shown)
+    if len(shown) < len(tables):
+        text += f"\n-- {len(tables) - len(shown)} more tables not shown"
+    return text, count_tokens(text)
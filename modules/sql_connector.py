@@ -1,6 +1,78 @@
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
 import pymysql
 import pandas as pd
-def create_connection(host, user, password, database):
+from pymysql.constants import SERVER_STATUS
+
+try:
+    from . import result_cache
+    from . import tracing
+    from . import validation
+    from . import write_batch
+except ImportError:
+    import result_cache
+    import tracing
+    import validation
+    import write_batch
+
+# Seconds a cached schema catalog is trusted before its fingerprint is re-checked
+SCHEMA_FINGERPRINT_TTL = 30
+# Seconds between background reloads of a server's database and table list
+SERVER_CATALOG_REFRESH_INTERVAL = 60
+# Databases left out of the database list unless nothing else is visible
+SYSTEM_DATABASES = ("information_schema", "mysql", "performance_schema", "sys")
+# Rows read per table for the sample values shown in the prompt (0 disables; one query per table)
+SCHEMA_SAMPLE_ROWS = int(os.environ.get("DB_CHATBOT_SCHEMA_SAMPLE_ROWS", "0"))
+# Distinct sample values kept per column
+SCHEMA_SAMPLE_VALUES = 5
+
+# Rows fetched per round of a server-side cursor
+RESULT_CHUNK_SIZE = 1000
+# Seconds an open result pager may sit unused before its connection is reclaimed
+RESULT_PAGER_IDLE_TIMEOUT = 120
+# Seconds between background checks for idle result pagers
+RESULT_PAGER_REAP_INTERVAL = 10
+# Share of a pool's connections open result pagers may hold; opening one more closes the least recently used
+RESULT_PAGER_MAX_POOL_SHARE = 0.5
+
+# Seconds a query may run before the client-side watchdog kills it; a little over the
+# cost guard's MAX_EXECUTION_TIME hint, so MySQL normally stops reads itself first
+QUERY_TIMEOUT = 35
+# MySQL errors for a statement stopped by KILL QUERY or MAX_EXECUTION_TIME
+QUERY_INTERRUPTED_ERRORS = (1317, 3024)
+
+# Seconds between checks of each read replica's lag
+REPLICA_LAG_CHECK_INTERVAL = 2
+# Replicas further behind their primary than this many seconds get no reads
+REPLICA_MAX_LAG = 30
+
+# Connection pool defaults
+POOL_MAX_SIZE = 10
+POOL_MAX_IDLE = 5
+POOL_WAIT_TIMEOUT = 30
+# Idle connections older than this are pinged before being handed out
+POOL_HEALTH_CHECK_AFTER = 30
+# Connections are replaced once they are this old
+POOL_RECYCLE_AFTER = 3600
+
+_schema_catalogs = {}
+_schema_catalog_lock = threading.Lock()
+
+_server_catalogs = {}
+_server_catalog_refreshers = {}
+_server_catalog_lock = threading.Lock()
+
+_open_pagers = set()
+_open_pagers_lock = threading.Lock()
+_pager_reaper = None
+
+_last_writes = {}
+_last_writes_lock = threading.Lock()
+
+def create_connection(host, user, password, database, port=3306, autocommit=False):
     """Create a connection to the MySQL database."""
  
     connection = pymysql.connect(
@@ -8,6 +80,8 @@ def create_connection(host, user, password, database):
         user=user,
         password=password,
         database=database,
+        port=int(port),
+        autocommit=autocommit,
         cursorclass=pymysql.cursors.DictCursor
         )
     return connection
@@ -20,38 +94,467 @@ def close_connection(connection):
     print("Connection to the database has been closed.")
 
 
-def execute_query(connection, query):
-    """Execute a SQL query on the connected database."""
+# Statements that only read data; WITH ... SELECT and (SELECT ...) count as SELECT
+READ_STATEMENTS = {"select", "table", "values", "show", "describe", "desc", "explain"}
+
+
+def is_read_query(query):
+    """Return True for statements that only read data (READ_STATEMENTS)."""
+    return validation.statement_kind(query) in READ_STATEMENTS
+
+
+def is_interrupted(err):
+    """Whether a pymysql error means the statement was killed or timed out (the connection stays usable)."""
+    return bool(err.args) and err.args[0] in QUERY_INTERRUPTED_ERRORS
+
+
+class QueryControl:
+    """Deadline and cancellation for the statements of one request.
+
+    Statements run inside ``running(connection)``. The deadline starts with
+    the first statement; once ``timeout`` seconds have passed a watchdog
+    timer stops the current statement, and ``cancel`` (from any thread) does
+    the same at once. Both send KILL QUERY over the pool's control
+    connection and keep later statements from starting. ``reason`` is then
+    "timeout" or "cancelled".
+    """
+
+    def __init__(self, pool, timeout=None):
+        self.pool = pool
+        self.timeout = QUERY_TIMEOUT if timeout is None else timeout
+        self.deadline = None
+        self.reason = None
+        self._lock = threading.Lock()
+        self._thread_id = None
+        self._owner = pool
+        self._killed = False
+
+    def cancel(self):
+        """Stop the running statement, if any, and every later one."""
+        self._interrupt("cancelled")
+
+    def _interrupt(self, reason):
+        # Held while KILL QUERY runs, so the connection can't be handed to another statement meanwhile
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+            if self._thread_id is not None and not self._killed:
+                self._killed = True
+                self._owner.kill_query(self._thread_id)
+
+    @contextmanager
+    def running(self, connection):
+        """Run a statement on ``connection`` under this control.
+
+        Raises an interrupted-query OperationalError instead of starting once
+        the request was cancelled or its deadline has passed.
+        """
+        with self._lock:
+            if self.deadline is None and self.timeout:
+                self.deadline = time.monotonic() + self.timeout
+            if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+                self.reason = "timeout"
+            if self.reason is not None:
+                raise pymysql.err.OperationalError(1317, f"Query {self.reason} before it started")
+            self._thread_id = connection.thread_id()
+            # Thread ids are per server: kill through the pool (primary or replica) the connection came from
+            self._owner = getattr(connection, "_pool", None) or self.pool
+            self._killed = False
+        watchdog = None
+        if self.deadline is not None:
+            watchdog = threading.Timer(max(self.deadline - time.monotonic(), 0), self._interrupt, ("timeout",))
+            watchdog.daemon = True
+            watchdog.start()
+        try:
+            yield
+        except pymysql.Error as err:
+            # MAX_EXECUTION_TIME stopped it on the server before the watchdog did
+            if self.reason is None and err.args and err.args[0] == 3024:
+                self.reason = "timeout"
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            with self._lock:
+                self._thread_id = None
+                killed = self._killed
+            if killed:
+                # Make sure the kill is spent before the connection runs anything else
+                try:
+                    connection.ping(reconnect=False)
+                except pymysql.Error:
+                    try:
+                        connection.close()
+                    except pymysql.Error:
+                        pass
+
+
+def _controlled(control, connection):
+    return control.running(connection) if control is not None else nullcontext()
+
+
+def execute_query(connection, query, use_cache=None, control=None):
+    """Execute a SQL query on the connected database.
+
+    With ``use_cache`` (default: result_cache.RESULT_CACHE_ENABLED) read
+    results are served from and stored in the shared result cache; committed
+    writes always invalidate the cached results of the tables they touch.
+    With a ``control`` (QueryControl) the statement can be cancelled and is
+    killed at its deadline.
+    """
     if connection is None :
         print("No valid database connection.")
         return None
     
-    if  query.lower().strip().startswith("select") or query.lower().strip().startswith("show") or query.lower().strip().startswith("describe")or query.lower().strip().startswith("explain"):
+    if use_cache is None:
+        use_cache = result_cache.RESULT_CACHE_ENABLED
+    
+    if is_read_query(query):
+        with tracing.span("mysql.execute", kind="read") as span:
+            update_times = None
+            if use_cache:
+                cached_result = get_cached_result(connection, query)
+                span.set(result_cache="miss" if cached_result is None else "hit")
+                if cached_result is not None:
+                    span.set(rows=len(cached_result))
+                    return cached_result
+                # Snapshot UPDATE_TIME before running the query so a concurrent write makes the entry stale
+                update_times = fetch_table_update_times(connection, result_cache.extract_tables(query))
+            cursor = connection.cursor()
+            try:
+                with _controlled(control, connection):
+                    cursor.execute(query)
+                    result = cursor.fetchall()
+                span.set(rows=len(result))
+                if use_cache:
+                    cache_result(connection, query, result, update_times)
+                return result
+            except pymysql.Error as err:
+                span.set(failed=str(err))
+                print(f"Error executing query: {err}")
+                return None
+            finally:
+                cursor.close()
+    elif all(validation.statement_kind(statement["text"]) in validation.SCRIPT_STATEMENTS
+             for statement in _statements(query)):
+        return execute_script(connection, query, control=control)
+    else :
+        return _execute_statement(connection, query, control=control)
+
+
+def _statements(query):
+    try:
+        return validation.split_statements(query) or [{"text": query}]
+    except ValueError:
+        return [{"text": query}]
+
+
+def _execute_statement(connection, query, control=None):
+    """Run and commit a statement that is neither a read nor a data change (DDL and the like)."""
+    with tracing.span("mysql.execute", kind="other") as span:
         cursor = connection.cursor()
         try:
-            cursor.execute(query)
-            result = cursor.fetchall()
-            return result
+            with _controlled(control, connection):
+                cursor.execute(query)
+            connection.commit()
+            span.set(rows=cursor.rowcount)
         except pymysql.Error as err:
-            print(f"Error executing query: {err}")
+            span.set(failed=str(err))
+            print(f"Error executing statement: {err}")
+            if connection.open:
+                connection.rollback()
             return None
         finally:
             cursor.close()
-    else :
+    record_write(connection)
+    invalidate_cached_results(connection, query)
+    return [{"sql": query, "statements": 1, "rows": cursor.rowcount}]
+
+
+def execute_script(connection, script, control=None):
+    """Run one or more write statements in a single transaction.
+
+    The script is planned with write_batch.plan_script, so runs of single-row
+    INSERT, UPDATE and DELETE statements go to the server as one batched
+    statement each. Everything commits once at the end or is rolled back on
+    the first error. Returns a list with one dict per executed statement
+    (``sql``, the number of ``statements`` it stands for and the ``rows`` it
+    affected), or None if the script failed or holds anything but INSERT,
+    REPLACE, UPDATE and DELETE statements. MySQL reports one row count per
+    statement sent, so a batched statement's ``rows`` is the combined count
+    of the statements it stands for.
+    """
+    if connection is None:
+        print("No valid database connection.")
+        return None
+    kinds = {validation.statement_kind(statement["text"]) for statement in _statements(script)}
+    if not kinds <= validation.SCRIPT_STATEMENTS:
+        print(f"Error executing update: only INSERT, REPLACE, UPDATE and DELETE statements run as a script, "
+              f"not {', '.join(sorted(str(kind).upper() for kind in kinds - validation.SCRIPT_STATEMENTS))}")
+        return None
+    steps = write_batch.plan_script(script)
+    with tracing.span("mysql.execute", kind="write", statements=sum(step["statements"] for step in steps)) as span:
+        results = []
         cursor = connection.cursor()
         try:
-            cursor.execute(query)
+            connection.begin()
+            with _controlled(control, connection):
+                for step in steps:
+                    cursor.execute(step["sql"])
+                    results.append({"sql": step["sql"], "statements": step["statements"], "rows": cursor.rowcount})
             connection.commit()
-            print("Update executed successfully.")
+            span.set(round_trips=len(steps), rows=sum(result["rows"] for result in results))
         except pymysql.Error as err:
+            span.set(failed=str(err))
             print(f"Error executing update: {err}")
-            connection.rollback()
+            if connection.open:
+                connection.rollback()
+            return None
         finally:
             cursor.close()
-    
+        record_write(connection)
+        for step in steps:
+            invalidate_cached_results(connection, step["sql"])
+        return results
+
+
+def fetch_table_update_times(connection, tables):
+    """Fetch information_schema UPDATE_TIME for tables of the current database."""
+    if not tables or not result_cache.RESULT_CACHE_CHECK_UPDATE_TIME:
+        return {}
+    tables = sorted(tables)
+    placeholders = ", ".join(["%s"] * len(tables))
+    query = (
+        "SELECT TABLE_NAME AS table_name, UPDATE_TIME AS update_time "
+        "FROM information_schema.TABLES "
+        f"WHERE TABLE_SCHEMA = DATABASE() AND LOWER(TABLE_NAME) IN ({placeholders})"
+    )
+    cursor = connection.cursor(pymysql.cursors.DictCursor)
+    try:
+        cursor.execute(query, tables)
+        return {row["table_name"].lower(): row["update_time"] for row in cursor.fetchall()}
+    except pymysql.Error as err:
+        print(f"Error fetching table update times: {err}")
+        return None
+    finally:
+        cursor.close()
+
+
+def get_cached_result(connection, query):
+    """Return a cached result for a read query, or None if missing or stale."""
+    cache = result_cache.get_result_cache()
+    key = catalog_key(connection)
+    entry = cache.get(key, query)
+    if entry is None:
+        return None
+    if result_cache.RESULT_CACHE_CHECK_UPDATE_TIME and entry["tables"]:
+        if fetch_table_update_times(connection, entry["tables"]) != entry["update_times"]:
+            cache.discard(key, query)
+            return None
+    return entry["result"]
+
+
+def cache_result(connection, query, result, update_times=None):
+    """Store a complete read result in the shared result cache."""
+    if update_times is None:
+        update_times = fetch_table_update_times(connection, result_cache.extract_tables(query))
+    if update_times is None:
+        return False
+    return result_cache.get_result_cache().put(catalog_key(connection), query, result, update_times)
+
+
+def invalidate_cached_results(connection, query):
+    """Drop cached results that a committed write statement may have changed."""
+    cache = result_cache.get_result_cache()
+    key = catalog_key(connection)
+    tables = result_cache.extract_tables(query)
+    if not tables or query.lower().strip().startswith(("create", "alter", "drop", "rename", "truncate")):
+        cache.invalidate_database(key)
+    else:
+        cache.invalidate_tables(key, tables)
+
+
+def _abandon_streaming_cursor(connection, cursor):
+    """Stop reading a server-side cursor without draining the remaining rows.
+
+    Closing an unbuffered cursor would read every leftover row off the
+    socket, so the connection is closed instead; a pool discards it on release.
+    """
+    try:
+        connection.close()
+    except pymysql.Error:
+        pass
+    cursor.connection = None
+
+
+def iter_query_chunks(connection, query, chunk_size=RESULT_CHUNK_SIZE, control=None):
+    """Execute a read query with a server-side cursor and yield DataFrame chunks.
+
+    Rows are streamed from MySQL ``chunk_size`` at a time and each chunk is
+    built straight from tuples plus column names, so memory stays bounded by
+    the chunk size. Stopping the iteration early closes the connection rather
+    than draining the rest of the result; a killed or timed-out query leaves
+    nothing to drain, so its connection stays open. ``control`` (a
+    QueryControl) covers the whole read.
+    """
+    cursor = connection.cursor(pymysql.cursors.SSCursor)
+    finished = False
+    try:
+        with _controlled(control, connection):
+            cursor.execute(query)
+            columns = [column[0] for column in cursor.description or []]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    finished = True
+                    break
+                yield pd.DataFrame.from_records(rows, columns=columns)
+    except pymysql.Error as err:
+        finished = is_interrupted(err)
+        raise
+    finally:
+        if finished and connection.open:
+            cursor.close()
+        else:
+            _abandon_streaming_cursor(connection, cursor)
+
+
+class ResultPager:
+    """Page through a read query's result on demand over a server-side cursor.
+
+    The pager keeps one pooled connection checked out until the result is
+    exhausted or ``close`` is called. Pagers left unused for longer than
+    RESULT_PAGER_IDLE_TIMEOUT (e.g. because the browser tab was closed) are
+    closed by a background thread, and open pagers hold at most
+    RESULT_PAGER_MAX_POOL_SHARE of a pool's connections: opening one more
+    closes the least recently used first.
+    """
+
+    def __init__(self, pool, database, query, page_size=RESULT_CHUNK_SIZE, control=None):
+        close_idle_pagers()
+        _make_room_for_pager(pool)
+        self.query = query
+        self.page_size = page_size
+        self.rows_fetched = 0
+        self.exhausted = False
+        self.last_used = time.monotonic()
+        self._interrupted = False
+        self._lock = threading.Lock()
+        self._pool = pool
+        self._connection = pool.acquire(database, read=True)
+        self._cursor = self._connection.cursor(pymysql.cursors.SSCursor)
+        try:
+            with _controlled(control, self._connection):
+                self._cursor.execute(query)
+        except Exception:
+            self._cursor.close()
+            self._release()
+            raise
+        self.columns = [column[0] for column in self._cursor.description or []]
+        with _open_pagers_lock:
+            _open_pagers.add(self)
+        _start_pager_reaper()
+
+    @property
+    def closed(self):
+        return self._connection is None
+
+    def fetch_page(self, control=None):
+        """Return the next page as a DataFrame (empty once the result is exhausted).
+
+        ``control`` (a QueryControl) can cancel or time out this page's fetch.
+        """
+        with self._lock:
+            self.last_used = time.monotonic()
+            if self._connection is None:
+                return pd.DataFrame(columns=self.columns)
+            with tracing.span("mysql.fetch_page") as span:
+                try:
+                    with _controlled(control, self._connection):
+                        rows = self._cursor.fetchmany(self.page_size)
+                except Exception as err:
+                    self._interrupted = isinstance(err, pymysql.Error) and is_interrupted(err)
+                    self._close()
+                    raise
+                span.set(rows=len(rows))
+            self.rows_fetched += len(rows)
+            self.last_used = time.monotonic()
+            if len(rows) < self.page_size:
+                self.exhausted = True
+                self._close()
+        return pd.DataFrame.from_records(rows, columns=self.columns)
+
+    def _release(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            self._pool.release(connection)
+
+    def _close(self):
+        if self._connection is None:
+            return
+        if (self.exhausted or self._interrupted) and self._connection.open:
+            self._cursor.close()
+        else:
+            _abandon_streaming_cursor(self._connection, self._cursor)
+        self._release()
+        with _open_pagers_lock:
+            _open_pagers.discard(self)
+
+    def close(self):
+        """Stop paging and hand the connection back to the pool."""
+        with self._lock:
+            self._close()
+
+
+def open_result_pager(pool, database, query, page_size=RESULT_CHUNK_SIZE, control=None):
+    """Start paging a read query, or return None if it fails to execute."""
+    try:
+        return ResultPager(pool, database, query, page_size=page_size, control=control)
+    except pymysql.Error as err:
+        print(f"Error executing query: {err}")
+        return None
+
+
+def close_idle_pagers(max_idle=None):
+    """Close result pagers that have not been read from for ``max_idle`` seconds."""
+    max_idle = RESULT_PAGER_IDLE_TIMEOUT if max_idle is None else max_idle
+    now = time.monotonic()
+    with _open_pagers_lock:
+        idle = [pager for pager in _open_pagers if now - pager.last_used > max_idle]
+    for pager in idle:
+        pager.close()
+
+
+def _make_room_for_pager(pool):
+    """Close a pool's least recently used pagers so one more stays within RESULT_PAGER_MAX_POOL_SHARE."""
+    allowed = max(int(getattr(pool, "max_size", POOL_MAX_SIZE) * RESULT_PAGER_MAX_POOL_SHARE), 1)
+    with _open_pagers_lock:
+        pagers = sorted((pager for pager in _open_pagers if pager._pool is pool), key=lambda pager: pager.last_used)
+    for pager in pagers[:max(len(pagers) - allowed + 1, 0)]:
+        pager.close()
+
+
+def _reap_idle_pagers(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            close_idle_pagers()
+        except Exception as err:
+            print(f"Error closing idle result pagers: {err}")
+
+
+def _start_pager_reaper():
+    """Start the daemon thread that closes idle pagers, once per process."""
+    global _pager_reaper
+    with _open_pagers_lock:
+        if _pager_reaper is not None:
+            return
+        _pager_reaper = threading.Thread(
+            target=_reap_idle_pagers, args=(RESULT_PAGER_REAP_INTERVAL,), name="result-pager-reaper", daemon=True
+        )
+        _pager_reaper.start()
 
 
-    
 
 def fetch_all_tables(connection):
     """Fetch all tables in the connected database."""
@@ -60,7 +563,7 @@ def fetch_all_tables(connection):
         return None
     
     query = "SHOW TABLES"
-    return [tables.values() for tables in execute_query(connection, query)]
+    return [tables.values() for tables in execute_query(connection, query, use_cache=False)]
 
 def fetch_table_schema(connection, table_name):
     """Fetch the schema of a specific table in the connected database."""
@@ -69,7 +572,7 @@ def fetch_table_schema(connection, table_name):
         return None
     
     query = f"DESCRIBE {table_name}"
-    return pd.DataFrame(execute_query(connection, query))
+    return pd.DataFrame(execute_query(connection, query, use_cache=False))
 
 def fetch_database_info(connection):
     """Fetch information about the connected database."""
@@ -78,5 +581,708 @@ def fetch_database_info(connection):
         return None
     
     query = "show databases ; "
-    return pd.DataFrame(execute_query(connection, query))
+    return pd.DataFrame(execute_query(connection, query, use_cache=False))
+
+
+def catalog_key(connection):
+    """Return the (host, database) key a connection's schema catalog is cached under.
+
+    Connections to a read replica use their primary's address, so both share
+    cached schemas and results and their invalidation.
+    """
+    return (getattr(connection, "_cluster", None) or f"{connection.host}:{connection.port}", connection.db)
+
+
+def record_write(connection):
+    """Note that a write was committed on a connection's database (see last_write)."""
+    with _last_writes_lock:
+        _last_writes[catalog_key(connection)] = time.monotonic()
+
+
+def last_write(key):
+    """time.monotonic() of the last write committed by this process under a catalog_key, or None."""
+    with _last_writes_lock:
+        return _last_writes.get(key)
+
+
+def fetch_schema_fingerprint(connection):
+    """Fetch a cheap fingerprint of the current database's schema.
+
+    Table and column counts and MAX(CREATE_TIME) come straight from the data
+    dictionary, and a checksum over every column's table, name, type, key and
+    position catches altered columns. Data changes (UPDATE_TIME) are left
+    out, so ordinary writes don't invalidate the catalog or the SQL cached
+    for it.
+    """
+    query = (
+        "SELECT (SELECT COUNT(*) FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE()) AS table_count, "
+        "(SELECT MAX(CREATE_TIME) FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE()) AS last_created, "
+        "COUNT(*) AS column_count, "
+        "SUM(CRC32(CONCAT_WS('|', TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, COLUMN_KEY, ORDINAL_POSITION))) "
+        "AS column_checksum "
+        "FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE()"
+    )
+    result = execute_query(connection, query, use_cache=False)
+    if not result:
+        return None
+    row = result[0]
+    return "|".join(
+        str(row[field]) for field in ("table_count", "column_count", "last_created", "column_checksum")
+    )
+
+
+def load_schema_catalog(connection):
+    """Load every table, column and foreign key of the current database.
+
+    Tables and columns come back from one bulk query and foreign keys from a
+    second one. Columns are returned in the same shape as a DESCRIBE row
+    (Field, Type, Null, Key, Default, Extra). With SCHEMA_SAMPLE_ROWS set,
+    sample values of short text columns are loaded as well.
+    """
+    query = (
+        "SELECT t.TABLE_NAME AS table_name, t.TABLE_TYPE AS table_type, "
+        "c.COLUMN_NAME AS Field, c.COLUMN_TYPE AS Type, c.IS_NULLABLE AS `Null`, "
+        "c.COLUMN_KEY AS `Key`, c.COLUMN_DEFAULT AS `Default`, c.EXTRA AS Extra "
+        "FROM information_schema.TABLES t "
+        "LEFT JOIN information_schema.COLUMNS c "
+        "ON c.TABLE_SCHEMA = t.TABLE_SCHEMA AND c.TABLE_NAME = t.TABLE_NAME "
+        "WHERE t.TABLE_SCHEMA = DATABASE() "
+        "ORDER BY t.TABLE_NAME, c.ORDINAL_POSITION"
+    )
+    rows = execute_query(connection, query, use_cache=False)
+    if rows is None:
+        return None
+
+    tables = {}
+    table_types = {}
+    for row in rows:
+        table_name = row["table_name"]
+        columns = tables.setdefault(table_name, [])
+        table_types[table_name] = row["table_type"]
+        if row["Field"] is not None:
+            columns.append({
+                "Field": row["Field"],
+                "Type": row["Type"],
+                "Null": row["Null"],
+                "Key": row["Key"],
+                "Default": row["Default"],
+                "Extra": row["Extra"],
+            })
+
+    return {
+        "key": catalog_key(connection),
+        "database": connection.db,
+        "tables": tables,
+        "table_types": table_types,
+        "foreign_keys": fetch_foreign_keys(connection) or [],
+        "samples": fetch_sample_values(connection, tables, table_types) if SCHEMA_SAMPLE_ROWS else {},
+    }
+
+
+def fetch_sample_values(connection, tables, table_types=None, rows=None):
+    """Distinct values of each base table's CHAR and VARCHAR columns, read from its first ``rows`` rows.
+
+    Returns {table: {column: [values]}}; tables that fail to read are skipped.
+    """
+    rows = SCHEMA_SAMPLE_ROWS if rows is None else rows
+    samples = {}
+    for table, columns in tables.items():
+        if (table_types or {}).get(table, "BASE TABLE") != "BASE TABLE":
+            continue
+        fields = [column["Field"] for column in columns if str(column["Type"]).lower().startswith(("char", "varchar"))]
+        if not fields:
+            continue
+        quoted = ", ".join("`" + field.replace("`", "``") + "`" for field in fields)
+        cursor = connection.cursor(pymysql.cursors.DictCursor)
+        try:
+            cursor.execute(f"SELECT {quoted} FROM `{table.replace('`', '``')}` LIMIT {int(rows)}")
+            result = cursor.fetchall()
+        except pymysql.Error as err:
+            print(f"Error fetching sample values for {table}: {err}")
+            continue
+        finally:
+            cursor.close()
+        values = {}
+        for row in result:
+            for field in fields:
+                value = row[field]
+                column_values = values.setdefault(field, [])
+                if value not in (None, "") and value not in column_values and len(column_values) < SCHEMA_SAMPLE_VALUES:
+                    column_values.append(value)
+        samples[table] = {field: column_values for field, column_values in values.items() if column_values}
+    return samples
+
+
+def fetch_foreign_keys(connection):
+    """Fetch every foreign key column of the current database."""
+    query = (
+        "SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name, "
+        "REFERENCED_TABLE_NAME AS referenced_table, "
+        "REFERENCED_COLUMN_NAME AS referenced_column "
+        "FROM information_schema.KEY_COLUMN_USAGE "
+        "WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL "
+        "ORDER BY TABLE_NAME, ORDINAL_POSITION"
+    )
+    return execute_query(connection, query, use_cache=False)
+
+
+def get_schema_catalog(connection, max_age=None):
+    """Return the cached schema catalog for the connection's (host, database).
+
+    The catalog is reloaded only when the schema fingerprint has changed. The
+    fingerprint itself is re-checked at most every ``max_age`` seconds
+    (SCHEMA_FINGERPRINT_TTL by default); pass ``max_age=0`` to always check.
+    """
+    if connection is None:
+        print("No valid database connection.")
+        return None
+
+    if max_age is None:
+        max_age = SCHEMA_FINGERPRINT_TTL
+
+    key = catalog_key(connection)
+    with tracing.span("schema.catalog") as span:
+        with _schema_catalog_lock:
+            cached = _schema_catalogs.get(key)
+        if cached is not None and time.monotonic() - cached["checked_at"] < max_age:
+            span.set(source="memory", tables=len(cached["tables"]))
+            return cached
+
+        fingerprint = fetch_schema_fingerprint(connection)
+        if cached is not None and fingerprint is not None and cached["fingerprint"] == fingerprint:
+            cached["checked_at"] = time.monotonic()
+            span.set(source="fingerprint", tables=len(cached["tables"]))
+            return cached
+
+        catalog = load_schema_catalog(connection)
+        if catalog is None:
+            span.set(source="failed")
+            return cached
+
+        catalog["fingerprint"] = fingerprint
+        catalog["checked_at"] = time.monotonic()
+        with _schema_catalog_lock:
+            _schema_catalogs[key] = catalog
+        span.set(source="reload", tables=len(catalog["tables"]))
+        return catalog
+
+
+def fetch_table_names(connection, max_age=None):
+    """Return the table names of the connected database from the schema catalog."""
+    catalog = get_schema_catalog(connection, max_age=max_age)
+    if catalog is None:
+        return []
+    return list(catalog["tables"])
+
+
+def invalidate_schema_catalog(connection=None):
+    """Drop the cached catalog for a connection, or every catalog if none is given."""
+    with _schema_catalog_lock:
+        if connection is None:
+            _schema_catalogs.clear()
+        else:
+            _schema_catalogs.pop(catalog_key(connection), None)
+
+
+def server_catalog_key(pool):
+    """Return the (server, user) key a server catalog is shared under; visible databases depend on the user."""
+    return (f"{pool.host}:{pool.port}", pool.user)
+
+
+def load_server_catalog(connection):
+    """Load every database the user can see with its table names, in one query."""
+    query = (
+        "SELECT s.SCHEMA_NAME AS database_name, t.TABLE_NAME AS table_name "
+        "FROM information_schema.SCHEMATA s "
+        "LEFT JOIN information_schema.TABLES t ON t.TABLE_SCHEMA = s.SCHEMA_NAME "
+        "ORDER BY s.SCHEMA_NAME, t.TABLE_NAME"
+    )
+    rows = execute_query(connection, query, use_cache=False)
+    if rows is None:
+        return None
+
+    tables = {}
+    for row in rows:
+        database_tables = tables.setdefault(row["database_name"], [])
+        if row["table_name"] is not None:
+            database_tables.append(row["table_name"])
+    user_databases = [database for database in tables if database.lower() not in SYSTEM_DATABASES]
+    return {
+        "databases": user_databases or list(tables),
+        "tables": tables,
+        "loaded_at": time.time(),
+    }
+
+
+def _reload_server_catalog(pool, key):
+    with tracing.span("server.catalog") as span:
+        with pool.connection(None, read=True) as connection:
+            catalog = load_server_catalog(connection)
+        span.set(databases=None if catalog is None else len(catalog["tables"]))
+    if catalog is not None:
+        catalog["key"] = key
+        with _server_catalog_lock:
+            _server_catalogs[key] = catalog
+    return catalog
+
+
+def _refresh_server_catalog(pool, key, stop, interval):
+    while not stop.wait(interval):
+        try:
+            _reload_server_catalog(pool, key)
+        except Exception as err:
+            print(f"Error refreshing database list: {err}")
+
+
+def get_server_catalog(pool, max_age=None):
+    """Return the databases and table names visible to a pool's login, shared across sessions.
+
+    The first call loads the catalog and starts a daemon thread that reloads
+    it every SERVER_CATALOG_REFRESH_INTERVAL seconds, so later calls answer
+    from memory. Pass ``max_age`` to reload a catalog older than that many
+    seconds right away (0 always reloads). Returns None if it cannot be loaded.
+    """
+    key = server_catalog_key(pool)
+    with _server_catalog_lock:
+        cached = _server_catalogs.get(key)
+        if key not in _server_catalog_refreshers:
+            stop = threading.Event()
+            thread = threading.Thread(
+                target=_refresh_server_catalog,
+                args=(pool, key, stop, SERVER_CATALOG_REFRESH_INTERVAL),
+                name="server-catalog-refresh",
+                daemon=True,
+            )
+            _server_catalog_refreshers[key] = stop
+            thread.start()
+    if cached is not None and (max_age is None or time.time() - cached["loaded_at"] < max_age):
+        return cached
+    try:
+        return _reload_server_catalog(pool, key) or cached
+    except Exception as err:
+        print(f"Error loading database list: {err}")
+        return cached
+
+
+def stop_server_catalog_refresh(pool):
+    """Stop the background reloads of a pool's server catalog and forget it."""
+    key = server_catalog_key(pool)
+    with _server_catalog_lock:
+        stop = _server_catalog_refreshers.pop(key, None)
+        _server_catalogs.pop(key, None)
+    if stop is not None:
+        stop.set()
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection became free within the wait timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of MySQL connections for one server login.
+
+    Connections are opened with autocommit enabled and switched between
+    databases with ``select_db`` rather than reconnecting. Idle connections
+    are pinged before reuse and replaced once they exceed POOL_RECYCLE_AFTER.
+    ``connection_factory`` replaces create_connection, e.g. to point the pool
+    at a local stand-in server in benchmarks. A pool for a read replica gets
+    its primary's "host:port" as ``cluster`` (see catalog_key).
+    """
+
+    def __init__(self, host, user, password, port=3306, max_size=POOL_MAX_SIZE,
+                 max_idle=POOL_MAX_IDLE, wait_timeout=POOL_WAIT_TIMEOUT, connection_factory=None, cluster=None):
+        self.host = host
+        self.user = user
+        self.cluster = cluster
+        self._password = password
+        self.port = int(port)
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.wait_timeout = wait_timeout
+        self._connection_factory = connection_factory or create_connection
+        self._idle = []
+        self._size = 0
+        self._condition = threading.Condition()
+        # Kept outside the pool so a query can be killed even when every pooled connection is busy
+        self._control_connection = None
+        self._control_lock = threading.Lock()
+        self._metrics = {
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "created": 0,
+            "recycled": 0,
+            "health_check_failures": 0,
+            "database_switches": 0,
+            "queries_killed": 0,
+        }
+
+    def _open(self, database):
+        connection = self._connection_factory(
+            self.host, self.user, self._password, database, port=self.port, autocommit=True
+        )
+        connection._pool_created_at = time.monotonic()
+        connection._pool = self
+        connection._cluster = self.cluster
+        self._count("created")
+        return connection
+
+    def _count(self, metric):
+        with self._condition:
+            self._metrics[metric] += 1
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except pymysql.Error:
+            pass
+
+    def _is_usable(self, connection, idle_since):
+        if time.monotonic() - connection._pool_created_at > POOL_RECYCLE_AFTER:
+            self._count("recycled")
+            return False
+        if time.monotonic() - idle_since > POOL_HEALTH_CHECK_AFTER:
+            try:
+                connection.ping(reconnect=False)
+            except pymysql.Error:
+                self._count("health_check_failures")
+                return False
+        return True
+
+    @property
+    def in_use(self):
+        """Connections currently checked out (or being opened)."""
+        with self._condition:
+            return self._size - len(self._idle)
+
+    def acquire(self, database, timeout=None, read=False):
+        """Check out a connection switched to ``database`` (None accepts any database).
+
+        ``read`` marks checkouts that only read; one server serves both here
+        (see ReplicaRouter).
+        """
+        timeout = self.wait_timeout if timeout is None else timeout
+        started = time.monotonic()
+        waited = False
+        with self._condition:
+            while not self._idle and self._size >= self.max_size:
+                waited = True
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._metrics["timeouts"] += 1
+                    raise PoolTimeoutError(
+                        f"No MySQL connection available after {timeout}s "
+                        f"({self._size} of {self.max_size} in use)"
+                    )
+                self._condition.wait(remaining)
+
+            wait_seconds = time.monotonic() - started
+            self._metrics["checkouts"] += 1
+            if waited:
+                self._metrics["waits"] += 1
+                self._metrics["total_wait_seconds"] += wait_seconds
+                self._metrics["max_wait_seconds"] = max(self._metrics["max_wait_seconds"], wait_seconds)
+
+            # Prefer an idle connection that is already on the right database
+            entry = None
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i][0].db == database:
+                    entry = self._idle.pop(i)
+                    break
+            if entry is None and self._idle:
+                entry = self._idle.pop()
+            # Reserve the slot before doing any network I/O outside the lock
+            if entry is None:
+                self._size += 1
+
+        try:
+            if entry is not None:
+                connection, idle_since = entry
+                if not self._is_usable(connection, idle_since):
+                    self._discard(connection)
+                    entry = None
+            if entry is None:
+                return self._open(database)
+
+            if database is not None and connection.db != database:
+                connection.select_db(database)
+                connection.db = database
+                self._count("database_switches")
+            return connection
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, connection):
+        """Return a checked-out connection to the pool."""
+        keep = connection.open
+        if keep and connection.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            try:
+                connection.rollback()
+            except pymysql.Error:
+                keep = False
+        with self._condition:
+            if keep and len(self._idle) < self.max_idle:
+                self._idle.append((connection, time.monotonic()))
+            else:
+                self._size -= 1
+                self._discard(connection)
+            self._condition.notify()
+
+    def kill_query(self, thread_id):
+        """Stop the statement running on a server connection (KILL QUERY), over the control connection.
+
+        Returns False if the statement could not be killed, e.g. because it
+        had already finished.
+        """
+        with self._control_lock:
+            try:
+                if self._control_connection is None or not self._control_connection.open:
+                    self._control_connection = self._open(None)
+                cursor = self._control_connection.cursor()
+                try:
+                    cursor.execute(f"KILL QUERY {int(thread_id)}")
+                finally:
+                    cursor.close()
+            except pymysql.Error as err:
+                # 1094: unknown thread id, the connection is already gone
+                if not (err.args and err.args[0] == 1094):
+                    print(f"Error killing query: {err}")
+                    if self._control_connection is not None:
+                        self._discard(self._control_connection)
+                        self._control_connection = None
+                return False
+        with self._condition:
+            self._metrics["queries_killed"] += 1
+        return True
+
+    @contextmanager
+    def connection(self, database, timeout=None, read=False):
+        """Context manager that checks a connection out and always returns it."""
+        connection = self.acquire(database, timeout=timeout, read=read)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def stats(self):
+        """Return pool size and wait-time metrics."""
+        with self._condition:
+            stats = dict(self._metrics)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+            stats["max_size"] = self.max_size
+        checkouts = stats["checkouts"] or 1
+        stats["avg_wait_seconds"] = stats["total_wait_seconds"] / checkouts
+        return stats
+
+    def close_all(self):
+        """Close every idle connection; checked-out ones close when released."""
+        stop_server_catalog_refresh(self)
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self.max_idle = 0
+            self._condition.notify_all()
+        for connection, _ in idle:
+            self._discard(connection)
+        with self._control_lock:
+            if self._control_connection is not None:
+                self._discard(self._control_connection)
+                self._control_connection = None
+
+
+def fetch_replica_lag(connection):
+    """Seconds a replica is behind its source, or None if it is not replicating."""
+    cursor = connection.cursor(pymysql.cursors.DictCursor)
+    try:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except pymysql.err.ProgrammingError:
+            # MySQL before 8.0.22
+            cursor.execute("SHOW SLAVE STATUS")
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    if not row:
+        return None
+    lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+    return None if lag is None else float(lag)
+
+
+class ReplicaRouter:
+    """A primary's connection pool plus pools for its read replicas, used like one ConnectionPool.
+
+    Checkouts with ``read=True`` go to the replica with the fewest
+    connections checked out among those that replicate, are at most
+    ``max_lag`` seconds behind and have caught up with the last write this
+    process committed to the database (so a question asked right after a
+    write reads its own change). Everything else, and reads when no replica
+    qualifies, goes to the primary. A daemon thread checks every replica's
+    lag each REPLICA_LAG_CHECK_INTERVAL seconds.
+    """
+
+    def __init__(self, primary, replicas, max_lag=None, check_interval=None):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.host = primary.host
+        self.user = primary.user
+        self.port = primary.port
+        self.max_size = primary.max_size
+        self.max_lag = REPLICA_MAX_LAG if max_lag is None else max_lag
+        self.check_interval = REPLICA_LAG_CHECK_INTERVAL if check_interval is None else check_interval
+        self._address = f"{primary.host}:{primary.port}"
+        self._lock = threading.Lock()
+        self._next = 0
+        self._status = {
+            replica: {"healthy": False, "lag": None, "caught_up_to": None, "error": "not checked yet"}
+            for replica in self.replicas
+        }
+        self._metrics = {"replica_reads": 0, "primary_reads": 0, "replica_failures": 0}
+        self._stop = threading.Event()
+        self._checker = threading.Thread(target=self._run_checks, name="replica-lag-check", daemon=True)
+        self._checker.start()
+
+    def _check_replica(self, replica):
+        checked_at = time.monotonic()
+        try:
+            with replica.connection(None, timeout=self.check_interval) as connection:
+                lag = fetch_replica_lag(connection)
+            error = None if lag is not None else "not replicating"
+        except PoolTimeoutError:
+            # Busy serving reads; judge it on the next round
+            return
+        except Exception as err:
+            lag, error = None, str(err)
+        if error is None and lag > self.max_lag:
+            error = f"{lag:.0f} s behind"
+        with self._lock:
+            status = self._status[replica]
+            if (error is None) != status["healthy"]:
+                state = "back in rotation" if error is None else f"out of rotation ({error})"
+                print(f"Read replica {replica.host}:{replica.port} {state}")
+            status.update(
+                healthy=error is None,
+                lag=lag,
+                error=error,
+                # Seconds_Behind_Source is whole seconds
+                caught_up_to=None if lag is None else checked_at - lag - 1,
+            )
+
+    def _run_checks(self):
+        while True:
+            for replica in self.replicas:
+                self._check_replica(replica)
+            if self._stop.wait(self.check_interval):
+                return
+
+    def _pick_replica(self, database):
+        written = last_write((self._address, database))
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % max(len(self.replicas), 1)
+            candidates = [
+                self.replicas[(start + i) % len(self.replicas)] for i in range(len(self.replicas))
+            ]
+            candidates = [
+                replica for replica in candidates
+                if self._status[replica]["healthy"]
+                and (written is None or self._status[replica]["caught_up_to"] > written)
+            ]
+        # Least outstanding requests; the rotating start breaks ties
+        return min(candidates, key=lambda replica: replica.in_use, default=None)
+
+    def acquire(self, database, timeout=None, read=False):
+        """Check out a connection: from a replica for reads when one qualifies, else from the primary."""
+        replica = self._pick_replica(database) if read else None
+        if replica is not None:
+            try:
+                connection = replica.acquire(database, timeout=timeout)
+                with self._lock:
+                    self._metrics["replica_reads"] += 1
+                return connection
+            except (PoolTimeoutError, pymysql.Error) as err:
+                print(f"Read replica {replica.host}:{replica.port} failed, reading from the primary: {err}")
+                with self._lock:
+                    self._metrics["replica_failures"] += 1
+                    self._status[replica].update(healthy=False, error=str(err))
+        if read:
+            with self._lock:
+                self._metrics["primary_reads"] += 1
+        return self.primary.acquire(database, timeout=timeout)
+
+    def release(self, connection):
+        """Return a checked-out connection to the pool it came from."""
+        connection._pool.release(connection)
+
+    @contextmanager
+    def connection(self, database, timeout=None, read=False):
+        """Context manager that checks a connection out and always returns it."""
+        connection = self.acquire(database, timeout=timeout, read=read)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def kill_query(self, thread_id):
+        """KILL QUERY on the primary (QueryControl kills through a connection's own pool)."""
+        return self.primary.kill_query(thread_id)
+
+    def stats(self):
+        """Return the primary pool's metrics plus read routing and per-replica status."""
+        stats = self.primary.stats()
+        with self._lock:
+            stats.update(self._metrics)
+            statuses = {replica: dict(status) for replica, status in self._status.items()}
+        stats["replicas"] = [
+            {
+                "target": f"{replica.host}:{replica.port}",
+                "healthy": statuses[replica]["healthy"],
+                "lag": statuses[replica]["lag"],
+                "error": statuses[replica]["error"],
+                "in_use": replica.in_use,
+            }
+            for replica in self.replicas
+        ]
+        return stats
+
+    def close_all(self):
+        """Stop the lag checks and close every pool's idle connections."""
+        self._stop.set()
+        self.primary.close_all()
+        for replica in self.replicas:
+            replica.close_all()
+
+
+def parse_targets(text, default_port=3306):
+    """Parse "host[:port], host[:port]" into a list of (host, port) pairs."""
+    targets = []
+    for item in (text or "").replace(";", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.rpartition(":") if ":" in item else (item, "", "")
+        targets.append((host, int(port) if port else default_port))
+    return targets
+
+
+def create_pool(host, user, password, port=3306, replicas=(), **pool_options):
+    """Return a ConnectionPool for a server, or a ReplicaRouter if read replicas are given.
 
+    ``replicas`` are (host, port) pairs reached with the same credentials.
+    """
+    primary = ConnectionPool(host, user, password, port=port, **pool_options)
+    if not replicas:
+        return primary
+    cluster = f"{host}:{int(port)}"
+    return ReplicaRouter(primary, [
+        ConnectionPool(replica_host, user, password, port=replica_port, cluster=cluster, **pool_options)
+        for replica_host, replica_port in replicas
+    ])
@@ -0,0 +1,185 @@
+import re
+
+# Statements that may follow each other in one extracted script
+SCRIPT_STATEMENTS = {"insert", "replace", "update", "delete"}
+# Words a statement can start with; a fence "info string" that is one of them is SQL, not a language tag
+_STATEMENT_WORDS = {
+    "select", "with", "insert", "replace", "update", "delete", "show", "describe", "desc", "explain",
+    "create", "alter", "drop", "truncate", "rename", "use", "set", "call", "table", "values",
+}
+# Leading whitespace and comments, then the first word and the character after it
+_LEADING_WORD = re.compile(r"(?:\s+|--[^\n]*\n|#[^\n]*\n|/\*.*?\*/)*([A-Za-z]*)(.?)", re.S)
+
+
+def _leading_word(text):
+    """The lowercased first word of a statement, "" if it starts otherwise, None if not known yet."""
+    word, after = _LEADING_WORD.match(text).groups()
+    if not after or (not word and after in "-/#"):
+        return None
+    return word.lower()
+
+
+class SQLExtractor:
+    """Incrementally pull the first SQL statement out of streamed model output.
+
+    Markdown fences are understood (the ```sql info string, up to the first
+    whitespace, is dropped unless it starts the statement, as in a one-line
+    ```SELECT 1;```, and any chatter before the opening fence is
+    discarded), quoted strings, backtick identifiers and comments are
+    tracked so a ``;`` inside them does not end the statement. ``complete`` becomes True once a terminating ``;`` or the
+    closing fence has been seen, at which point the caller can stop reading.
+    Data changes (SCRIPT_STATEMENTS) are the exception: a ``;`` after one
+    keeps reading as long as the next statement is a data change too, so a
+    multi-statement write comes out as one script.
+    """
+
+    def __init__(self):
+        self._chars = []
+        self._in_fence = False
+        self._skipping_info = False
+        self._info = []
+        self._quote = None
+        self._escaped = False
+        self._line_comment = False
+        self._block_comment = False
+        self._pending_backticks = 0
+        self._prev = ""
+        # Lengths of _chars at each ``;`` that ended a data change
+        self._boundaries = []
+        # Whether the statement after the last boundary has yet to show its first word
+        self._deciding = False
+        self.complete = False
+
+    @property
+    def sql(self):
+        """The statement extracted so far, without surrounding whitespace."""
+        return "".join(self._chars).strip()
+
+    def feed(self, text):
+        """Consume the next chunk of model output; returns True once complete."""
+        for char in text:
+            if self.complete:
+                break
+            if char == "`" and self._quote not in ("'", '"') and not self._in_comment():
+                self._pending_backticks += 1
+                continue
+            if self._pending_backticks:
+                self._flush_backticks()
+                if self.complete:
+                    break
+            self._consume(char)
+        return self.complete
+
+    def finish(self):
+        """Signal the end of the stream and return the extracted statement."""
+        if self._pending_backticks and not self.complete:
+            self._flush_backticks()
+        if self._skipping_info:
+            self._end_info()
+        if self._boundaries:
+            tail = "".join(self._chars[self._boundaries[-1]:])
+            if tail.strip() and _leading_word(tail + "\n") not in SCRIPT_STATEMENTS:
+                self._end_script()
+        return self.sql
+
+    def _end_script(self):
+        # Whatever follows the last data change is not part of the script
+        del self._chars[self._boundaries[-1]:]
+        self._deciding = False
+        self.complete = True
+
+    def _in_comment(self):
+        return self._line_comment or self._block_comment
+
+    def _flush_backticks(self):
+        run = self._pending_backticks
+        self._pending_backticks = 0
+        if run >= 3 and self._quote is None:
+            if self._in_fence:
+                if self._skipping_info:
+                    self._end_info()
+                self.complete = True
+            else:
+                # Anything before the opening fence is chatter, not SQL
+                self._chars = []
+                self._in_fence = True
+                self._skipping_info = True
+                self._info = []
+            return
+        if self._skipping_info:
+            self._info.append("`" * run)
+            return
+        self._chars.append("`" * run)
+        if run % 2:
+            self._quote = None if self._quote == "`" else "`"
+        self._prev = "`"
+
+    def _end_info(self, after=""):
+        """The info string after an opening fence ended; replay it if it was the start of the SQL."""
+        self._skipping_info = False
+        info = "".join(self._info)
+        self._info = []
+        if info.lstrip("(").lower() in _STATEMENT_WORDS:
+            self.feed(info + after)
+            if self._pending_backticks and not self.complete:
+                self._flush_backticks()
+
+    def _consume(self, char):
+        if self._skipping_info:
+            if char.isspace():
+                self._end_info(char)
+            else:
+                self._info.append(char)
+            return
+
+        self._chars.append(char)
+        prev, self._prev = self._prev, char
+        if self._deciding:
+            word = _leading_word("".join(self._chars[self._boundaries[-1]:]))
+            if word is not None:
+                if word not in SCRIPT_STATEMENTS:
+                    self._end_script()
+                    return
+                self._deciding = False
+
+        if self._line_comment:
+            if char == "\n":
+                self._line_comment = False
+            return
+        if self._block_comment:
+            if prev == "*" and char == "/":
+                self._block_comment = False
+                self._prev = ""
+            return
+        if self._quote is not None:
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == self._quote:
+                self._quote = None
+            return
+
+        if char in ("'", '"'):
+            self._quote = char
+        elif char == "#" or (prev == "-" and char == "-"):
+            self._line_comment = True
+        elif prev == "/" and char == "*":
+            self._block_comment = True
+            self._prev = ""
+        elif char == ";":
+            start = self._boundaries[-1] if self._boundaries else 0
+            if _leading_word("".join(self._chars[start:])) in SCRIPT_STATEMENTS:
+                self._boundaries.append(len(self._chars))
+                self._deciding = True
+            elif self._boundaries:
+                self._end_script()
+            else:
+                self.complete = True
+
+
+def extract_sql(text):
+    """Extract the first SQL statement (or data-change script) from a complete model response."""
+    extractor = SQLExtractor()
+    extractor.feed(text)
+    return extractor.finish()
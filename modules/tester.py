@@ -1,26 +1,26 @@
 import sql_connector as sql
-import mysql_query_generator as query_gen
-import pandas as pd
-import os
-import pymysql
+from chatbot_engine import ChatbotEngine
 
 
-conncection=sql.create_connection("localhost","root","123","classicmodels")
+pool = sql.ConnectionPool("localhost", "root", "123")
+engine = ChatbotEngine(pool)
 
 while True:
     request= str(input("Enter your request: "))
     if f"{request.lower()}".strip() == "exit":
         print("Exiting the program.")
         break
-    query = query_gen.generate_mysql_query(request)
-    sql.execute_query(conncection, query)
-    df = pd.DataFrame(sql.execute_query(conncection, query))
+    response = engine.ask(request, "classicmodels")
+    print(f"Generated query: {response['sql']}")
+    df = response["data"]
     
-    if df.empty:
+    if response["status"] != "ok":
+        print(f"Query failed: {response['error']}")
+    elif df is None or df.empty:
         print("No data found for the query.")
     else:
         print("Query executed successfully. Here are the results:")
         print(df)
     
-sql.close_connection(conncection)
-
+engine.shutdown()
+pool.close_all()
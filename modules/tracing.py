@@ -0,0 +1,339 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Append every finished trace as one JSON line to this file (empty disables)
+TRACE_LOG_PATH = os.environ.get("DB_CHATBOT_TRACE_LOG", "")
+# Rewrite Prometheus text-format metrics to this file after every trace (empty disables),
+# e.g. into a node_exporter textfile collector directory
+METRICS_PATH = os.environ.get("DB_CHATBOT_METRICS_FILE", "")
+# Serve the metrics on http://0.0.0.0:<port>/metrics when set
+METRICS_PORT = os.environ.get("DB_CHATBOT_METRICS_PORT", "")
+# Finished traces kept in memory for the UI
+RECENT_TRACES = 100
+# Durations kept per span name for the percentile summary
+RECENT_DURATIONS = 1000
+# Prometheus histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Numeric span attributes that are also summed into Prometheus counters
+COUNTED_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "rows", "bytes")
+
+_current_trace = contextvars.ContextVar("db_chatbot_trace", default=None)
+_current_span = contextvars.ContextVar("db_chatbot_span", default=None)
+
+
+class Span:
+    """One timed stage of a request; attributes are set with ``set``."""
+
+    def __init__(self, name, parent=None, offset_ms=0.0, **attributes):
+        self.name = name
+        self.parent = parent
+        self.offset_ms = offset_ms
+        self.attributes = dict(attributes)
+        self.duration_ms = None
+        self.cpu_ms = None
+        self.error = None
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def elapsed_ms(self):
+        """Milliseconds since the span started (its duration once finished)."""
+        if self.duration_ms is not None:
+            return self.duration_ms
+        return (time.perf_counter() - self._started) * 1000
+
+    @property
+    def seconds(self):
+        return (self.duration_ms or 0.0) / 1000
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "parent": self.parent,
+            "offset_ms": round(self.offset_ms, 3),
+            "duration_ms": None if self.duration_ms is None else round(self.duration_ms, 3),
+            "cpu_ms": None if self.cpu_ms is None else round(self.cpu_ms, 3),
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """The spans recorded while answering one question.
+
+    A trace is made current with ``activate``; ``span`` then attaches to it
+    from any module without the trace being passed around. Thread pools do
+    not inherit the current trace, so each worker activates it again.
+    """
+
+    def __init__(self, name, **attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = dict(attributes)
+        self.started_at = time.time()
+        self.duration_ms = None
+        self.spans = []
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def _offset_ms(self):
+        return (time.perf_counter() - self._started) * 1000
+
+    def _add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def stage_seconds(self):
+        """Seconds per top-level span name."""
+        stages = {}
+        for span in self.spans:
+            if span.parent is None and span.duration_ms is not None:
+                stages[span.name] = stages.get(span.name, 0.0) + span.seconds
+        return stages
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.offset_ms)
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": None if self.duration_ms is None else round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "spans": [span.to_dict() for span in spans],
+        }
+
+
+class Metrics:
+    """Process-wide per-span latency histograms and attribute counters."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._spans = {}
+
+    def observe(self, span):
+        with self._lock:
+            stats = self._spans.get(span.name)
+            if stats is None:
+                stats = self._spans[span.name] = {
+                    "count": 0,
+                    "errors": 0,
+                    "sum": 0.0,
+                    "buckets": [0] * len(self.buckets),
+                    "recent": deque(maxlen=RECENT_DURATIONS),
+                    "totals": {},
+                }
+            seconds = span.seconds
+            stats["count"] += 1
+            stats["sum"] += seconds
+            stats["recent"].append(seconds)
+            if span.error is not None:
+                stats["errors"] += 1
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    stats["buckets"][i] += 1
+            for attribute in COUNTED_ATTRIBUTES:
+                value = span.attributes.get(attribute)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats["totals"][attribute] = stats["totals"].get(attribute, 0) + value
+
+    def summary(self):
+        """Per span name: count, errors, mean/p50/p95 ms and attribute totals."""
+        with self._lock:
+            snapshot = {name: (dict(stats), sorted(stats["recent"])) for name, stats in self._spans.items()}
+        summary = {}
+        for name, (stats, recent) in sorted(snapshot.items()):
+            summary[name] = {
+                "count": stats["count"],
+                "errors": stats["errors"],
+                "mean_ms": stats["sum"] / stats["count"] * 1000,
+                "p50_ms": _percentile(recent, 0.50) * 1000,
+                "p95_ms": _percentile(recent, 0.95) * 1000,
+                **stats["totals"],
+            }
+        return summary
+
+    def render_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            snapshot = {
+                name: {**stats, "buckets": list(stats["buckets"]), "totals": dict(stats["totals"])}
+                for name, stats in self._spans.items()
+            }
+        lines = [
+            "# HELP db_chatbot_span_duration_seconds Duration of chatbot pipeline stages.",
+            "# TYPE db_chatbot_span_duration_seconds histogram",
+        ]
+        for name, stats in sorted(snapshot.items()):
+            label = f'span="{_escape_label(name)}"'
+            for bound, count in zip(self.buckets, stats["buckets"]):
+                lines.append(f'db_chatbot_span_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'db_chatbot_span_duration_seconds_bucket{{{label},le="+Inf"}} {stats["count"]}')
+            lines.append(f"db_chatbot_span_duration_seconds_sum{{{label}}} {stats['sum']}")
+            lines.append(f"db_chatbot_span_duration_seconds_count{{{label}}} {stats['count']}")
+        lines.append("# HELP db_chatbot_span_errors_total Spans that ended with an exception.")
+        lines.append("# TYPE db_chatbot_span_errors_total counter")
+        for name, stats in sorted(snapshot.items()):
+            lines.append(f'db_chatbot_span_errors_total{{span="{_escape_label(name)}"}} {stats["errors"]}')
+        for attribute in COUNTED_ATTRIBUTES:
+            lines.append(f"# HELP db_chatbot_{attribute}_total Sum of the {attribute} attribute per span.")
+            lines.append(f"# TYPE db_chatbot_{attribute}_total counter")
+            for name, stats in sorted(snapshot.items()):
+                if attribute in stats["totals"]:
+                    lines.append(
+                        f'db_chatbot_{attribute}_total{{span="{_escape_label(name)}"}} {stats["totals"][attribute]}'
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Atomically rewrite a Prometheus textfile with the current metrics."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as handle:
+            handle.write(self.render_prometheus())
+        os.replace(temp_path, path)
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_metrics = Metrics()
+_recent_traces = deque(maxlen=RECENT_TRACES)
+_export_lock = threading.Lock()
+_metrics_server = None
+
+
+def get_metrics():
+    """Return the process-wide metrics registry."""
+    return _metrics
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def activate(trace):
+    """Make ``trace`` the current trace for spans opened in this context."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a block as a span of the current trace and record it in the metrics.
+
+    Without a current trace the span still feeds the process-wide metrics.
+    """
+    trace = _current_trace.get()
+    parent = _current_span.get()
+    record = Span(
+        name,
+        parent=parent.name if parent is not None else None,
+        offset_ms=trace._offset_ms() if trace is not None else 0.0,
+        **attributes,
+    )
+    token = _current_span.set(record)
+    cpu_started = time.thread_time()
+    try:
+        yield record
+    except Exception as err:
+        record.error = f"{type(err).__name__}: {err}"
+        raise
+    finally:
+        record.duration_ms = (time.perf_counter() - record._started) * 1000
+        record.cpu_ms = (time.thread_time() - cpu_started) * 1000
+        _current_span.reset(token)
+        if trace is not None:
+            trace._add(record)
+        _metrics.observe(record)
+
+
+def finish(trace, **attributes):
+    """Close a trace, keep it for the UI and export it; returns its dict form."""
+    trace.attributes.update(attributes)
+    trace.duration_ms = trace._offset_ms()
+    total = Span(trace.name)
+    total.duration_ms = trace.duration_ms
+    total.error = trace.attributes.get("error")
+    _metrics.observe(total)
+    record = trace.to_dict()
+    _recent_traces.append(record)
+    with _export_lock:
+        try:
+            if TRACE_LOG_PATH:
+                directory = os.path.dirname(TRACE_LOG_PATH)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(TRACE_LOG_PATH, "a") as handle:
+                    handle.write(json.dumps(record, default=str) + "\n")
+            if METRICS_PATH:
+                _metrics.write_prometheus(METRICS_PATH)
+        except OSError as err:
+            print(f"Error exporting trace: {err}")
+    return record
+
+
+def recent_traces(limit=None):
+    """Most recent finished traces, newest first."""
+    traces = list(_recent_traces)[::-1]
+    return traces if limit is None else traces[:limit]
+
+
+def start_metrics_server(port=None, host="0.0.0.0"):
+    """Serve /metrics in a daemon thread (once per process); returns the server or None."""
+    global _metrics_server
+    port = port if port is not None else (int(METRICS_PORT) if METRICS_PORT else None)
+    if port is None:
+        return None
+    with _export_lock:
+        if _metrics_server is not None:
+            return _metrics_server
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = _metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            _metrics_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as err:
+            print(f"Error starting metrics server: {err}")
+            return None
+        threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _metrics_server
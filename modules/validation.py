@@ -0,0 +1,508 @@
+import difflib
+import re
+
+# Minimum similarity (0-1) for a misspelled identifier to be corrected to a catalog name
+FUZZY_CUTOFF = 0.8
+
+_TOKEN = re.compile(
+    r"""
+    (?P<ws>\s+)
+    |(?P<hint>/\*\+.*?\*/)
+    |(?P<comment>--(?=\s|$)[^\n]*|\#[^\n]*|/\*.*?\*/)
+    |(?P<quoted>`(?:[^`]|``)*`)
+    |(?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+    |(?P<number>0x[0-9A-Fa-f]+|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    |(?P<variable>@@?(?:`[^`]*`|[A-Za-z0-9_.$]+)|\?|%s)
+    |(?P<word>[A-Za-z_$][A-Za-z0-9_$]*)
+    |(?P<op><=>|<=|>=|<>|!=|:=|\|\||&&|<<|>>|->>|->|[-+*/%=<>!~^&|(),.;:{}])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+_STATEMENTS = {
+    "select", "with", "show", "describe", "desc", "explain", "insert", "replace", "update", "delete",
+    "create", "alter", "drop", "truncate", "rename", "set", "call",
+}
+# Statements that may be combined into one script, run in a single transaction
+SCRIPT_STATEMENTS = {"insert", "replace", "update", "delete"}
+# Statements whose table and column references are checked against the catalog
+_CHECKED_STATEMENTS = {"select", "with", "insert", "replace", "update", "delete", "describe", "desc", "explain"}
+
+# Words that are never identifiers in the statements the model generates
+KEYWORDS = {
+    "accessible", "add", "after", "against", "algorithm", "all", "alter", "analyze", "and", "any", "as", "asc",
+    "auto_increment", "avg_row_length", "before", "between", "bigint", "binary", "blob", "boolean", "both", "by",
+    "call", "cascade", "case", "cast", "change", "char", "character", "charset", "check", "collate", "column",
+    "columns", "constraint", "convert", "create", "cross", "cube", "current", "current_date", "current_time",
+    "current_timestamp", "current_user", "database", "databases", "date", "datetime", "day", "day_hour",
+    "day_minute", "day_second", "dec", "decimal", "default", "delayed", "delete", "desc", "describe", "distinct",
+    "distinctrow", "div", "double", "drop", "dual", "duplicate", "else", "elseif", "enclosed", "end", "engine",
+    "enum", "escape", "escaped", "except", "exists", "explain", "false", "fields", "first", "float", "following",
+    "for", "force", "foreign", "format", "from", "full", "fulltext", "generated", "global", "grant", "group",
+    "grouping", "having", "high_priority", "hour", "hour_minute", "hour_second", "if", "ignore", "in", "index",
+    "infile", "inner", "insert", "int", "integer", "intersect", "interval", "into", "is", "join", "json", "key",
+    "keys", "last", "lateral", "leading", "left", "like", "limit", "lines", "local", "localtime",
+    "localtimestamp", "lock", "longtext", "low_priority", "match", "mediumint", "mediumtext", "microsecond",
+    "minute", "minute_second", "mod", "mode", "month", "natural", "no", "not", "null", "nulls", "numeric",
+    "of", "offset", "on", "optionally", "or", "order", "outer", "outfile", "over", "partition", "preceding",
+    "primary", "procedure", "quarter", "range", "read", "real", "recursive", "references", "regexp", "rename",
+    "replace", "restrict", "right", "rlike", "rollup", "row", "rows", "schema", "schemas", "second", "select",
+    "separator", "set", "share", "show", "signed", "smallint", "sounds", "sql_big_result",
+    "sql_buffer_result", "sql_calc_found_rows", "sql_no_cache", "sql_small_result", "straight_join", "table",
+    "tables", "temporary", "terminated", "text", "then", "time", "timestamp", "tinyint", "tinytext", "to",
+    "trailing", "true", "truncate", "unbounded", "union", "unique", "unknown", "unsigned", "update", "usage",
+    "use", "using", "utc_date", "utc_time", "utc_timestamp", "values", "varbinary", "varchar", "view", "week",
+    "when", "where", "window", "with", "xor", "year", "year_month", "zerofill",
+}
+# Keywords that end a FROM clause's comma-separated table list
+_CLAUSE_KEYWORDS = {
+    "where", "group", "order", "having", "limit", "on", "using", "set", "union", "except", "intersect",
+    "window", "for", "lock", "into", "values", "select", "partition", "natural", "inner", "cross", "left",
+    "right", "straight_join", "join", "procedure",
+}
+# Functions whose arguments use FROM/IN without naming a table
+_FROM_FUNCTIONS = {"extract", "trim", "substring", "substr", "position", "overlay"}
+# Keywords after which an identifier is a column or expression, never an alias
+_OPERAND_KEYWORDS = {"end", "null", "true", "false", "current_date", "current_time", "current_timestamp"}
+
+
+def _tokenize(query):
+    """Split a statement into significant tokens; raises ValueError on unscannable input."""
+    tokens = []
+    position = 0
+    while position < len(query):
+        match = _TOKEN.match(query, position)
+        if match is None:
+            char = query[position]
+            if char in "'\"`":
+                raise ValueError(f"unterminated quote starting at character {position}")
+            raise ValueError(f"unexpected character {char!r} at position {position}")
+        kind = match.lastgroup
+        if kind not in ("ws", "comment", "hint"):
+            tokens.append({"kind": kind, "text": match.group(), "start": match.start(), "end": match.end()})
+        position = match.end()
+    return tokens
+
+
+def _name(token):
+    """Identifier text of a word or backtick-quoted token."""
+    if token["kind"] == "quoted":
+        return token["text"][1:-1].replace("``", "`")
+    return token["text"]
+
+
+def _is_identifier(token):
+    if token is None:
+        return False
+    if token["kind"] == "quoted":
+        return True
+    return token["kind"] == "word" and token["text"].lower() not in KEYWORDS
+
+
+def _word(token):
+    return token["text"].lower() if token is not None and token["kind"] == "word" else None
+
+
+def _ends_operand(token):
+    """True if the token can end an expression, so an identifier right after it is an alias."""
+    if token["kind"] in ("quoted", "number", "string") or token["text"] == ")":
+        return True
+    word = _word(token)
+    return word is not None and (word not in KEYWORDS or word in _OPERAND_KEYWORDS)
+
+
+def _quote_like(token, name):
+    return f"`{name}`" if token["kind"] == "quoted" else name
+
+
+def _validation_index(catalog):
+    """Lower-cased table and column names of a catalog, built once per catalog."""
+    index = catalog.get("validation_index")
+    if index is None:
+        tables = {name.lower(): name for name in catalog["tables"]}
+        columns = {
+            name.lower(): {column["Field"].lower(): column["Field"] for column in catalog["tables"][name]}
+            for name in catalog["tables"]
+        }
+        index = catalog["validation_index"] = {"tables": tables, "columns": columns}
+    return index
+
+
+def _squash(name):
+    return name.lower().replace("_", "")
+
+
+def closest_match(name, candidates, cutoff=None):
+    """Return the unambiguous closest candidate (a {lowered: canonical} dict) or None."""
+    cutoff = FUZZY_CUTOFF if cutoff is None else cutoff
+    lowered = name.lower()
+    if lowered in candidates:
+        return candidates[lowered]
+    # customer_name vs customerName, and plural/singular slips
+    squashed = {}
+    for key, canonical in candidates.items():
+        squashed.setdefault(_squash(key), []).append(canonical)
+    for variant in (_squash(lowered), _squash(lowered) + "s", _squash(lowered)[:-1] if lowered.endswith("s") else None):
+        if variant and len(squashed.get(variant, [])) == 1:
+            return squashed[variant][0]
+    matches = difflib.get_close_matches(lowered, list(candidates), n=2, cutoff=cutoff)
+    if not matches:
+        return None
+    if len(matches) == 2:
+        first = difflib.SequenceMatcher(None, lowered, matches[0]).ratio()
+        second = difflib.SequenceMatcher(None, lowered, matches[1]).ratio()
+        if first == second:
+            return None
+    return candidates[matches[0]]
+
+
+def _matching_paren(tokens, i):
+    depth = 0
+    for j in range(i, len(tokens)):
+        if tokens[j]["text"] == "(":
+            depth += 1
+        elif tokens[j]["text"] == ")":
+            depth -= 1
+            if depth == 0:
+                return j
+    return len(tokens) - 1
+
+
+class _Statement:
+    """Table sources, aliases and identifier positions found in one statement."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.tables = []        # (token index, database, table name)
+        self.aliases = {}       # lowered alias -> lowered table name or None for derived tables
+        self.derived = False    # a source with unknown columns (subquery, CTE, other database)
+        self.ctes = set()
+        self.defined = set()    # lowered select-list / derived aliases
+        self.consumed = set()   # token indexes that are not column references
+        self.insert_columns = []  # (token index, lowered table) for INSERT column lists
+        self._collect()
+
+    def _collect(self):
+        tokens = self.tokens
+        functions = []
+        in_from = False
+        statement = _word(tokens[0])
+        for i, token in enumerate(tokens):
+            text = token["text"].lower()
+            previous = tokens[i - 1] if i > 0 else None
+            following = tokens[i + 1] if i + 1 < len(tokens) else None
+
+            if text == "(":
+                functions.append(_word(previous) if previous is not None else None)
+                continue
+            if text == ")":
+                if functions:
+                    functions.pop()
+                in_from = False
+                continue
+
+            # CTE names: WITH name AS (...), name AS (...)
+            if (_is_identifier(token) and _word(following) == "as"
+                    and i + 2 < len(tokens) and tokens[i + 2]["text"] == "("
+                    and previous is not None and (_word(previous) in ("with", "recursive") or previous["text"] == ",")):
+                self.ctes.add(_name(token).lower())
+                self.consumed.add(i)
+                continue
+
+            # Named windows: WINDOW w AS (...), referenced as OVER w
+            if _is_identifier(token) and _word(previous) == "window":
+                self.defined.add(_name(token).lower())
+                self.consumed.add(i)
+                continue
+
+            # Character sets and collations: CONVERT(x USING cs), x COLLATE c,
+            # CHARACTER SET cs, and introducers such as _utf8mb4'text'
+            if token["kind"] == "word" and (
+                    _word(previous) in ("collate", "charset")
+                    or _word(previous) == "using" and functions and functions[-1] == "convert"
+                    or _word(previous) == "set" and i > 1 and _word(tokens[i - 2]) == "character"
+                    or text.startswith("_") and following is not None and following["kind"] == "string"
+                    and following["start"] == token["end"]):
+                self.consumed.add(i)
+                continue
+
+            starts_table = False
+            if token["kind"] == "word":
+                if text == "from" and (not functions or functions[-1] not in _FROM_FUNCTIONS):
+                    starts_table = True
+                elif text == "join" or text == "straight_join":
+                    starts_table = True
+                elif text == "update" and _word(previous) not in ("key", "for"):
+                    starts_table = True
+                elif text == "into" and statement in ("insert", "replace"):
+                    starts_table = True
+                elif text == "table" and _word(previous) in ("truncate", "describe", "desc"):
+                    starts_table = True
+                elif text in ("describe", "desc", "explain") and i == 0 and _is_identifier(following):
+                    starts_table = True
+                elif text in _CLAUSE_KEYWORDS:
+                    in_from = False
+            if starts_table:
+                in_from = text == "from" or text.endswith("join")
+                self._table_reference(i + 1, statement)
+            elif in_from and token["text"] == ",":
+                self._table_reference(i + 1, statement)
+
+            # Aliases: "expr AS alias" and bare "expr alias"
+            if (_is_identifier(token) and i not in self.consumed and previous is not None
+                    and (_word(previous) == "as" or _ends_operand(previous))
+                    and (following is None or following["text"] not in (".", "("))):
+                self.defined.add(_name(token).lower())
+                self.consumed.add(i)
+
+    def _table_reference(self, i, statement):
+        tokens = self.tokens
+        if i >= len(tokens):
+            return
+        if tokens[i]["text"] == "(":
+            # Derived table: its alias names a source with unknown columns
+            end = _matching_paren(tokens, i)
+            self.derived = True
+            self._alias(end + 1, None)
+            return
+        if not (_is_identifier(tokens[i]) or tokens[i]["kind"] == "word" and _word(tokens[i]) not in _CLAUSE_KEYWORDS
+                and _word(tokens[i]) not in ("dual", "lateral", "select")):
+            return
+        database, name_index = None, i
+        if i + 2 < len(tokens) and tokens[i + 1]["text"] == "." and tokens[i + 2]["kind"] in ("word", "quoted"):
+            database, name_index = _name(tokens[i]), i + 2
+            self.consumed.add(i)
+        self.consumed.add(name_index)
+        table = _name(tokens[name_index]).lower()
+        self.tables.append((name_index, database, _name(tokens[name_index])))
+        if table in self.ctes or database is not None:
+            self.derived = True
+        self.aliases.setdefault(table, table)
+        after = self._alias(name_index + 1, table)
+        # INSERT INTO t (a, b): the column list names columns of t
+        if statement in ("insert", "replace") and after < len(tokens) and tokens[after]["text"] == "(":
+            end = _matching_paren(tokens, after)
+            for j in range(after + 1, end):
+                if _is_identifier(tokens[j]):
+                    self.insert_columns.append((j, table))
+                    self.consumed.add(j)
+
+    def _alias(self, i, table):
+        tokens = self.tokens
+        if i < len(tokens) and _word(tokens[i]) == "as":
+            i += 1
+        if i < len(tokens) and _is_identifier(tokens[i]):
+            self.aliases[_name(tokens[i]).lower()] = table
+            self.consumed.add(i)
+            return i + 1
+        return i
+
+
+def _split_tokens(tokens):
+    statements = [[]]
+    for token in tokens:
+        if token["text"] == ";":
+            statements.append([])
+        else:
+            statements[-1].append(token)
+    return [statement for statement in statements if statement]
+
+
+def split_statements(query):
+    """Split a script into its statements, without their semicolons.
+
+    Returns a list of dicts with the statement's ``text`` and its ``tokens``
+    (kind, text, and start/end offsets into ``query``); raises ValueError on
+    input that can't be scanned as MySQL.
+    """
+    return [
+        {"text": query[statement[0]["start"]:statement[-1]["end"]], "tokens": statement}
+        for statement in _split_tokens(_tokenize(query))
+    ]
+
+
+def statement_kind(query):
+    """The kind of statement ``query`` (its first statement) runs, as a lowercase keyword.
+
+    Usually the first word; for ``WITH ...`` the statement the common table
+    expressions lead to, and ``(SELECT ...)`` is a "select". Returns None if
+    the query can't be scanned or has no statement.
+    """
+    try:
+        tokens = _tokenize(query)
+    except ValueError:
+        return None
+    depth = 0
+    with_clause = False
+    for token in tokens:
+        if token["text"] == ";":
+            break
+        if token["text"] in ("(", ")"):
+            depth += 1 if token["text"] == "(" else -1
+            continue
+        word = _word(token)
+        if not with_clause:
+            if word != "with":
+                return word
+            with_clause = True
+        elif depth == 0 and word in ("select", "table", "values", "insert", "replace", "update", "delete"):
+            return word
+    return None
+
+
+def validate_query(query, catalog):
+    """Check a generated statement offline against the schema catalog.
+
+    The statement is tokenized as MySQL and every table and column it names
+    is resolved against the catalog. Near-miss identifiers (within
+    FUZZY_CUTOFF similarity and unambiguous) are corrected in place. A
+    script of several statements is accepted if they are all data changes
+    (SCRIPT_STATEMENTS), each checked on its own. Returns a dict with
+    ``valid``, the possibly corrected ``query``, ``corrections`` (dicts with
+    kind, from, to) and ``errors``.
+    """
+    report = {"valid": True, "query": query, "corrections": [], "errors": []}
+
+    def reject(message):
+        report["valid"] = False
+        report["errors"].append(message)
+
+    if not query or not query.strip():
+        reject("empty statement")
+        return report
+    try:
+        tokens = _tokenize(query)
+    except ValueError as err:
+        reject(str(err))
+        return report
+
+    statements = _split_tokens(tokens)
+    if not statements:
+        reject("empty statement")
+        return report
+    if len(statements) > 1 and any(_word(statement[0]) not in SCRIPT_STATEMENTS for statement in statements):
+        reject("more than one statement (only INSERT, REPLACE, UPDATE and DELETE statements can be combined)")
+        return report
+    replacements = []
+    for statement in statements:
+        _check_statement(statement, catalog, report, replacements)
+
+    if replacements:
+        corrected = query
+        for start, end, text in sorted(replacements, reverse=True):
+            corrected = corrected[:start] + text + corrected[end:]
+        report["query"] = corrected
+    return report
+
+
+def _check_statement(tokens, catalog, report, replacements):
+    """Check one statement's tokens, adding errors to ``report`` and fixes to ``replacements``."""
+
+    def reject(message):
+        report["valid"] = False
+        report["errors"].append(message)
+
+    depth = 0
+    for token in tokens:
+        depth += {"(": 1, ")": -1}.get(token["text"], 0)
+        if depth < 0:
+            break
+    if depth != 0:
+        reject("unbalanced parentheses")
+        return
+    statement = _word(tokens[0]) or (tokens[0]["text"] == "(" and "select")
+    if statement == "use":
+        # The pool tracks each connection's database; a USE would switch it behind the pool's back
+        reject("USE statements are not allowed; the database is chosen in the app")
+        return
+    if statement not in _STATEMENTS:
+        reject(f"not a SQL statement: starts with {tokens[0]['text']!r}")
+        return
+    if statement not in _CHECKED_STATEMENTS or not catalog or not catalog.get("tables"):
+        return
+
+    index = _validation_index(catalog)
+    parsed = _Statement(tokens)
+
+    def correct(token, kind, canonical):
+        replacements.append((token["start"], token["end"], _quote_like(token, canonical)))
+        report["corrections"].append({"kind": kind, "from": _name(token), "to": canonical})
+
+    # Tables
+    sources = {}
+    for token_index, database, name in parsed.tables:
+        lowered = name.lower()
+        if database is not None and database.lower() != str(catalog.get("database", "")).lower():
+            continue
+        if lowered in parsed.ctes:
+            continue
+        canonical = index["tables"].get(lowered) or closest_match(name, index["tables"])
+        if canonical is None:
+            reject(f"unknown table {name!r}")
+            continue
+        if canonical.lower() != lowered:
+            correct(tokens[token_index], "table", canonical)
+        sources[lowered] = canonical.lower()
+    aliases = {alias: sources.get(table, table) for alias, table in parsed.aliases.items()}
+    in_scope = {table for table in sources.values()}
+
+    def table_columns(table):
+        return index["columns"].get(table)
+
+    def resolve_column(token, table):
+        columns = table_columns(table)
+        name = _name(token)
+        if columns is None or name == "*" or name.lower() in columns:
+            return
+        canonical = closest_match(name, columns)
+        if canonical is None:
+            reject(f"unknown column {name!r} in table {index['tables'][table]!r}")
+        else:
+            correct(token, "column", canonical)
+
+    for token_index, table in parsed.insert_columns:
+        resolve_column(tokens[token_index], sources.get(table, table))
+
+    # Columns
+    all_columns = {}
+    for table in in_scope:
+        all_columns.update(table_columns(table) or {})
+    for i, token in enumerate(tokens):
+        if i in parsed.consumed or not _is_identifier(token):
+            continue
+        following = tokens[i + 1] if i + 1 < len(tokens) else None
+        previous = tokens[i - 1] if i > 0 else None
+        if following is not None and following["text"] == "(":
+            continue  # function call
+        if previous is not None and previous["text"] == ".":
+            continue  # handled with its qualifier
+        name = _name(token)
+        lowered = name.lower()
+        if following is not None and following["text"] == "." and i + 2 < len(tokens):
+            target = tokens[i + 2]
+            if lowered in aliases:
+                table = aliases[lowered]
+            elif lowered in index["tables"]:
+                table = lowered
+            elif lowered in parsed.ctes or lowered in parsed.defined or lowered == str(catalog.get("database", "")).lower():
+                continue
+            else:
+                guess = closest_match(name, {alias: alias for alias in aliases})
+                if guess is None:
+                    reject(f"unknown table or alias {name!r}")
+                    continue
+                correct(token, "alias", guess)
+                table = aliases[guess.lower()]
+            if table is not None and target["kind"] in ("word", "quoted"):
+                resolve_column(target, table)
+            continue
+        if lowered in all_columns or lowered in parsed.defined or lowered in aliases or lowered in parsed.ctes:
+            continue
+        if parsed.derived or not in_scope:
+            continue  # columns of subqueries and CTEs are not known here
+        canonical = closest_match(name, all_columns)
+        if canonical is None:
+            reject(f"unknown column {name!r}")
+        else:
+            correct(token, "column", canonical)
+
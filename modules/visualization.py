@@ -0,0 +1,333 @@
+import datetime
+import math
+import re
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+try:
+    from . import sql_connector as sql
+    from . import query_guard
+    from . import tracing
+except ImportError:
+    import sql_connector as sql
+    import query_guard
+    import tracing
+
+# Most points a chart sends to the browser, across all of its series
+CHART_POINT_BUDGET = 2000
+# Bars shown per chart; the remaining categories are summed into "Other"
+CHART_MAX_CATEGORIES = 30
+# Candidate time-bucket widths in seconds for aggregating time series in MySQL
+CHART_TIME_BUCKETS = (
+    1, 5, 15, 60, 5 * 60, 15 * 60, 3600, 6 * 3600, 86400, 7 * 86400, 30 * 86400, 91 * 86400, 365 * 86400,
+)
+# Aggregates offered for measures
+CHART_AGGREGATES = ("sum", "avg", "min", "max", "count")
+
+# Numeric columns with these names are identifiers, not measures (customerNumber, product_id, ...)
+_IDENTIFIER_NAME = re.compile(r"(^(id|ID)$|_(id|ID|no)$|[a-z](Id|ID)$|[Nn]umber$|[Cc]ode$)")
+_ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+
+def _quote(identifier):
+    return "`" + str(identifier).replace("`", "``") + "`"
+
+
+def _as_time(series):
+    """The column as datetime64, or None if it does not hold dates/times."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    if series.dtype != object and not pd.api.types.is_string_dtype(series):
+        return None
+    sample = series.dropna().head(50)
+    if sample.empty:
+        return None
+    if all(isinstance(value, (datetime.date, datetime.datetime)) for value in sample):
+        return pd.to_datetime(series, errors="coerce")
+    if all(isinstance(value, str) and _ISO_DATE.match(value) for value in sample):
+        return pd.to_datetime(series, errors="coerce", format="ISO8601")
+    return None
+
+
+def _as_number(series):
+    """The column as floats, or None if it is not numeric (DECIMAL values arrive as Decimal objects)."""
+    if pd.api.types.is_bool_dtype(series):
+        return None
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    if series.dtype == object:
+        sample = series.dropna().head(50)
+        if not sample.empty and all(isinstance(value, (Decimal, int, float)) for value in sample):
+            return pd.to_numeric(series, errors="coerce").astype(float)
+    return None
+
+
+def column_roles(df):
+    """Split a result's columns into time, measure and category columns."""
+    roles = {"time": [], "measure": [], "category": []}
+    for column in df.columns:
+        series = df[column]
+        if _as_time(series) is not None:
+            roles["time"].append(column)
+        elif _as_number(series) is not None and not _IDENTIFIER_NAME.search(str(column)):
+            roles["measure"].append(column)
+        else:
+            roles["category"].append(column)
+    return roles
+
+
+def suggest_charts(df):
+    """Suggest charts for a result: time series, category bars and scatter plots.
+
+    Each suggestion is a dict with ``kind`` ("line", "bar" or "scatter"),
+    ``x``, ``y`` (a list of measure columns; empty means a row count),
+    ``agg`` and a ``title``. The most specific suggestions come first.
+    """
+    if df is None or df.empty or len(df.columns) < 1:
+        return []
+    roles = column_roles(df)
+    measures = roles["measure"][:3]
+    suggestions = []
+    for time_column in roles["time"][:1]:
+        suggestions.append({
+            "kind": "line",
+            "x": time_column,
+            "y": measures,
+            "agg": "sum" if measures else "count",
+            "title": f"{', '.join(map(str, measures)) or 'rows'} over {time_column}",
+        })
+    # Descriptive, low-cardinality columns (status, country) make better bars than identifiers
+    categories = sorted(
+        roles["category"],
+        key=lambda column: (bool(_IDENTIFIER_NAME.search(str(column))), df[column].nunique(dropna=False)),
+    )
+    for category in categories[:2]:
+        measure = measures[:1]
+        suggestions.append({
+            "kind": "bar",
+            "x": category,
+            "y": measure,
+            "agg": "sum" if measure else "count",
+            "title": f"{measure[0] if measure else 'rows'} by {category}",
+        })
+    if len(roles["measure"]) >= 2:
+        x, y = roles["measure"][:2]
+        suggestions.append({"kind": "scatter", "x": x, "y": [y], "agg": None, "title": f"{y} vs {x}"})
+    return suggestions
+
+
+def lttb(x, y, n_out):
+    """Indices of ``n_out`` points that keep the visual shape of a series (Largest-Triangle-Three-Buckets).
+
+    ``x`` must be sorted. Bucket averages are computed for all buckets at
+    once; only the choice of one point per bucket, which depends on the
+    previous choice, loops in Python over the ``n_out`` buckets.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # n_out - 2 buckets between the first and last point, which are always kept
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    mean_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    # Each bucket is judged against the average of the bucket after it (the last point for the final one)
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        area = np.abs(
+            (x[previous] - next_x[bucket]) * (y[lo:hi] - y[previous])
+            - (x[previous] - x[lo:hi]) * (next_y[bucket] - y[previous])
+        )
+        previous = lo + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def _aggregate(frame, by, measures, agg):
+    if not measures:
+        return frame.groupby(by, dropna=False).size().rename("count").reset_index()
+    return frame.groupby(by, dropna=False)[measures].agg("mean" if agg == "avg" else agg).reset_index()
+
+
+def _top_categories(data, x, value_columns, max_categories):
+    """Keep the largest categories and sum the rest into "Other"."""
+    data = data.sort_values(value_columns[0], ascending=False)
+    if len(data) <= max_categories:
+        return data
+    top = data.head(max_categories - 1)
+    other = data.iloc[max_categories - 1:][value_columns].sum().to_frame().T
+    other.insert(0, x, "Other")
+    return pd.concat([top, other], ignore_index=True)
+
+
+def _long_series(data, x, value_columns):
+    """Reshape to one row per (x, series) for plotting several measures on one chart."""
+    return data.melt(id_vars=[x], value_vars=value_columns, var_name="series", value_name="value")
+
+
+def prepare_chart(chart, df, point_budget=None, max_categories=None):
+    """Reduce a complete result to at most ``point_budget`` points for a suggested chart.
+
+    Time series are aggregated per distinct timestamp, then downsampled with
+    LTTB per series. Bars keep the largest ``max_categories`` categories.
+    Scatter plots take an evenly spread sample. Returns a DataFrame with the
+    columns ``x`` plus ``series`` and ``value`` (line), ``value`` (bar) or the
+    y column (scatter).
+    """
+    point_budget = point_budget or CHART_POINT_BUDGET
+    max_categories = max_categories or CHART_MAX_CATEGORIES
+    x = chart["x"]
+    measures = list(chart["y"])
+    frame = pd.DataFrame({x: df[x]})
+    for measure in measures:
+        frame[measure] = _as_number(df[measure])
+
+    with tracing.span("chart.prepare", kind=chart["kind"], rows=len(df)) as span:
+        if chart["kind"] == "line":
+            frame[x] = _as_time(df[x])
+            frame = frame.dropna(subset=[x])
+            data = _aggregate(frame, x, measures, chart["agg"]).sort_values(x)
+            value_columns = measures or ["count"]
+            per_series = max(point_budget // len(value_columns), 3)
+            parts = []
+            for column in value_columns:
+                series = data[[x, column]].dropna()
+                keep = lttb(series[x].to_numpy(dtype="datetime64[ns]").astype(np.int64), series[column], per_series)
+                parts.append(_long_series(series.iloc[keep], x, [column]))
+            data = pd.concat(parts, ignore_index=True)
+        elif chart["kind"] == "bar":
+            data = _aggregate(frame, x, measures, chart["agg"])
+            value_column = measures[0] if measures else "count"
+            data = _top_categories(data, x, [value_column], min(max_categories, point_budget))
+            data = data.rename(columns={value_column: "value"})
+            data[x] = data[x].astype(str)
+        else:
+            data = frame.dropna()
+            if len(data) > point_budget:
+                data = data.iloc[np.linspace(0, len(data) - 1, point_budget).astype(np.int64)]
+        span.set(points=len(data))
+    return data.reset_index(drop=True)
+
+
+def _empty_chart_data(chart):
+    if chart["kind"] == "line":
+        return pd.DataFrame(columns=[chart["x"], "series", "value"])
+    if chart["kind"] == "bar":
+        return pd.DataFrame(columns=[chart["x"], "value"])
+    return pd.DataFrame(columns=[chart["x"], chart["y"][0]])
+
+
+def _bucket_seconds(span_seconds, buckets):
+    needed = span_seconds / max(buckets, 1)
+    for width in CHART_TIME_BUCKETS:
+        if width >= needed:
+            return width
+    return int(math.ceil(needed / CHART_TIME_BUCKETS[-1])) * CHART_TIME_BUCKETS[-1]
+
+
+def _aggregate_sql(agg, column):
+    if agg == "count" or column is None:
+        return "COUNT(*)"
+    return f"{agg.upper()}({_quote(column)})"
+
+
+def pushdown_query(chart, query, point_budget=None, max_categories=None, x_range=None):
+    """The aggregate query MySQL runs instead of sending the full result for a chart.
+
+    Line and scatter charts need ``x_range`` (min, max and non-NULL count of
+    the x column, from ``range_query``): line charts to pick a time-bucket
+    width that stays within the budget, scatter plots to pick a sample rate.
+    """
+    point_budget = point_budget or CHART_POINT_BUDGET
+    max_categories = max_categories or CHART_MAX_CATEGORIES
+    source = f"({query.strip().rstrip(';')}) AS chart_source"
+    x = _quote(chart["x"])
+    measures = list(chart["y"])
+    if chart["kind"] == "bar":
+        value = _aggregate_sql(chart["agg"], measures[0] if measures else None)
+        return (
+            f"SELECT {x} AS {x}, {value} AS value FROM {source} "
+            f"GROUP BY {x} ORDER BY value DESC LIMIT {min(max_categories, point_budget)}"
+        )
+    if chart["kind"] == "line":
+        low, high, _ = x_range
+        per_series = max(point_budget // max(len(measures), 1), 1)
+        span_seconds = max((pd.Timestamp(high) - pd.Timestamp(low)).total_seconds(), 1)
+        width = _bucket_seconds(span_seconds, per_series)
+        values = ", ".join(
+            f"{_aggregate_sql(chart['agg'], measure)} AS {_quote(measure)}" for measure in measures
+        ) or "COUNT(*) AS `count`"
+        return (
+            f"SELECT FROM_UNIXTIME(FLOOR(UNIX_TIMESTAMP({x}) / {width}) * {width}) AS {x}, {values} "
+            f"FROM {source} WHERE {x} IS NOT NULL GROUP BY 1 ORDER BY 1"
+        )
+    y = _quote(measures[0])
+    _, _, rows = x_range
+    fraction = min(1.0, point_budget * 1.2 / max(rows, 1))
+    return (
+        f"SELECT {x} AS {x}, {y} AS {y} FROM {source} "
+        f"WHERE {x} IS NOT NULL AND {y} IS NOT NULL AND RAND() < {fraction:.6f} LIMIT {point_budget}"
+    )
+
+
+def range_query(chart, query):
+    """Query for the min, max and non-NULL row count of a chart's x column over the full result."""
+    x = _quote(chart["x"])
+    return (
+        f"SELECT MIN({x}) AS low, MAX({x}) AS high, COUNT({x}) AS row_count "
+        f"FROM ({query.strip().rstrip(';')}) AS chart_source"
+    )
+
+
+def pushdown_chart(pool, database, query, chart, point_budget=None, max_categories=None):
+    """Aggregate a chart's data in MySQL over the full result of ``query``.
+
+    Used when only part of the result was fetched. Returns data shaped like
+    ``prepare_chart``'s (bars show the largest categories without an "Other"
+    total), or None if MySQL rejected the rewritten query.
+    """
+    point_budget = point_budget or CHART_POINT_BUDGET
+    max_categories = max_categories or CHART_MAX_CATEGORIES
+    x = chart["x"]
+    with tracing.span("chart.pushdown", kind=chart["kind"]) as span, pool.connection(database, read=True) as connection:
+        x_range = None
+        if chart["kind"] in ("line", "scatter"):
+            rows = sql.execute_query(connection, query_guard.add_execution_time_hint(range_query(chart, query)))
+            if not rows:
+                return None
+            x_range = (rows[0]["low"], rows[0]["high"], int(rows[0]["row_count"] or 0))
+            if x_range[2] == 0:
+                return _empty_chart_data(chart)
+        aggregate_query = pushdown_query(chart, query, point_budget, max_categories, x_range)
+        rows = sql.execute_query(connection, query_guard.add_execution_time_hint(aggregate_query))
+        if rows is None:
+            return None
+        span.set(points=len(rows))
+    if not rows:
+        return _empty_chart_data(chart)
+    data = pd.DataFrame(rows)
+
+    if chart["kind"] == "bar":
+        data["value"] = pd.to_numeric(data["value"], errors="coerce")
+        data[x] = data[x].astype(str)
+    elif chart["kind"] == "line":
+        data[x] = pd.to_datetime(data[x], errors="coerce")
+        value_columns = list(chart["y"]) or ["count"]
+        for column in value_columns:
+            data[column] = pd.to_numeric(data[column], errors="coerce")
+        data = _long_series(data, x, value_columns)
+    else:
+        for column in data.columns:
+            data[column] = pd.to_numeric(data[column], errors="coerce")
+    return data.reset_index(drop=True)
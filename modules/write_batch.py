@@ -0,0 +1,274 @@
+import decimal
+import re
+
+try:
+    from . import validation
+except ImportError:
+    import validation
+
+# Most single-row statements folded into one batched statement
+WRITE_BATCH_ROWS = 1000
+# Longest batched statement in characters, well under MySQL's smallest default max_allowed_packet
+WRITE_BATCH_MAX_CHARS = 1_000_000
+
+_INSERT_MODIFIERS = {"ignore", "low_priority", "delayed", "high_priority"}
+_NUMBER = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)(?:e[+-]?\d+)?", re.IGNORECASE)
+
+
+def _text(query, tokens, start, end):
+    """Source text of ``tokens[start:end]``, comments and spacing included."""
+    return query[tokens[start]["start"]:tokens[end - 1]["end"]]
+
+
+def _word_at(tokens, i):
+    if i < len(tokens) and tokens[i]["kind"] == "word":
+        return tokens[i]["text"].lower()
+    return None
+
+
+def _identifier(tokens, i):
+    if i >= len(tokens):
+        return False
+    token = tokens[i]
+    return token["kind"] == "quoted" or (token["kind"] == "word" and token["text"].lower() not in validation.KEYWORDS)
+
+
+def _table(tokens, i):
+    """End index of a ``table`` or ``database.table`` name starting at ``tokens[i]``, or None."""
+    if not _identifier(tokens, i):
+        return None
+    if i + 2 < len(tokens) and tokens[i + 1]["text"] == "." and _identifier(tokens, i + 2):
+        return i + 3
+    return i + 1
+
+
+def _literal(tokens, i):
+    """End index of the constant starting at ``tokens[i]``, or None if there isn't one."""
+    if i < len(tokens) and tokens[i]["text"] in ("-", "+"):
+        return i + 2 if i + 1 < len(tokens) and tokens[i + 1]["kind"] == "number" else None
+    if i < len(tokens) and (tokens[i]["kind"] in ("number", "string") or _word_at(tokens, i) in ("null", "true", "false")):
+        return i + 1
+    return None
+
+
+def _key(tokens, start, end):
+    return tuple(token["text"].lower() for token in tokens[start:end])
+
+
+def _parse_insert(query, tokens):
+    """``INSERT|REPLACE [modifiers] [INTO] table [(columns)] VALUES (...)[, (...)]``."""
+    i = 1
+    while _word_at(tokens, i) in _INSERT_MODIFIERS:
+        i += 1
+    if _word_at(tokens, i) == "into":
+        i += 1
+    i = _table(tokens, i)
+    if i is None:
+        return None
+    if i < len(tokens) and tokens[i]["text"] == "(":
+        i += 1
+        while _identifier(tokens, i) and i + 1 < len(tokens) and tokens[i + 1]["text"] in (",", ")"):
+            i += 2
+            if tokens[i - 1]["text"] == ")":
+                break
+        else:
+            return None
+    if _word_at(tokens, i) not in ("values", "value"):
+        return None
+    values_index = i
+    rows = []
+    i += 1
+    while i < len(tokens) and tokens[i]["text"] == "(":
+        start, depth = i, 0
+        while i < len(tokens):
+            depth += {"(": 1, ")": -1}.get(tokens[i]["text"], 0)
+            if _word_at(tokens, i) == "select":
+                return None  # subqueries may read the rows inserted by the earlier statements
+            i += 1
+            if depth == 0:
+                break
+        if depth:
+            return None
+        rows.append(_text(query, tokens, start, i))
+        if i < len(tokens) and tokens[i]["text"] == ",":
+            i += 1
+        elif i < len(tokens):
+            return None  # ON DUPLICATE KEY UPDATE and the like run as written
+    if not rows or i < len(tokens):
+        return None
+    return {
+        "kind": "insert",
+        "group": ("insert",) + _key(tokens, 0, values_index),
+        "prefix": _text(query, tokens, 0, values_index),
+        "rows": rows,
+    }
+
+
+def _parse_key_condition(query, tokens, i):
+    """``WHERE column = constant`` ending the statement: (column text, column key, value text)."""
+    if _word_at(tokens, i) != "where" or not _identifier(tokens, i + 1):
+        return None
+    if i + 2 >= len(tokens) or tokens[i + 2]["text"] != "=":
+        return None
+    end = _literal(tokens, i + 3)
+    if end != len(tokens) or _word_at(tokens, i + 3) in ("null", "true", "false"):
+        return None
+    return tokens[i + 1]["text"], _key(tokens, i + 1, i + 2), _text(query, tokens, i + 3, end)
+
+
+def _parse_update(query, tokens):
+    """``UPDATE table SET column = constant[, ...] WHERE key = constant``."""
+    i = _table(tokens, 1)
+    if i is None or _word_at(tokens, i) != "set":
+        return None
+    table = _text(query, tokens, 1, i)
+    table_key = _key(tokens, 1, i)
+    columns, values = [], []
+    i += 1
+    while True:
+        if not _identifier(tokens, i) or i + 1 >= len(tokens) or tokens[i + 1]["text"] != "=":
+            return None
+        end = _literal(tokens, i + 2)
+        if end is None:
+            return None
+        columns.append(tokens[i]["text"])
+        values.append(_text(query, tokens, i + 2, end))
+        i = end
+        if i < len(tokens) and tokens[i]["text"] == ",":
+            i += 1
+        else:
+            break
+    condition = _parse_key_condition(query, tokens, i)
+    if condition is None:
+        return None
+    key_column, key_column_key, key_value = condition
+    column_keys = tuple(column.lower() for column in columns)
+    if key_column_key[0] in column_keys or len(set(column_keys)) != len(column_keys):
+        return None
+    return {
+        "kind": "update",
+        "group": ("update",) + table_key + ("set",) + column_keys + ("where",) + key_column_key,
+        "table": table,
+        "columns": columns,
+        "values": values,
+        "key_column": key_column,
+        "key_value": key_value,
+    }
+
+
+def _parse_delete(query, tokens):
+    """``DELETE FROM table WHERE key = constant``."""
+    if _word_at(tokens, 1) != "from":
+        return None
+    i = _table(tokens, 2)
+    if i is None:
+        return None
+    condition = _parse_key_condition(query, tokens, i)
+    if condition is None:
+        return None
+    key_column, key_column_key, key_value = condition
+    return {
+        "kind": "delete",
+        "group": ("delete",) + _key(tokens, 2, i) + ("where",) + key_column_key,
+        "table": _text(query, tokens, 2, i),
+        "key_column": key_column,
+        "key_value": key_value,
+    }
+
+
+_PARSERS = {"insert": _parse_insert, "replace": _parse_insert, "update": _parse_update, "delete": _parse_delete}
+
+
+def _parse(query, tokens):
+    if any(token["kind"] == "hint" for token in tokens):
+        return None
+    parser = _PARSERS.get(_word_at(tokens, 0))
+    return parser(query, tokens) if parser is not None else None
+
+
+def _key_value(text):
+    """Comparable form of a key constant.
+
+    Numbers, quoted or not, compare by value, as MySQL compares them with a
+    numeric column ('1', 1 and 1.0 name the same row); other strings compare
+    case-insensitively, as most collations do.
+    """
+    quoted = text[0] in "'\""
+    value = text[1:-1] if quoted else "".join(text.split())
+    if _NUMBER.fullmatch(value.strip()):
+        return decimal.Decimal(value.strip())
+    return value.lower().rstrip() if quoted else text
+
+
+def _batched_sql(batch):
+    first = batch[0]
+    if first["kind"] == "insert":
+        return f"{first['prefix']} VALUES {', '.join(row for spec in batch for row in spec['rows'])}"
+    key_column = first["key_column"]
+    keys = ", ".join(spec["key_value"] for spec in batch)
+    if first["kind"] == "delete":
+        return f"DELETE FROM {first['table']} WHERE {key_column} IN ({keys})"
+    assignments = ", ".join(
+        f"{column} = CASE {key_column} "
+        + " ".join(f"WHEN {spec['key_value']} THEN {spec['values'][position]}" for spec in batch)
+        + " END"
+        for position, column in enumerate(first["columns"])
+    )
+    return f"UPDATE {first['table']} SET {assignments} WHERE {key_column} IN ({keys})"
+
+
+def plan_script(query):
+    """Split a write script into the statements to run, folding repetitive ones into batches.
+
+    Runs of single-row INSERT/REPLACE statements into the same table and
+    columns become one multi-row VALUES statement; runs of UPDATEs setting
+    the same columns to constants by a ``key = constant`` condition become one
+    UPDATE with CASE expressions and ``key IN (...)``; runs of DELETEs by key
+    become one DELETE with ``key IN (...)``. A batch is capped at
+    WRITE_BATCH_ROWS statements and WRITE_BATCH_MAX_CHARS characters.
+    Statements that don't fit a pattern run as written, in order. Returns a
+    list of dicts with ``sql``, the number of ``statements`` it stands for and
+    whether it was ``batched``.
+    """
+    try:
+        statements = validation.split_statements(query)
+    except ValueError:
+        return [{"sql": query, "statements": 1, "batched": False}]
+
+    steps = []
+    batch, batch_rows, batch_chars, batch_keys = [], 0, 0, set()
+
+    def flush():
+        nonlocal batch, batch_rows, batch_chars, batch_keys
+        if len(batch) == 1:
+            steps.append({"sql": batch[0]["text"], "statements": 1, "batched": False})
+        elif batch:
+            steps.append({"sql": _batched_sql(batch), "statements": len(batch), "batched": True})
+        batch, batch_rows, batch_chars, batch_keys = [], 0, 0, set()
+
+    for statement in statements:
+        spec = _parse(query, statement["tokens"])
+        if spec is None:
+            flush()
+            steps.append({"sql": statement["text"], "statements": 1, "batched": False})
+            continue
+        spec["text"] = statement["text"]
+        rows = len(spec.get("rows", ())) or 1
+        key = _key_value(spec["key_value"]) if spec["kind"] == "update" else None
+        fits = (
+            batch
+            and batch[0]["group"] == spec["group"]
+            and batch_rows + rows <= WRITE_BATCH_ROWS
+            and batch_chars + len(spec["text"]) <= WRITE_BATCH_MAX_CHARS
+            # Two updates of the same row must stay in order; a CASE would apply only the first
+            and key not in batch_keys
+        )
+        if not fits:
+            flush()
+        batch.append(spec)
+        batch_rows += rows
+        batch_chars += len(spec["text"])
+        if key is not None:
+            batch_keys.add(key)
+    flush()
+    return steps
@@ -0,0 +1,72 @@
+import datetime
+
+import pytest
+
+import mysql_query_generator as query_gen
+import query_cache
+import sql_connector as sql
+from standins import StandInMySQLServer
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = StandInMySQLServer(str(tmp_path / "mysql"))
+    server.add_classicmodels()
+    return server
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = query_cache.QueryCache(path=str(tmp_path / "query_cache.sqlite3"))
+    monkeypatch.setattr(query_cache, "_cache", cache)
+    return cache
+
+
+def cached_sql(server, question):
+    connection = server.connect("localhost", "user", "", "classicmodels")
+    try:
+        catalog = sql.get_schema_catalog(connection, max_age=0)
+    finally:
+        connection.close()
+    return query_cache.get_cache().get(query_gen._cache_key(question, catalog)), catalog
+
+
+def test_data_writes_keep_cached_sql(server, cache):
+    question = "How many customers are there?"
+    _, catalog = cached_sql(server, question)
+    query_gen.remember_query(question, "SELECT COUNT(*) FROM customers;", catalog)
+
+    connection = server.connect("localhost", "user", "", "classicmodels")
+    sql.execute_query(connection, "UPDATE customers SET creditLimit = 0 WHERE customerNumber = 103", use_cache=False)
+    connection.close()
+    assert server.databases["classicmodels"]["update_time"]["customers"] is not None
+
+    cached, after = cached_sql(server, question)
+    assert after["fingerprint"] == catalog["fingerprint"]
+    assert cached == "SELECT COUNT(*) FROM customers;"
+    # Survives a restart too: the disk entry was not wiped
+    assert query_cache.QueryCache(path=cache.path).get(query_gen._cache_key(question, after)) == cached
+
+
+def test_column_changes_invalidate_cached_sql(server, cache):
+    question = "How many customers are there?"
+    _, catalog = cached_sql(server, question)
+    query_gen.remember_query(question, "SELECT COUNT(*) FROM customers;", catalog)
+
+    schema = server.databases["classicmodels"]
+    schema["tables"] = {**schema["tables"], "customers": schema["tables"]["customers"] + [("loyalty", "int", "")]}
+
+    cached, after = cached_sql(server, question)
+    assert after["fingerprint"] != catalog["fingerprint"]
+    assert cached is None
+
+
+def test_rebuilt_tables_invalidate_cached_sql(server, cache):
+    question = "How many customers are there?"
+    _, catalog = cached_sql(server, question)
+    query_gen.remember_query(question, "SELECT COUNT(*) FROM customers;", catalog)
+
+    server.databases["classicmodels"]["create_time"]["customers"] = datetime.datetime(2025, 1, 1)
+
+    cached, _ = cached_sql(server, question)
+    assert cached is None
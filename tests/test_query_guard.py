@@ -0,0 +1,49 @@
+import pytest
+
+from query_guard import add_execution_time_hint, apply_row_limit, is_guardable
+
+
+@pytest.mark.parametrize("query, guardable", [
+    ("SELECT 1", True),
+    ("/* note */ select id FROM t", True),
+    ("WITH t AS (SELECT id FROM a) SELECT * FROM t", True),
+    ("(SELECT id FROM a) UNION (SELECT id FROM b)", True),
+    ("UPDATE a SET x = 1", False),
+    ("WITH t AS (SELECT id FROM a) DELETE a FROM a JOIN t USING (id)", False),
+    ("SHOW TABLES", False),
+])
+def test_is_guardable(query, guardable):
+    assert is_guardable(query) is guardable
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT id FROM t", "SELECT /*+ MAX_EXECUTION_TIME(500) */ id FROM t"),
+    ("SELECT /*+ NO_ICP(t) */ id FROM t", "SELECT /*+ MAX_EXECUTION_TIME(500) NO_ICP(t) */ id FROM t"),
+    # The hint belongs to the outer query block, not to a CTE
+    ("WITH t AS (SELECT id FROM a) SELECT * FROM t",
+     "WITH t AS (SELECT id FROM a) SELECT /*+ MAX_EXECUTION_TIME(500) */ * FROM t"),
+    # and to the first SELECT of a parenthesized union
+    ("(SELECT id FROM a) UNION (SELECT id FROM b)",
+     "(SELECT /*+ MAX_EXECUTION_TIME(500) */ id FROM a) UNION (SELECT id FROM b)"),
+    ("SELECT /*+ MAX_EXECUTION_TIME(10) */ id FROM t", "SELECT /*+ MAX_EXECUTION_TIME(10) */ id FROM t"),
+])
+def test_add_execution_time_hint(query, expected):
+    assert add_execution_time_hint(query, 500) == expected
+
+
+@pytest.mark.parametrize("query, expected, applied", [
+    ("SELECT id FROM t;", "SELECT id FROM t LIMIT 100;", "added"),
+    ("SELECT id FROM t LIMIT 5000", "SELECT id FROM t LIMIT 100", "tightened"),
+    ("SELECT id FROM t LIMIT 10", "SELECT id FROM t LIMIT 10", None),
+    ("SELECT id FROM t FOR UPDATE", "SELECT id FROM t LIMIT 100 FOR UPDATE", "added"),
+    # A LIMIT inside a CTE or a parenthesized query doesn't bound the result
+    ("WITH t AS (SELECT id FROM a LIMIT 5) SELECT * FROM t",
+     "WITH t AS (SELECT id FROM a LIMIT 5) SELECT * FROM t LIMIT 100", "added"),
+    ("WITH t AS (SELECT id FROM a) SELECT * FROM t LIMIT 5000",
+     "WITH t AS (SELECT id FROM a) SELECT * FROM t LIMIT 100", "tightened"),
+    ("(SELECT id FROM a) UNION (SELECT id FROM b)",
+     "(SELECT id FROM a) UNION (SELECT id FROM b) LIMIT 100", "added"),
+    ("(SELECT id FROM a LIMIT 5000)", "(SELECT id FROM a LIMIT 5000) LIMIT 100", "added"),
+])
+def test_apply_row_limit(query, expected, applied):
+    assert apply_row_limit(query, 100) == (expected, applied)
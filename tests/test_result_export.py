@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+import result_export
+import sql_connector as sql
+from standins import StandInMySQLServer
+
+
+@pytest.fixture
+def pool(tmp_path):
+    server = StandInMySQLServer(str(tmp_path / "server"))
+    server.add_classicmodels()
+    return sql.ConnectionPool("standin", "user", "", max_size=1, wait_timeout=0.1, connection_factory=server.connect)
+
+
+def test_export_writes_the_full_result(pool, tmp_path):
+    export = result_export.export_query(
+        pool, "classicmodels", "SELECT * FROM customers", chunk_size=7, directory=str(tmp_path / "exports")
+    )
+    assert export is not None and export["rows"] > 7
+    assert os.path.getsize(export["path"]) == export["bytes"]
+
+
+def test_export_failure_returns_none_and_leaves_no_file(pool, tmp_path):
+    directory = tmp_path / "exports"
+    # The only connection is taken, so the export times out waiting for one
+    with pool.connection("classicmodels"):
+        export = result_export.export_query(pool, "classicmodels", "SELECT * FROM customers", directory=str(directory))
+    assert export is None
+    assert list(directory.iterdir()) == []
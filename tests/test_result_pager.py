@@ -0,0 +1,37 @@
+import time
+
+import pytest
+
+import sql_connector as sql
+from standins import StandInMySQLServer
+
+
+@pytest.fixture
+def pool(tmp_path):
+    server = StandInMySQLServer(str(tmp_path))
+    server.add_classicmodels()
+    pool = sql.ConnectionPool("standin", "user", "", max_size=4, wait_timeout=1, connection_factory=server.connect)
+    yield pool
+    for pager in list(sql._open_pagers):
+        pager.close()
+
+
+def test_open_pagers_leave_half_the_pool_free(pool):
+    pagers = [sql.open_result_pager(pool, "classicmodels", "SELECT * FROM customers", page_size=10) for _ in range(4)]
+    assert [pager.closed for pager in pagers] == [True, True, False, False]
+    # The other half is still free for queries
+    with pool.connection("classicmodels") as first, pool.connection("classicmodels") as second:
+        assert first is not second
+
+
+def test_idle_pagers_are_closed_in_the_background(pool, monkeypatch):
+    monkeypatch.setattr(sql, "RESULT_PAGER_IDLE_TIMEOUT", 0.05)
+    monkeypatch.setattr(sql, "_pager_reaper", None)
+    monkeypatch.setattr(sql, "RESULT_PAGER_REAP_INTERVAL", 0.05)
+    pager = sql.open_result_pager(pool, "classicmodels", "SELECT * FROM customers", page_size=10)
+    assert len(pager.fetch_page()) == 10
+    deadline = time.monotonic() + 5
+    while not pager.closed and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert pager.closed
+    assert pool.stats()["in_use"] == 0
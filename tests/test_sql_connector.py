@@ -0,0 +1,90 @@
+import pytest
+
+import sql_connector as sql
+from standins import StandInMySQLServer
+
+
+@pytest.fixture
+def connection(tmp_path):
+    server = StandInMySQLServer(str(tmp_path))
+    server.add_classicmodels()
+    connection = server.connect("localhost", "user", "password", "classicmodels")
+    yield connection
+    connection.close()
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT 1",
+    "  select * from customers",
+    "WITH big AS (SELECT * FROM customers WHERE creditLimit > 0) SELECT COUNT(*) FROM big",
+    "WITH RECURSIVE n (i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 3) SELECT * FROM n",
+    "(SELECT customerNumber FROM customers) UNION (SELECT customerNumber FROM payments)",
+    "/* report */ SELECT 1",
+    "SHOW TABLES",
+    "DESCRIBE customers",
+    "EXPLAIN SELECT 1",
+])
+def test_reads(query):
+    assert sql.is_read_query(query)
+
+
+@pytest.mark.parametrize("query", [
+    "INSERT INTO offices (code) VALUES ('8')",
+    "UPDATE customers SET creditLimit = 0",
+    "DELETE FROM payments",
+    "WITH old AS (SELECT customerNumber FROM customers) DELETE FROM payments WHERE customerNumber IN (SELECT * FROM old)",
+    "INSERT INTO t SELECT * FROM customers",
+    "CREATE TABLE t (a INT)",
+])
+def test_writes(query):
+    assert not sql.is_read_query(query)
+
+
+def test_with_select_returns_rows(connection):
+    result = sql.execute_query(
+        connection, "WITH big AS (SELECT * FROM customers) SELECT COUNT(*) AS n FROM big", use_cache=False
+    )
+    assert result == [{"n": 122}]
+
+
+def test_execute_script_rejects_reads(connection):
+    assert sql.execute_script(connection, "WITH big AS (SELECT * FROM customers) SELECT * FROM big") is None
+    assert sql.execute_script(connection, "UPDATE customers SET creditLimit = 0; SELECT 1") is None
+
+
+def test_execute_script_runs_batched_writes_in_one_transaction(connection):
+    results = sql.execute_script(
+        connection,
+        "UPDATE customers SET creditLimit = 1 WHERE customerNumber = 103;"
+        "UPDATE customers SET creditLimit = 2 WHERE customerNumber = 112;",
+    )
+    assert results == [{
+        "sql": "UPDATE customers SET creditLimit = CASE customerNumber WHEN 103 THEN 1 WHEN 112 THEN 2 END "
+               "WHERE customerNumber IN (103, 112)",
+        "statements": 2,
+        "rows": 2,
+    }]
+
+
+def test_failed_script_rolls_back(connection):
+    results = sql.execute_script(
+        connection,
+        "UPDATE customers SET creditLimit = 1 WHERE customerNumber = 103;"
+        "INSERT INTO no_such_table (a) VALUES (1);",
+    )
+    assert results is None
+    rows = sql.execute_query(connection, "SELECT creditLimit FROM customers WHERE customerNumber = 103",
+                             use_cache=False)
+    assert rows[0]["creditLimit"] != 1
+
+
+def test_schema_metadata_bypasses_the_result_cache(connection, monkeypatch):
+    import result_cache
+
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_ENABLED", True)
+    before = sql.fetch_schema_fingerprint(connection)
+    schema = connection.server.databases["classicmodels"]
+    schema["tables"] = {**schema["tables"], "customers": schema["tables"]["customers"] + [("loyalty", "int", "")]}
+    assert sql.fetch_schema_fingerprint(connection) != before
+    catalog = sql.load_schema_catalog(connection)
+    assert "loyalty" in [column["Field"] for column in catalog["tables"]["customers"]]
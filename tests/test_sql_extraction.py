@@ -0,0 +1,32 @@
+import pytest
+
+from sql_extraction import SQLExtractor, extract_sql
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("```sql\nSELECT 1;\n```", "SELECT 1;"),
+    ("Here you go:\n```mysql\nSELECT `name` FROM t\n```\nThanks", "SELECT `name` FROM t"),
+    ("SELECT 1; SELECT 2;", "SELECT 1;"),
+    # One-line fences: the info string ends at the first whitespace, and may be the SQL itself
+    ("```sql SELECT 1;```", "SELECT 1;"),
+    ("```SELECT * FROM customers;```", "SELECT * FROM customers;"),
+    ("```(SELECT 1) UNION (SELECT 2)```", "(SELECT 1) UNION (SELECT 2)"),
+    ("```SELECT 1", "SELECT 1"),
+    ("```sql```", ""),
+])
+def test_extract_sql(text, expected):
+    assert extract_sql(text) == expected
+
+
+@pytest.mark.parametrize("text", ["```sql SELECT 1;```", "```SELECT 1;```"])
+def test_one_line_fence_streamed_char_by_char(text):
+    extractor = SQLExtractor()
+    for char in text:
+        extractor.feed(char)
+    assert extractor.finish() == "SELECT 1;"
+    assert extractor.complete
+
+
+def test_data_change_script_in_one_line_fence():
+    text = "```sql UPDATE t SET a = 1 WHERE b = 2; DELETE FROM t WHERE c = 1;``` done"
+    assert extract_sql(text) == "UPDATE t SET a = 1 WHERE b = 2; DELETE FROM t WHERE c = 1;"
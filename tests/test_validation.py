@@ -0,0 +1,75 @@
+import pytest
+
+from validation import validate_query
+
+CATALOG = {
+    "database": "shop",
+    "tables": {
+        "customers": [{"Field": "id"}, {"Field": "customer_name"}, {"Field": "city"}],
+        "orders": [{"Field": "id"}, {"Field": "customer_id"}, {"Field": "amount"}, {"Field": "created_at"}],
+    },
+}
+
+
+@pytest.mark.parametrize("query", [
+    # Character sets and collations are not columns
+    "SELECT CONVERT(customer_name USING utf8mb4) FROM customers",
+    "SELECT customer_name FROM customers ORDER BY customer_name COLLATE utf8mb4_general_ci",
+    "SELECT CAST(customer_name AS CHAR CHARACTER SET utf8mb4) FROM customers",
+    "SELECT id FROM customers WHERE customer_name = _utf8mb4'x' COLLATE utf8mb4_bin",
+    # Named windows
+    "SELECT id, SUM(amount) OVER w FROM orders WINDOW w AS (ORDER BY id)",
+    "SELECT id, SUM(amount) OVER w AS total, AVG(amount) OVER w2 FROM orders "
+    "WINDOW w AS (PARTITION BY customer_id ORDER BY id), w2 AS (w)",
+    # CTEs and subquery aliases name sources whose columns aren't in the catalog
+    "WITH totals AS (SELECT customer_id, SUM(amount) AS total FROM orders GROUP BY customer_id) "
+    "SELECT c.customer_name, t.total FROM customers c JOIN totals t ON t.customer_id = c.id",
+    "SELECT s.total FROM (SELECT customer_id, SUM(amount) AS total FROM orders GROUP BY customer_id) AS s",
+    "SELECT c.city, COUNT(*) AS n FROM customers c GROUP BY c.city ORDER BY n DESC",
+    # Quoted identifiers
+    "SELECT `customer_name`, `c`.`city` FROM `customers` AS `c`",
+    "SELECT o.id FROM customers c JOIN orders o USING (id)",
+])
+def test_valid_queries(query):
+    report = validate_query(query, CATALOG)
+    assert report["valid"], report["errors"]
+    assert report["query"] == query
+    assert report["corrections"] == []
+
+
+@pytest.mark.parametrize("query, error", [
+    ("SELECT CONVERT(bogus USING utf8mb4) FROM customers", "unknown column 'bogus'"),
+    ("SELECT id FROM customers ORDER BY bogus COLLATE utf8mb4_bin", "unknown column 'bogus'"),
+    ("SELECT id FROM invoices", "unknown table 'invoices'"),
+    ("SELECT x.id FROM customers c", "unknown table or alias 'x'"),
+    ("SELECT `c`.`bogus` FROM `customers` `c`", "unknown column 'bogus' in table 'customers'"),
+])
+def test_invalid_queries(query, error):
+    report = validate_query(query, CATALOG)
+    assert not report["valid"]
+    assert error in report["errors"]
+
+
+@pytest.mark.parametrize("query, corrected, corrections", [
+    ("SELECT customerName FROM customer",
+     "SELECT customer_name FROM customers",
+     [("table", "customer", "customers"), ("column", "customerName", "customer_name")]),
+    ("SELECT `c`.`cty` FROM customers `c` ORDER BY `c`.`cty` COLLATE utf8mb4_bin",
+     "SELECT `c`.`city` FROM customers `c` ORDER BY `c`.`city` COLLATE utf8mb4_bin",
+     [("column", "cty", "city"), ("column", "cty", "city")]),
+    ("WITH t AS (SELECT customer_id FROM ordrs) SELECT customer_id FROM t",
+     "WITH t AS (SELECT customer_id FROM orders) SELECT customer_id FROM t",
+     [("table", "ordrs", "orders")]),
+])
+def test_near_misses_are_corrected(query, corrected, corrections):
+    report = validate_query(query, CATALOG)
+    assert report["valid"], report["errors"]
+    assert report["query"] == corrected
+    assert [(c["kind"], c["from"], c["to"]) for c in report["corrections"]] == corrections
+
+
+def test_use_is_rejected():
+    # A USE would switch a pooled connection's database without the pool knowing
+    report = validate_query("USE other_db", CATALOG)
+    assert not report["valid"]
+    assert report["errors"] == ["USE statements are not allowed; the database is chosen in the app"]
@@ -0,0 +1,88 @@
+import pytest
+
+from write_batch import plan_script
+
+
+def test_single_row_inserts_become_one_multi_row_insert():
+    steps = plan_script(
+        "INSERT INTO offices (code, city) VALUES ('8', 'Oslo');"
+        "INSERT INTO offices (code, city) VALUES ('9', 'Rome');"
+    )
+    assert steps == [{
+        "sql": "INSERT INTO offices (code, city) VALUES ('8', 'Oslo'), ('9', 'Rome')",
+        "statements": 2,
+        "batched": True,
+    }]
+
+
+def test_updates_by_key_become_one_case_update():
+    steps = plan_script(
+        "UPDATE customers SET creditLimit = 100 WHERE customerNumber = 103;"
+        "UPDATE customers SET creditLimit = 200 WHERE customerNumber = 112;"
+    )
+    assert steps == [{
+        "sql": "UPDATE customers SET creditLimit = CASE customerNumber WHEN 103 THEN 100 WHEN 112 THEN 200 END "
+               "WHERE customerNumber IN (103, 112)",
+        "statements": 2,
+        "batched": True,
+    }]
+
+
+def test_deletes_by_key_become_one_in_list_delete():
+    steps = plan_script("DELETE FROM payments WHERE checkNumber = 'A1'; DELETE FROM payments WHERE checkNumber = 'B2';")
+    assert steps == [{
+        "sql": "DELETE FROM payments WHERE checkNumber IN ('A1', 'B2')",
+        "statements": 2,
+        "batched": True,
+    }]
+
+
+def test_updates_of_the_same_row_stay_in_order():
+    steps = plan_script(
+        "UPDATE customers SET creditLimit = 1 WHERE customerNumber = 103;"
+        "UPDATE customers SET creditLimit = 2 WHERE customerNumber = 103;"
+    )
+    assert [step["sql"] for step in steps] == [
+        "UPDATE customers SET creditLimit = 1 WHERE customerNumber = 103",
+        "UPDATE customers SET creditLimit = 2 WHERE customerNumber = 103",
+    ]
+
+
+@pytest.mark.parametrize("first, second", [
+    ("103", "'103'"),
+    ("'103'", "103.0"),
+    ("'103'", "' 0103'"),
+    ("-5", "'-5'"),
+    ("'ABC'", "'abc '"),
+])
+def test_updates_of_the_same_row_written_differently_stay_in_order(first, second):
+    steps = plan_script(
+        f"UPDATE customers SET creditLimit = 1 WHERE customerNumber = {first};"
+        f"UPDATE customers SET creditLimit = 2 WHERE customerNumber = {second};"
+    )
+    assert [step["batched"] for step in steps] == [False, False]
+
+
+def test_updates_of_different_rows_still_batch():
+    steps = plan_script(
+        "UPDATE customers SET creditLimit = 1 WHERE customerNumber = '103';"
+        "UPDATE customers SET creditLimit = 2 WHERE customerNumber = 112;"
+        "UPDATE customers SET creditLimit = 3 WHERE customerNumber = 'abc';"
+    )
+    assert [(step["statements"], step["batched"]) for step in steps] == [(3, True)]
+
+
+def test_other_statements_run_as_written_and_split_batches():
+    steps = plan_script(
+        "INSERT INTO offices (code) VALUES ('8');"
+        "UPDATE offices SET city = 'Oslo' WHERE city IS NULL;"
+        "INSERT INTO offices (code) VALUES ('9');"
+        "INSERT INTO offices (code) SELECT code FROM offices;"
+    )
+    assert [(step["statements"], step["batched"]) for step in steps] == [(1, False)] * 4
+
+
+def test_batches_are_capped(monkeypatch):
+    monkeypatch.setattr("write_batch.WRITE_BATCH_ROWS", 2)
+    steps = plan_script("".join(f"INSERT INTO t (a) VALUES ({i});" for i in range(5)))
+    assert [step["statements"] for step in steps] == [2, 2, 1]